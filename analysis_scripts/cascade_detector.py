@@ -0,0 +1,130 @@
+import argparse
+import time
+import jsonlines
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+
+def _truth_tag(truth_entry: dict) -> bool:
+    # same rule as metric_calculation.py: "do not know" answers count as hallucinations
+    if "tag" in truth_entry and truth_entry["tag"] == "do not know":
+        return True
+    return truth_entry["ground_truth"]
+
+
+def _make_checker(name: str):
+    """
+    Returns a function entry -> (hallucination probability in [0, 1], seconds spent).
+    The baselines pull in heavy dependencies, so they are only imported when a checker is called live.
+    """
+    if name == "factscore":
+        from baseline.factscore_evaluator import FactScoreEvaluator
+
+        def _check(entry: dict) -> tuple[float, float]:
+            start = time.time()
+            # FactScore: a higher score means less hallucination
+            _, init_score = FactScoreEvaluator(db_id=str(entry["id"])).get_single_fact_score(entry["generations"][0],
+                                                                                          entry["doc_chunk"])
+            return 1 - init_score, time.time() - start
+    else:
+        from baseline.selfcheckgpt_evaluator import SelfCheckGPT
+        selfcheck, option = SelfCheckGPT(), name.split("-")[1].upper()
+
+        def _check(entry: dict) -> tuple[float, float]:
+            start = time.time()
+            _, avg_score = selfcheck.evaluate(entry["generations"][0], entry["generations"][1:], option=option)
+            return float(avg_score), time.time() - start
+    return _check
+
+
+def _load_checker_results(path: str, name: str) -> dict:
+    """
+    Recorded checker outputs (e.g. results/fact_score_result_test.jsonl) keyed by id, as (probability, seconds).
+    """
+    results = dict()
+    with jsonlines.open(path, "r") as reader:
+        for entry in reader:
+            prob = 1 - entry["init_score"] if name == "factscore" else entry["avg_score"]
+            results[entry["id"]] = (prob, entry["time"])
+    return results
+
+
+def cascade_scores(hallupaq_scores: np.ndarray, checker_probs: np.ndarray, threshold: float, band: float) -> np.ndarray:
+    """
+    Scores outside [threshold - band, threshold + band] are kept. Inside the band, the checker's hallucination
+    probability is mapped linearly onto the band, so the cascade score stays monotone with both detectors.
+    """
+    low, high = threshold - band, threshold + band
+    escalated = (hallupaq_scores >= low) & (hallupaq_scores <= high)
+    return np.where(escalated, low + (high - low) * checker_probs, hallupaq_scores)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Score with HalluPAQ and escalate only the uncertain items to FactScore or SelfCheckGPT.")
+    parser.add_argument("rag_output", help="Path to the simulated RAG output, tagged by hallupaq_tagging.py unless --index_dir is given.")
+    parser.add_argument("ground_truth", help="Path to the ground truth JSONL file, e.g. PAQ/test_ground_truth.jsonl.")
+    parser.add_argument("threshold", type=float, help="Threshold for confidence score; larger confidence score means less confident.")
+    parser.add_argument("--band", nargs="+", default=[0.1], type=float,
+                        help="Half-widths of the uncertainty band around the threshold; several values are compared.")
+    parser.add_argument("--checker", default="factscore", choices=["factscore", "selfcheckgpt-nli", "selfcheckgpt-llm"],
+                        help="Detector called for the items inside the band.")
+    parser.add_argument("--checker_results", required=False,
+                        help="Recorded checker outputs (e.g. results/fact_score_result_test.jsonl) used instead of live calls.")
+    parser.add_argument("--index_dir", required=False, help="Re-score the questions with this HalluPAQ index and time it.")
+    parser.add_argument("--hallupaq_latency", default=0.00455, type=float,
+                        help="Per-item HalluPAQ latency assumed when scores are read from the input file.")
+    parser.add_argument("--output_file", required=False, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    with jsonlines.open(args.rag_output, "r") as rag_reader, jsonlines.open(args.ground_truth, "r") as truth_reader:
+        entries, truth_tags = [], []
+        # simulated_rag.py starts its output with a null line
+        for rag_entry, truth_entry in zip((entry for entry in rag_reader.iter(allow_none=True) if entry), truth_reader):
+            assert rag_entry["id"] == truth_entry["id"]
+            entries.append(rag_entry)
+            truth_tags.append(_truth_tag(truth_entry))
+
+    if args.index_dir:
+        from hallupaq import HalluPAQScorer
+        scorer = HalluPAQScorer.load(args.index_dir)
+        hallupaq_scores, hallupaq_times = [], []
+        for entry in entries:
+            start = time.time()
+            hallupaq_scores.append(float(scorer.score_batch([entry["question"]])[1][0, 0]))
+            hallupaq_times.append(time.time() - start)
+        hallupaq_scores, hallupaq_times = np.array(hallupaq_scores), np.array(hallupaq_times)
+    else:
+        hallupaq_scores = np.array([entry["score"] for entry in entries])
+        hallupaq_times = np.full(len(entries), args.hallupaq_latency)
+
+    recorded = _load_checker_results(args.checker_results, args.checker) if args.checker_results else None
+    check = None
+    checked = dict()  # entry index -> (probability, seconds), shared by all bands
+
+    lines = [f"HalluPAQ only: ROC-AUC {roc_auc_score(truth_tags, hallupaq_scores):.5f}, "
+             f"mean latency {hallupaq_times.mean():.5f}s, p95 latency {np.percentile(hallupaq_times, 95):.5f}s",
+             f"{'Band':>8} {'Escalated':>10} {'ROC-AUC':>8} {'Mean (s)':>9} {'p95 (s)':>9}"]
+    for band in args.band:
+        escalated = np.flatnonzero(np.abs(hallupaq_scores - args.threshold) <= band)
+        for i in escalated:
+            if i in checked:
+                continue
+            if recorded is not None:
+                checked[i] = recorded[entries[i]["id"]]
+            else:
+                check = check or _make_checker(args.checker)
+                checked[i] = check(entries[i])
+
+        checker_probs, latencies = np.zeros(len(entries)), hallupaq_times.copy()
+        for i in escalated:
+            checker_probs[i] = checked[i][0]
+            latencies[i] += checked[i][1]
+        scores = cascade_scores(hallupaq_scores, checker_probs, args.threshold, band)
+        lines.append(f"{band:>8.4f} {len(escalated) / len(entries):>9.2%} {roc_auc_score(truth_tags, scores):>8.5f} "
+                     f"{latencies.mean():>9.5f} {np.percentile(latencies, 95):>9.5f}")
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            print(report, file=f)
@@ -2,8 +2,10 @@ import argparse
 import jsonlines
 from openai import OpenAI
 from concurrent.futures import ThreadPoolExecutor
+from hallupaq.generation_cache import GenerationCache, cached_chat_completion
 
 _OPENAI_KEY, _ERROR_FILE = "", ""
+_GENERATION_CACHE = None
 
 
 def _send_covered_request(entry):
@@ -14,7 +16,7 @@ def _send_covered_request(entry):
     client = OpenAI(api_key=_OPENAI_KEY)
     entry_id, question, true_answer, generated_answer = entry["id"], entry["question"], entry["answer"], entry["generations"][0]
 
-    response = client.chat.completions.create(
+    content = cached_chat_completion(_GENERATION_CACHE, client,
         model="gpt-4-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant who can tell if ANSWER2 provides the same "
@@ -23,7 +25,7 @@ def _send_covered_request(entry):
         ],
         max_tokens=10
     )
-    ground_truth = response.choices[0].message.content.strip().lower().replace(".", "")
+    ground_truth = content.strip().lower().replace(".", "")
 
     if ground_truth == "true" or ground_truth == "false":
         entry["ground_truth"] = True if ground_truth == "false" else False
@@ -42,7 +44,7 @@ def _send_pubmed_request(entry):
     client = OpenAI(api_key=_OPENAI_KEY)
     entry_id, question, true_answer, generated_answer = entry["id"], entry["question"], entry["answer"], entry["generations"][0]
 
-    response = client.chat.completions.create(
+    content = cached_chat_completion(_GENERATION_CACHE, client,
         model="gpt-4-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant who can tell if ANSWER2 provides the same "
@@ -53,7 +55,7 @@ def _send_pubmed_request(entry):
         ],
         max_tokens=10
     )
-    tag = response.choices[0].message.content.strip().lower().replace(".", "")
+    tag = content.strip().lower().replace(".", "")
 
     if tag == "match" or tag == "not match" or tag == "do not know":
         entry["tag"] = tag
@@ -73,7 +75,7 @@ def _send_surreal_request(entry):
     client = OpenAI(api_key=_OPENAI_KEY)
     entry_id, question, generated_answer = entry["id"], entry["question"], entry["generations"][0]
 
-    response = client.chat.completions.create(
+    content = cached_chat_completion(_GENERATION_CACHE, client,
         model="gpt-4-turbo",
         messages=[
             {"role": "system", "content": "Given a QUESTION that involves a non-existent concept or unrelated "
@@ -90,7 +92,7 @@ def _send_surreal_request(entry):
         ],
         max_tokens=10
     )
-    tag = response.choices[0].message.content.strip().lower().replace(".", "").replace("(", "").replace(")", "")
+    tag = content.strip().lower().replace(".", "").replace("(", "").replace(")", "")
 
     if tag == "1" or tag == "2":
         entry["tag"] = "tricked" if tag == "1" else "not trickek"
@@ -119,8 +121,16 @@ if __name__ == "__main__":
     parser.add_argument("error_output_file", help="Path to put entries that encountered problem.")
     parser.add_argument("openai_api_key", help="OpenAI API key.")
     parser.add_argument("--n_threads", default=4, type=int, help="Number of threads to send requests")
+    parser.add_argument("--generation_cache", required=False, type=str,
+                        help="SQLite file caching GPT responses by request, so reruns skip the requests already made.")
+    parser.add_argument("--generation_cache_mode", default="readwrite", choices=GenerationCache.MODES,
+                        help="readonly: do not store new responses; replay: fail entries whose responses are not cached.")
+    parser.add_argument("--generation_cache_mb", default=1024, type=int, help="Size of the generation cache before eviction, in MB.")
     args = parser.parse_args()
     _OPENAI_KEY, _ERROR_FILE = args.openai_api_key, args.error_output_file
+    if args.generation_cache:
+        _GENERATION_CACHE = GenerationCache(args.generation_cache, args.generation_cache_mode,
+                                            max_bytes=args.generation_cache_mb << 20)
     pool = ThreadPoolExecutor(max_workers=args.n_threads)
 
     with jsonlines.open(args.input_file, "r") as reader:
@@ -139,3 +149,6 @@ if __name__ == "__main__":
 
         with jsonlines.open(args.output_file, "a") as writer:
             writer.write_all(results)
+
+    if _GENERATION_CACHE is not None:
+        print(f"Generation cache: {_GENERATION_CACHE.stats()}")
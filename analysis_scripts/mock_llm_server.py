@@ -0,0 +1,336 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+# number of parameters of every latency distribution, e.g. "lognormal:0.8,0.4"
+LATENCY_DISTRIBUTIONS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+DEFAULT_TEMPLATE = "Mock answer {index} from {model}."
+_SAGEMAKER_PATH = re.compile(r"^/endpoints/([^/]+)/invocations$")
+_OPENAI_PATHS = ("/v1/chat/completions", "/chat/completions")
+
+
+def parse_latency(spec: str) -> tuple[str, list[float]]:
+    """
+    Parse a latency distribution in seconds: "fixed:S", "uniform:LOW,HIGH", "normal:MEAN,STD" (clipped at 0),
+    "lognormal:MEDIAN,SIGMA" or "exponential:MEAN".
+    """
+    name, _, params = spec.partition(":")
+    if name not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution {name}; expected one of {tuple(LATENCY_DISTRIBUTIONS)}")
+    values = [float(value) for value in params.split(",")] if params else []
+    if len(values) != LATENCY_DISTRIBUTIONS[name]:
+        raise ValueError(f"Latency distribution {name} takes {LATENCY_DISTRIBUTIONS[name]} parameters, got {spec}")
+    return name, values
+
+
+def _tokens(text: str) -> int:
+    # same estimate as PromptBatcher in simulated_rag.py: about four characters per token
+    return math.ceil(len(text) / 4)
+
+
+class MockLLM:
+    """
+    Behaviour of the stand-in endpoint, shared by the SageMaker and OpenAI routes of `make_server`.
+
+    A request first passes the failure injection: a token bucket of `rate_limit` requests per second (burst
+    `burst`) and random throttles with probability `throttle_rate` are rejected as rate limited, and random
+    server errors with probability `error_rate`; rejected requests return at once. An accepted request waits for
+    one of `slots` serving slots (0: unlimited), which models a single GPU working through its queue, then
+    sleeps a latency drawn from `latency` plus `item_latency` per dialog or choice and `token_latency` per token
+    of its longest reply.
+
+    Every reply is the content of the first `canned` rule whose regex `pattern` matches the last user message
+    (a list of contents is sampled from), or else `template`. {prompt}, {system}, {model} and {index} (the
+    dialog or choice number) are substituted in both. Replies are cut to the requested max tokens.
+    """
+
+    def __init__(self, latency: str = "fixed:0", item_latency: float = 0.0, token_latency: float = 0.0,
+                 slots: int = 0, error_rate: float = 0.0, throttle_rate: float = 0.0, rate_limit: float = 0.0,
+                 burst: float = None, template: str = DEFAULT_TEMPLATE, canned: list[dict] = None, seed: int = None):
+        self.latency = parse_latency(latency)
+        self.item_latency = item_latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.burst = burst if burst is not None else max(1.0, rate_limit)
+        self.template = template
+        self.canned = [(re.compile(rule["pattern"]), rule["content"]) for rule in canned or []]
+        self._slots = threading.Semaphore(slots) if slots else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bucket, self._bucket_time = self.burst, time.time()
+        self._stats = dict()
+
+    @classmethod
+    def load_canned(cls, path: str) -> list[dict]:
+        """
+        Read canned replies from a JSONL file of {"pattern": regex, "content": str or list of str} rules.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _count(self, route: str, **counts):
+        with self._lock:
+            stats = self._stats.setdefault(route, {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0,
+                                                   "bad_requests": 0, "items": 0, "busy_seconds": 0.0})
+            for name, count in counts.items():
+                stats[name] += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {route: dict(stats) for route, stats in self._stats.items()}
+
+    def reject(self) -> tuple[str, float]:
+        """
+        The injected failure of a new request ("rate_limited" or "error", or None) and the seconds until the
+        token bucket admits the next request.
+        """
+        with self._lock:
+            if self.rate_limit:
+                now = time.time()
+                self._bucket = min(self.burst, self._bucket + (now - self._bucket_time) * self.rate_limit)
+                self._bucket_time = now
+                if self._bucket < 1:
+                    return "rate_limited", (1 - self._bucket) / self.rate_limit
+                self._bucket -= 1
+            draw = self._random.random()
+        if draw < self.throttle_rate:
+            return "rate_limited", 0.0
+        if draw < self.throttle_rate + self.error_rate:
+            return "error", 0.0
+        return None, 0.0
+
+    def _sample_latency(self) -> float:
+        name, values = self.latency
+        with self._lock:
+            if name == "fixed":
+                return values[0]
+            if name == "uniform":
+                return self._random.uniform(*values)
+            if name == "normal":
+                return max(0.0, self._random.gauss(*values))
+            if name == "lognormal":
+                return self._random.lognormvariate(math.log(values[0]), values[1])
+            return self._random.expovariate(1 / values[0])
+
+    def reply(self, messages: list[dict], model: str, index: int, max_tokens: int = None) -> str:
+        prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        content = self.template
+        for pattern, rule_content in self.canned:
+            if pattern.search(prompt):
+                content = rule_content
+                if isinstance(content, list):
+                    with self._lock:
+                        content = self._random.choice(content)
+                break
+        for field, value in (("{prompt}", prompt), ("{system}", system), ("{model}", model), ("{index}", str(index))):
+            content = content.replace(field, value)
+        if max_tokens is not None:
+            content = content[:4 * max_tokens]
+        return content
+
+    def serve(self, route: str, replies: list[str]):
+        """
+        Hold an accepted request for its simulated latency.
+        """
+        delay = (self._sample_latency() + self.item_latency * len(replies) +
+                 self.token_latency * max((_tokens(reply) for reply in replies), default=0))
+        if self._slots is not None:
+            with self._slots:
+                time.sleep(delay)
+        else:
+            time.sleep(delay)
+        self._count(route, ok=1, items=len(replies), busy_seconds=delay)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # keep-alive, like the real endpoints
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _respond(self, status: int, body, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ("/ping", "/health"):
+            self._respond(200, {"status": "ok"})
+        elif path == "/stats":
+            self._respond(200, self.server.mock.stats())
+        else:
+            self._respond(404, {"message": f"Unknown path {path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        match = _SAGEMAKER_PATH.match(path)
+        if match:
+            self._sagemaker(match.group(1), body)
+        elif path in _OPENAI_PATHS:
+            self._openai(body)
+        else:
+            self._respond(404, {"message": f"Unknown path {path}"})
+
+    def _sagemaker(self, endpoint_name: str, body: bytes):
+        """
+        The invoke_endpoint contract of the Llama-2 chat JumpStart container used by `SageMakerLlama27B`:
+        {"inputs": [dialog, ...], "parameters": {...}} -> [{"generation": {"role", "content"}}, ...].
+        A string input is answered like the text-generation container, [{"generated_text": ...}].
+        """
+        mock = self.server.mock
+        mock._count("sagemaker", requests=1)
+        try:
+            payload = json.loads(body)
+            inputs = payload["inputs"]
+            max_tokens = payload.get("parameters", dict()).get("max_new_tokens", 256)
+            if isinstance(inputs, str):
+                dialogs = [[{"role": "user", "content": inputs}]]
+            else:
+                # a single dialog is a list of messages, a batch is a list of dialogs
+                dialogs = [inputs] if inputs and isinstance(inputs[0], dict) else inputs
+            replies = [mock.reply(dialog, endpoint_name, i, max_tokens) for i, dialog in enumerate(dialogs)]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            mock._count("sagemaker", bad_requests=1)
+            self._respond(400, {"message": f"Invalid payload: {e}"}, {"x-amzn-ErrorType": "ValidationError"})
+            return
+
+        failure, _ = mock.reject()
+        if failure == "rate_limited":
+            mock._count("sagemaker", rate_limited=1)
+            self._respond(400, {"message": "Rate exceeded"}, {"x-amzn-ErrorType": "ThrottlingException"})
+            return
+        if failure == "error":
+            mock._count("sagemaker", errors=1)
+            self._respond(500, {"message": "Injected failure"}, {"x-amzn-ErrorType": "InternalFailure"})
+            return
+
+        mock.serve("sagemaker", replies)
+        if isinstance(inputs, str):
+            self._respond(200, [{"generated_text": replies[0]}])
+        else:
+            self._respond(200, [{"generation": {"role": "assistant", "content": reply}} for reply in replies])
+
+    def _openai(self, body: bytes):
+        """
+        The chat-completions API: model, messages, n and max_tokens are honoured, other parameters are ignored.
+        """
+        mock = self.server.mock
+        mock._count("openai", requests=1)
+        try:
+            payload = json.loads(body)
+            model, messages = payload["model"], payload["messages"]
+            max_tokens = payload.get("max_tokens") or payload.get("max_completion_tokens")
+            replies = [mock.reply(messages, model, i, max_tokens) for i in range(payload.get("n") or 1)]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            mock._count("openai", bad_requests=1)
+            self._respond(400, {"error": {"message": f"Invalid request: {e}", "type": "invalid_request_error",
+                                          "param": None, "code": None}})
+            return
+
+        failure, retry_after = mock.reject()
+        if failure == "rate_limited":
+            mock._count("openai", rate_limited=1)
+            headers = {"retry-after-ms": str(math.ceil(1000 * retry_after))} if retry_after else None
+            self._respond(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                          "param": None, "code": "rate_limit_exceeded"}}, headers)
+            return
+        if failure == "error":
+            mock._count("openai", errors=1)
+            self._respond(500, {"error": {"message": "Injected failure", "type": "server_error",
+                                          "param": None, "code": None}})
+            return
+
+        mock.serve("openai", replies)
+        prompt_tokens = sum(_tokens(message.get("content") or "") for message in messages)
+        completion_tokens = sum(_tokens(reply) for reply in replies)
+        finish_reason = "stop"
+        if max_tokens is not None and any(_tokens(reply) >= max_tokens for reply in replies):
+            finish_reason = "length"
+        self._respond(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": i, "message": {"role": "assistant", "content": reply},
+                         "logprobs": None, "finish_reason": finish_reason} for i, reply in enumerate(replies)],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class _MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # load tests open many connections at once; the socketserver default backlog is 5
+    request_queue_size = 1024
+
+
+def make_server(mock: MockLLM, host: str = "127.0.0.1", port: int = 8080, verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    A threaded HTTP server answering SageMaker `invoke_endpoint` (POST /endpoints/<name>/invocations) and
+    OpenAI chat-completions (POST /v1/chat/completions) requests with `mock`; GET /stats returns the counters.
+    Port 0 picks a free port (see `server.server_address`). Call `serve_forever` to start it.
+    """
+    server = _MockServer((host, port), _MockHandler)
+    server.mock = mock
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Local stand-in for the SageMaker Llama-2 endpoint and the OpenAI chat-completions "
+                                     "API, for offline throughput benchmarking.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", default=8080, type=int, help="Port to listen on.")
+    parser.add_argument("--latency", default="fixed:0", type=str,
+                        help="Base latency distribution in seconds: fixed:S, uniform:LOW,HIGH, normal:MEAN,STD, "
+                             "lognormal:MEDIAN,SIGMA or exponential:MEAN.")
+    parser.add_argument("--item_latency", default=0.0, type=float, help="Seconds added per dialog (SageMaker) or choice (OpenAI).")
+    parser.add_argument("--token_latency", default=0.0, type=float, help="Seconds added per token of the longest reply.")
+    parser.add_argument("--slots", default=0, type=int, help="Requests served at once; others queue (0: unlimited).")
+    parser.add_argument("--error_rate", default=0.0, type=float, help="Fraction of requests failing with a server error.")
+    parser.add_argument("--throttle_rate", default=0.0, type=float, help="Fraction of requests randomly rejected as rate limited.")
+    parser.add_argument("--rate_limit", default=0.0, type=float, help="Requests per second admitted by a token bucket (0: no limit).")
+    parser.add_argument("--burst", default=None, type=float, help="Token bucket size; defaults to max(1, rate_limit).")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, type=str,
+                        help="Reply template; {prompt}, {system}, {model} and {index} are substituted.")
+    parser.add_argument("--canned", required=False, type=str,
+                        help='JSONL of {"pattern": regex, "content": reply or list of replies} rules matched against '
+                             'the last user message before falling back to --template.')
+    parser.add_argument("--seed", default=None, type=int, help="Seed of the latency, failure and reply sampling.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    mock = MockLLM(args.latency, args.item_latency, args.token_latency, args.slots, args.error_rate,
+                   args.throttle_rate, args.rate_limit, args.burst, args.template,
+                   MockLLM.load_canned(args.canned) if args.canned else None, args.seed)
+    server = make_server(mock, args.host, args.port, args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Mock LLM endpoint listening on http://{host}:{port} "
+          f"(SageMaker: /endpoints/<name>/invocations, OpenAI: /v1/chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(mock.stats(), indent=4))
@@ -1,15 +1,36 @@
 import argparse
-from collections import deque
 import jsonlines
 from sagemaker.jumpstart.model import JumpStartModel
 import sagemaker
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
 import json
-from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+import queue
+import random
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
 from rank_bm25 import BM25Okapi
 import time
 import traceback
 from pprint import pp
+from hallupaq import HalluPAQScorer
+from hallupaq.bm25 import BM25Index, process_corpus as _process_corpus
+from hallupaq.bm25_builder import source_fingerprint as _source_fingerprint
+from hallupaq.dense_retrieval import DenseChunkIndex, hybrid_search
+from hallupaq.generation_cache import GenerationCache
+from hallupaq.latency import StageTimer
+from hallupaq.retrieval_cache import RetrievalCache
+from hallupaq.text import normalize_text as _normalize_text
+
+
+LOW_CONFIDENCE_RESPONSE = "I am not confident enough to answer this question."
+
+# latency of every stage of the run (see --stage_times), summarized at exit
+_STAGES = StageTimer()
 
 
 PROMPT_TEMPLATE = \
@@ -26,12 +47,89 @@ def _build_llama2_prompt(context, question):
     return PROMPT_TEMPLATE.replace("{context}", context).replace("{question}", question)
 
 
+class SageMakerRuntimePool:
+    """
+    One SageMaker runtime client shared by all threads. botocore clients are thread-safe and keep a pool of
+    keep-alive HTTP connections, sized here to `max_connections` (the number of requests in flight), so a
+    request reuses a warm TLS connection instead of building a client, resolving credentials and connecting.
+
+    Throttling, server and connection errors are retried up to `max_attempts` times in total, sleeping a
+    random time up to min(max_delay, base_delay * 2^retry) in between (full jitter); botocore's own retries
+    are disabled so every attempt is counted here. `stats` reports requests, retries and connection reuse.
+    """
+
+    RETRYABLE_CODES = ("ThrottlingException", "Throttling", "TooManyRequestsException", "ServiceUnavailable",
+                       "InternalFailure", "RequestLimitExceeded")
+
+    def __init__(self, endpoint_url: str = None, max_connections: int = 10, connect_timeout: float = 10,
+                 read_timeout: float = 120, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 20):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        config = Config(max_pool_connections=max_connections, connect_timeout=connect_timeout,
+                        read_timeout=read_timeout, retries={"total_max_attempts": 1})
+        # a session of our own: creating clients from boto3's default session is not thread-safe
+        self.client = boto3.session.Session().client("runtime.sagemaker", endpoint_url=endpoint_url, config=config)
+        self.n_requests, self.n_retries, self.n_failed = 0, 0, 0
+        self._lock = threading.Lock()
+
+    def _retryable(self, e: Exception) -> bool:
+        if isinstance(e, (BotocoreConnectionError, HTTPClientError)):
+            return True
+        if isinstance(e, ClientError):
+            error = e.response.get("Error", dict())
+            status = e.response.get("ResponseMetadata", dict()).get("HTTPStatusCode", 0)
+            return error.get("Code") in self.RETRYABLE_CODES or status == 429 or status >= 500
+        return False
+
+    def invoke(self, endpoint_name: str, body: bytes) -> bytes:
+        """
+        Response body of one invoke_endpoint call with a JSON payload.
+        """
+        for attempt in range(self.max_attempts):
+            with self._lock:
+                self.n_requests += 1
+            try:
+                response = self.client.invoke_endpoint(EndpointName=endpoint_name,
+                                                       ContentType="application/json",
+                                                       CustomAttributes='accept_eula=true',
+                                                       Body=body)
+                return response["Body"].read()
+            except Exception as e:
+                if attempt + 1 == self.max_attempts or not self._retryable(e):
+                    with self._lock:
+                        self.n_failed += 1
+                    raise
+                with self._lock:
+                    self.n_retries += 1
+            with _STAGES.span("retry_wait"):
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def stats(self) -> dict:
+        stats = {"requests": self.n_requests, "retries": self.n_retries, "failed": self.n_failed}
+        # urllib3 counts connections per host pool; botocore does not expose them publicly
+        manager = getattr(getattr(self.client._endpoint, "http_session", None), "_manager", None)
+        if manager is not None:
+            pools = [manager.pools[key] for key in manager.pools.keys()]
+            opened = sum(pool.num_connections for pool in pools)
+            sent = sum(pool.num_requests for pool in pools)
+            stats.update({"connections_opened": opened, "connections_reused": max(sent - opened, 0),
+                          "reuse_rate": (sent - opened) / sent if sent else 0.0})
+        return stats
+
+
 class SageMakerLlama27B:
+    MODEL_ID = "meta-textgeneration-llama-2-7b-f"
+    # SageMaker runtime URL override, e.g. a local analysis_scripts/mock_llm_server.py
+    endpoint_url = None
+    # shared runtime client, created on first use unless set up with `configure_runtime`
+    _runtime = None
+    _runtime_lock = threading.Lock()
 
     def __init__(self, sagemaker_arn_role, sagemaker_endpoint_name):
         self.role = sagemaker_arn_role
         self.endpoint_name = sagemaker_endpoint_name
-        llama_model = JumpStartModel(model_id="meta-textgeneration-llama-2-7b-f", model_version="2.*", role=self.role)
+        llama_model = JumpStartModel(model_id=self.MODEL_ID, model_version="2.*", role=self.role)
         print("Deploying Llama-2 7B Chat to SageMaker...")
         llama_model.deploy(initial_instance_count=1,
                            instance_type="ml.g5.2xlarge",
@@ -48,6 +146,22 @@ class SageMakerLlama27B:
         sagemaker_session.delete_endpoint(endpoint_name)
         sagemaker_session.delete_endpoint_config(endpoint_name)
 
+    @classmethod
+    def configure_runtime(cls, **kwargs) -> SageMakerRuntimePool:
+        """
+        (Re)create the shared runtime client with `SageMakerRuntimePool` arguments, e.g. max_connections.
+        """
+        with cls._runtime_lock:
+            cls._runtime = SageMakerRuntimePool(cls.endpoint_url, **kwargs)
+        return cls._runtime
+
+    @classmethod
+    def runtime(cls) -> SageMakerRuntimePool:
+        with cls._runtime_lock:
+            if cls._runtime is None:
+                cls._runtime = SageMakerRuntimePool(cls.endpoint_url)
+            return cls._runtime
+
     @classmethod
     def prompt(cls, endpoint_name: str, question: str, context: str, repeats: int, max_new_tokens: int = 256,
                top_p: float = 0.9, temperature: float = 0.6, print_prompt=False) -> list[str]:
@@ -56,75 +170,380 @@ class SageMakerLlama27B:
         if print_prompt:
             print(prompt)
 
-        payload = {
-            "inputs": prompt,
+        with _STAGES.span("prompt"):
+            dialogs = [cls.dialog(question, context)] * repeats
+        return cls.invoke(endpoint_name, dialogs, max_new_tokens, top_p, temperature)
 
-        }
+    @staticmethod
+    def dialog(question: str, context: str) -> list[dict]:
+        return [
+            {"role": "system", "content": "You are a helpful assistant who answers questions on biomedical "
+                                          "queries. Please provide an ANSWER to the QUESTION based on the "
+                                          "information given in CONTEXT. Please just provide a short answer."},
+            {"role": "user", "content": f"CONTEXT: {context}\nQUESTION: {question}\nANSWER:"}
+        ]
 
+    @classmethod
+    def request(cls, question: str, context: str, max_new_tokens: int = 256, top_p: float = 0.9,
+                temperature: float = 0.6) -> dict:
+        """
+        Description of one generation for `hallupaq.generation_cache.GenerationCache`.
+        """
+        return {"model": cls.MODEL_ID, "endpoint_url": cls.endpoint_url, "inputs": cls.dialog(question, context),
+                "parameters": {"max_new_tokens": max_new_tokens, "top_p": top_p, "temperature": temperature}}
+
+    @classmethod
+    def invoke(cls, endpoint_name: str, dialogs: list[list[dict]], max_new_tokens: int = 256, top_p: float = 0.9,
+               temperature: float = 0.6) -> list[str]:
+        """
+        One invoke_endpoint call generating a reply to every dialog, in order.
+        """
         payload = {
-            "inputs": [
-                [
-                    {"role": "system", "content": "You are a helpful assistant who answers questions on biomedical "
-                                                  "queries. Please provide an ANSWER to the QUESTION based on the "
-                                                  "information given in CONTEXT. Please just provide a short answer."},
-                    {"role": "user", "content": f"CONTEXT: {context}\nQUESTION: {question}\nANSWER:"}
-                ]
-            ] * repeats,
+            "inputs": dialogs,
             "parameters": {"max_new_tokens": max_new_tokens,
                            "top_p": top_p,
                            "temperature": temperature,
                            "return_full_text": False}
         }
 
-        runtime = boto3.client("runtime.sagemaker")
-        payload = json.dumps(payload, indent=4).encode("utf-8")
-        response = runtime.invoke_endpoint(EndpointName=endpoint_name,
-                                           ContentType="application/json",
-                                           CustomAttributes='accept_eula=true',
-                                           Body=payload)
-        response_body = json.loads(response["Body"].read())
-        generations = [e["generation"]["content"].strip() for e in response_body]
+        runtime = cls.runtime()
+        with _STAGES.span("encode"):
+            payload = json.dumps(payload, indent=4).encode("utf-8")
+        with _STAGES.span("network"):
+            response_body = runtime.invoke(endpoint_name, payload)
+        with _STAGES.span("decode"):
+            generations = [e["generation"]["content"].strip() for e in json.loads(response_body)]
         return generations
 
-def _process_corpus(corpus: list[str]) -> tuple[list[str], list[list[str]]]:
-    org_corpus_set = set()
-    org_corpus = deque()
-    tokenized_corpus = deque()
-    for doc in corpus:
-        if doc in org_corpus_set:
-            continue
-
-        tokenized_doc = _normalize_text(doc)
-        tokenized_corpus.append(tokenized_doc)
-        org_corpus.append(doc)
-        org_corpus_set.add(doc)
-
-    return list(org_corpus), list(tokenized_corpus)
 
-
-def _normalize_text(doc):
-    punctuations = "`~!@#$%^&*()_+[]\\;',./{}|:\"<>?"
-    d = doc.lower()
-    for punc in punctuations:
-        d = d.replace(punc, "")
-    tokenized_doc = d.split()
-    return tokenized_doc
+class PromptBatcher:
+    """
+    Packs the dialogs of several entries into one `SageMakerLlama27B.invoke` call. Threads call `prompt` like
+    `SageMakerLlama27B.prompt` and block until their replies are back. A dispatcher thread collects pending
+    requests for up to `max_wait` seconds, or until `max_dialogs` dialogs or `max_tokens` estimated tokens
+    (prompt characters / 4 plus `max_new_tokens` per dialog) are reached. The endpoint answers the dialogs in
+    order, so the replies are split back by position. At most `max_in_flight` batched requests run at once.
+    An entry larger than the budget is sent on its own. A failed request fails every entry in it.
+    """
+
+    def __init__(self, endpoint_name: str, max_dialogs: int = 32, max_tokens: int = 16384, max_wait: float = 0.05,
+                 max_in_flight: int = 2, max_new_tokens: int = 256, top_p: float = 0.9, temperature: float = 0.6):
+        self.endpoint_name = endpoint_name
+        self.max_dialogs = max_dialogs
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+        self.max_new_tokens = max_new_tokens
+        self.top_p = top_p
+        self.temperature = temperature
+        self.n_requests, self.n_dialogs = 0, 0
+        self._stats_lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._dispatcher = threading.Thread(target=self._dispatch, name="prompt-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def _tokens(self, dialogs: list[list[dict]]) -> int:
+        return sum(sum(len(message["content"]) for message in dialog) // 4 + self.max_new_tokens
+                   for dialog in dialogs)
+
+    def prompt(self, question: str, context: str, repeats: int) -> list[str]:
+        future = Future()
+        with _STAGES.span("prompt"):
+            dialogs = [SageMakerLlama27B.dialog(question, context)] * repeats
+        self._requests.put((dialogs, self._tokens(dialogs), future))
+        return future.result()
+
+    def _dispatch(self):
+        carried, closing = None, False
+        while not closing:
+            first = carried or self._requests.get()
+            carried = None
+            if first is None:
+                break
+            batch, n_dialogs, n_tokens = [first], len(first[0]), first[1]
+            deadline = time.time() + self.max_wait
+            while n_dialogs < self.max_dialogs:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                if n_dialogs + len(request[0]) > self.max_dialogs or n_tokens + request[1] > self.max_tokens:
+                    carried = request
+                    break
+                batch.append(request)
+                n_dialogs, n_tokens = n_dialogs + len(request[0]), n_tokens + request[1]
+            self._in_flight.acquire()
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch: list[tuple]):
+        try:
+            dialogs = [dialog for request_dialogs, _, _ in batch for dialog in request_dialogs]
+            generations = SageMakerLlama27B.invoke(self.endpoint_name, dialogs, self.max_new_tokens, self.top_p,
+                                                   self.temperature)
+            if len(generations) != len(dialogs):
+                raise ValueError(f"Endpoint returned {len(generations)} generations for {len(dialogs)} dialogs")
+            with self._stats_lock:
+                self.n_requests += 1
+                self.n_dialogs += len(dialogs)
+            position = 0
+            for request_dialogs, _, future in batch:
+                future.set_result(generations[position: position + len(request_dialogs)])
+                position += len(request_dialogs)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+        finally:
+            self._in_flight.release()
+
+    def close(self):
+        self._requests.put(None)
+        self._dispatcher.join()
+        self._pool.shutdown()
+
+
+def ordered_pipeline(entries, process, write, on_error, concurrency: int = 1, max_pending: int = None):
+    """
+    Run `process` on every entry with at most `concurrency` calls in flight and pass the results to `write`
+    from a single writer thread, in input order. Reading `entries` blocks while `max_pending` entries
+    (default 4 x concurrency) are read but not written yet, so a slow endpoint applies backpressure instead
+    of buffering the whole input. An exception raised for one entry is handed to `on_error(entry, exception)`,
+    called inside the except block, and the entry is skipped; the other entries continue.
+    """
+    pending = threading.Semaphore(max_pending or 4 * concurrency)
+    ordered = queue.Queue()
+
+    def _writer():
+        while True:
+            item = ordered.get()
+            if item is None:
+                return
+            entry, future = item
+            try:
+                write(future.result())
+            except Exception as e:
+                on_error(entry, e)
+            finally:
+                pending.release()
+
+    writer = threading.Thread(target=_writer, name="ordered-writer")
+    writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for entry in entries:
+                pending.acquire()
+                ordered.put((entry, pool.submit(process, entry)))
+    finally:
+        ordered.put(None)
+        writer.join()
+
+
+def _complete_lines(path: str):
+    """
+    Parsed lines of a JSONL file written one flushed line at a time, with the byte offset after each.
+    A last line cut off by a crash is truncated away; a corrupt line before it raises ValueError.
+    """
+    if not os.path.exists(path):
+        return
+    end = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("unterminated line")
+                value = json.loads(line)
+            except ValueError:
+                if f.read(1):
+                    raise ValueError(f"Corrupt line at byte {end} of {path}")
+                f.truncate(end)
+                return
+            end += len(line)
+            yield value, end
+
+
+def completed_lines(output_jsonl: str, checkpoint: str = None) -> set:
+    """
+    Input line numbers of the entries an interrupted run already wrote to `output_jsonl`, read in one streaming
+    pass over the sidecar `checkpoint` if it exists, otherwise over the output itself. Ids are not unique in the
+    PAQ splits, so entries are tracked by the `input_line` written into every output entry. The checkpoint
+    records the output offset after every entry, so the output is truncated to the last checkpointed entry;
+    entries written after it are generated again instead of appearing twice.
+    """
+    lines = set()
+    if checkpoint is None or not os.path.exists(checkpoint):
+        for entry, _ in _complete_lines(output_jsonl):
+            if entry is not None:  # the output starts with a null line
+                lines.add(entry["input_line"])
+        return lines
+
+    end = 0
+    for record, _ in _complete_lines(checkpoint):
+        lines.add(record["input_line"])
+        end = record["offset"]
+    if os.path.exists(output_jsonl) and os.path.getsize(output_jsonl) > end:
+        with open(output_jsonl, "rb+") as f:
+            f.truncate(end)
+    return lines
+
+
+def restore_input_order(output_jsonl: str, checkpoint: str = None) -> bool:
+    """
+    Rewrite `output_jsonl` with its entries sorted by `input_line`, as an uninterrupted run writes them;
+    retried entries and the entries of a resumed run are appended after the others. Lines are copied as bytes
+    into a temporary file that replaces the output, and the `checkpoint` is regenerated with the new offsets.
+    Both files keep the same entries and size, so a crash between the two replacements still resumes correctly.
+    Returns whether any entry moved.
+    """
+    # (input line, id, start, end) of every output line; the leading null line stays first
+    lines, start = [], 0
+    for entry, end in _complete_lines(output_jsonl):
+        if entry is None:
+            lines.append((-1, None, start, end))
+        else:
+            lines.append((entry["input_line"], entry["id"], start, end))
+        start = end
+    ordered = sorted(lines, key=lambda line: line[0])
+    if ordered == lines:
+        return False
+
+    records = []
+    with open(output_jsonl, "rb") as src, open(output_jsonl + ".tmp", "wb") as dst:
+        for input_line, entry_id, start, end in ordered:
+            src.seek(start)
+            dst.write(src.read(end - start))
+            if input_line >= 0:
+                records.append({"input_line": input_line, "id": entry_id, "offset": dst.tell()})
+    if checkpoint is not None:
+        with open(checkpoint + ".tmp", "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        os.replace(checkpoint + ".tmp", checkpoint)
+    os.replace(output_jsonl + ".tmp", output_jsonl)
+    return True
+
+
+def _gating_report(split_stats: dict, cost_per_hour: float) -> str:
+    """
+    Latency and endpoint cost saved by gating, per split. The time a gated entry would have taken is
+    estimated with the mean generation time of the entries of its split that were generated.
+    """
+    generated_time = sum(stats["generation_time"] for stats in split_stats.values())
+    generated = sum(stats["generated"] for stats in split_stats.values())
+    overall_mean = generated_time / generated if generated else 0.0
+
+    lines = [f"{'Split':<8} {'Entries':>7} {'Gated':>6} {'Mean gen (s)':>12} {'Saved (s)':>10} {'Saved ($)':>10}"]
+    total_saved = 0.0
+    for split, stats in sorted(split_stats.items()):
+        mean_time = stats["generation_time"] / stats["generated"] if stats["generated"] else overall_mean
+        saved = stats["gated"] * mean_time
+        total_saved += saved
+        lines.append(f"{split:<8} {stats['generated'] + stats['gated']:>7} {stats['gated']:>6} {mean_time:>12.3f} "
+                     f"{saved:>10.1f} {saved * cost_per_hour / 3600:>10.4f}")
+    lines.append(f"{'total':<8} {'':>7} {'':>6} {overall_mean:>12.3f} {total_saved:>10.1f} "
+                 f"{total_saved * cost_per_hour / 3600:>10.4f}")
+    return "\n".join(lines)
 
 
 class Retriever(object):
+    """
+    BM25 retriever over the knowledge source. The default backend is an inverted index with top-k pruning
+    (`hallupaq.bm25.BM25Index`) returning the same documents as the exhaustive `rank_bm25` backend.
+    The inverted index is saved next to the knowledge source and memory-mapped, so later launches skip
+    tokenization; it is rebuilt automatically when the knowledge source changes. Documents are read from the
+    index's compressed doc store.
+
+    The "dense" backend ranks chunks by embedding similarity (`hallupaq.dense_retrieval.DenseChunkIndex`,
+    built on first use in `dense_index_dir`), and "hybrid" fuses the top `fusion_depth` BM25 and dense
+    documents with reciprocal rank fusion. `embedder` is any object with `name` and `embed(texts)`.
+
+    With `cache_size` (in-memory LRU entries) and/or `cache_path` (a SQLite file kept across runs), results
+    are cached by `hallupaq.retrieval_cache.RetrievalCache`, keyed by the normalized token tuple (the raw
+    question for the dense and hybrid backends, whose embedder sees it) and the build id of the index, so
+    a rebuilt index invalidates them.
+    """
+
+    BACKENDS = ("inverted", "rank_bm25", "dense", "hybrid")
+
+    def __init__(self, backend: str = "inverted", knowledge_source: str = "knowledge_source/knowledge_source.jsonl",
+                 index_path: str = None, dense_index_dir: str = None, embedder=None, hnsw: bool = False,
+                 fusion_depth: int = 50, cache_size: int = 0, cache_path: str = None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown retriever backend {backend}; expected one of {self.BACKENDS}")
+        self.backend = backend
+        self.fusion_depth = fusion_depth
+        if backend != "rank_bm25":
+            self.bm25 = BM25Index.load_or_build(knowledge_source, index_path)
+            version = self.bm25.build_id
+            if backend in ("dense", "hybrid"):
+                self.dense = DenseChunkIndex.load_or_build(
+                    dense_index_dir or os.path.splitext(knowledge_source)[0] + "_dense", self.bm25, embedder, hnsw=hnsw)
+                version = f"{version}:{self.dense.build_id}:{fusion_depth}"
+        else:
+            docs = []
+            with jsonlines.open(knowledge_source, "r") as reader:
+                for entry in reader:
+                    docs.append(entry["text"])
 
-    def __init__(self):
-        docs = []
-        with jsonlines.open("knowledge_source/knowledge_source.jsonl", "r") as reader:
-            for entry in reader:
-                docs.append(entry["text"])
+            self.org_corpus, self.tokenized_corpus = _process_corpus(docs)
+            self.bm25 = BM25Okapi(self.tokenized_corpus)
+            version = json.dumps(_source_fingerprint(knowledge_source))
 
-        self.org_corpus, self.tokenized_corpus = _process_corpus(docs)
-        self.bm25 = BM25Okapi(self.tokenized_corpus)
+        self.cache = None
+        if cache_size or cache_path:
+            self.cache = RetrievalCache(f"{backend}:{os.path.abspath(knowledge_source)}", version,
+                                        max_memory_entries=cache_size, cache_path=cache_path)
 
     def retrieve(self, question: str):
+        if self.cache is not None:
+            return self.document(self.retrieve_batch([question], 1)[0, 0])
         tokenized_question = _normalize_text(question)
-        return self.bm25.get_top_n(tokenized_question, self.org_corpus, n=1)[0]
+        if self.backend == "rank_bm25":
+            return self.bm25.get_top_n(tokenized_question, self.org_corpus, n=1)[0]
+        if self.backend == "inverted":
+            return self.bm25.document(self.bm25.top_k(tokenized_question, 1)[0][0])
+        return self.bm25.document(self.retrieve_batch([question], 1)[0, 0])
+
+    def retrieve_batch(self, questions: list[str], k: int = 1) -> np.ndarray:
+        """
+        Indices of the top-k documents of every question, shape (len(questions), k); see `document`.
+        The inverted backend scores all questions with sparse matrix products, the dense backend embeds them
+        in batches. Dense and hybrid rows are padded with -1 if fewer than k documents are found.
+        Only questions missing from the cache are searched.
+        """
+        if self.cache is None:
+            return self._search(questions, k)
+        if self.backend in ("dense", "hybrid"):
+            queries = [(question,) for question in questions]
+        else:
+            queries = [tuple(_normalize_text(question)) for question in questions]
+        results, missing = self.cache.get(queries, k)
+        if missing:
+            found = self._search([questions[i] for i in missing], k)
+            self.cache.put([queries[i] for i in missing], k, found)
+            for i, doc_ids in zip(missing, found):
+                results[i] = doc_ids
+        return np.array(results, dtype=np.int64).reshape(len(questions), k)
+
+    def _search(self, questions: list[str], k: int) -> np.ndarray:
+        if self.backend == "dense":
+            return self.dense.search(questions, k)[0]
+        tokenized_questions = [_normalize_text(question) for question in questions]
+        if self.backend == "rank_bm25":
+            return np.array([np.argsort(self.bm25.get_scores(tokenized_question))[::-1][:k]
+                             for tokenized_question in tokenized_questions], dtype=np.int64).reshape(len(questions), k)
+        if self.backend == "inverted":
+            return self.bm25.top_k_batch(tokenized_questions, k)[0]
+        return hybrid_search(self.bm25, self.dense, questions, k, self.fusion_depth)
+
+    def document(self, doc_id: int) -> str:
+        if self.backend == "rank_bm25":
+            return self.org_corpus[doc_id]
+        return self.bm25.document(doc_id)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else dict()
 
 
 if __name__ == "__main__":
@@ -133,14 +552,97 @@ if __name__ == "__main__":
     parser.add_argument("output_jsonl", help="Path to output test result JSONL file.")
     parser.add_argument("--arn_role", required=False, type=str, help="SageMaker ARN role. This will start a SageMaker endpoint if specified")
     parser.add_argument("--shut_down", action="store_true", help="Shut down SageMaker endpoint.")
+    parser.add_argument("--gate_index", required=False, type=str,
+                        help="HalluPAQ index directory. If specified, questions scoring above --gate_threshold are answered "
+                             "with a low-confidence response without calling the endpoint.")
+    parser.add_argument("--gate_threshold", default=None, type=float,
+                        help="Confidence score threshold of the gate; larger confidence score means less confident.")
+    parser.add_argument("--cost_per_hour", default=1.515, type=float,
+                        help="Hourly price of the endpoint instance (ml.g5.2xlarge), used to report the cost saved by gating.")
+    parser.add_argument("--gate_report", required=False, type=str, help="Also write the gating report to this file.")
+    parser.add_argument("--retriever", default="inverted", choices=Retriever.BACKENDS,
+                        help="Retrieval backend: BM25 (inverted or rank_bm25), dense chunk embeddings, or their hybrid.")
+    parser.add_argument("--dense_index", required=False, type=str,
+                        help="Directory of the dense chunk index; defaults to knowledge_source/knowledge_source_dense.")
+    parser.add_argument("--retrieval_cache_size", default=0, type=int, help="Number of retrieval results kept in the in-memory LRU.")
+    parser.add_argument("--retrieval_cache", required=False, type=str, help="SQLite file persisting retrieval results across runs.")
+    parser.add_argument("--concurrency", default=1, type=int, help="Number of entries processed (endpoint requests in flight) at once.")
+    parser.add_argument("--max_pending", default=None, type=int,
+                        help="Entries read but not yet written before reading the input pauses; defaults to 4 x concurrency.")
+    parser.add_argument("--batch_dialogs", default=0, type=int,
+                        help="Pack the dialogs of concurrent entries into endpoint requests of up to this many dialogs (0: one request per entry).")
+    parser.add_argument("--batch_tokens", default=16384, type=int, help="Estimated token budget (prompts + new tokens) of a batched request.")
+    parser.add_argument("--batch_wait", default=0.05, type=float, help="Seconds a batched request waits for more entries.")
+    parser.add_argument("--batch_in_flight", default=None, type=int,
+                        help="Batched requests sent to the endpoint at once; defaults to --concurrency.")
+    parser.add_argument("--endpoint_url", required=False, type=str,
+                        help="SageMaker runtime URL to send requests to instead of AWS, e.g. http://127.0.0.1:8080 "
+                             "for analysis_scripts/mock_llm_server.py.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Append to an existing output, skipping the entries it (or --checkpoint) already holds.")
+    parser.add_argument("--checkpoint", required=False, type=str,
+                        help="Sidecar file recording the input line, id and output offset of every written entry, read by --resume.")
+    parser.add_argument("--retries", default=1, type=int, help="Rounds of retrying the entries that failed.")
+    parser.add_argument("--retry_wait", default=10.0, type=float, help="Seconds to wait before each retry round.")
+    parser.add_argument("--failed_jsonl", required=False, type=str,
+                        help="Where entries still failing after the retries are written; defaults to <output>_failed.jsonl.")
+    parser.add_argument("--generation_cache", required=False, type=str,
+                        help="SQLite file caching generations by prompt, model, sampling parameters and sample index.")
+    parser.add_argument("--generation_cache_mode", default="readwrite", choices=GenerationCache.MODES,
+                        help="readonly: do not store new generations; replay: also fail entries whose generations are not cached.")
+    parser.add_argument("--generation_cache_mb", default=1024, type=int, help="Size of the generation cache before eviction, in MB.")
+    parser.add_argument("--stage_times", action="store_true",
+                        help="Write the seconds spent per stage (retrieval, prompt, encode, network, ...) into every output entry.")
+    parser.add_argument("--stage_report", required=False, type=str, help="Also write the per-stage latency summary to this file.")
+    parser.add_argument("--max_connections", default=None, type=int,
+                        help="Keep-alive connections to the endpoint; defaults to max(10, concurrency).")
+    parser.add_argument("--connect_timeout", default=10, type=float, help="Endpoint connection timeout in seconds.")
+    parser.add_argument("--read_timeout", default=120, type=float, help="Endpoint read timeout in seconds.")
+    parser.add_argument("--max_attempts", default=5, type=int,
+                        help="Attempts per endpoint request; throttling, server and connection errors are retried with jittered backoff.")
     args = parser.parse_args()
+    if args.gate_index and args.gate_threshold is None:
+        parser.error("--gate_index requires --gate_threshold")
 
+    SageMakerLlama27B.endpoint_url = args.endpoint_url
+    runtime = SageMakerLlama27B.configure_runtime(max_connections=args.max_connections or max(10, args.concurrency),
+                                                  connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                                                  max_attempts=args.max_attempts)
     if args.arn_role: SageMakerLlama27B(args.arn_role, "hw4-endpoint")
-    pool = ThreadPoolExecutor(max_workers=2)
-    retriever = Retriever()
-    total_entries, completed_entries = 0, 0
-
-    def _process_one_entry(entry: dict):
+    batcher = None
+    if args.batch_dialogs:
+        batcher = PromptBatcher("hw4-endpoint", max_dialogs=args.batch_dialogs, max_tokens=args.batch_tokens,
+                                max_wait=args.batch_wait, max_in_flight=args.batch_in_flight or args.concurrency)
+    generation_cache = None
+    if args.generation_cache:
+        generation_cache = GenerationCache(args.generation_cache, args.generation_cache_mode,
+                                           max_bytes=args.generation_cache_mb << 20)
+    retriever = Retriever(args.retriever, dense_index_dir=args.dense_index, cache_size=args.retrieval_cache_size,
+                          cache_path=args.retrieval_cache)
+    total_entries, completed_entries, skipped_entries = 0, 0, 0
+    done_lines = completed_lines(args.output_jsonl, args.checkpoint) if args.resume else set()
+    failed_entries = []
+    retried = False
+    scorer = None
+    if args.gate_index:
+        scorer = HalluPAQScorer.load(args.gate_index, exact_match=True)
+    split_stats = dict()
+    # entries are processed by worker threads; the counters and statistics they share are guarded
+    stats_lock, scorer_lock, counter_lock = threading.Lock(), threading.Lock(), threading.Lock()
+
+    def _generate(question: str, context: str, repeats: int) -> list[str]:
+        if batcher is not None:
+            prompt = batcher.prompt
+        else:
+            def prompt(question, context, repeats):
+                return SageMakerLlama27B.prompt("hw4-endpoint", question, context, repeats)
+        if generation_cache is None:
+            return prompt(question, context, repeats)
+        # only the samples missing from the cache are generated
+        return generation_cache.fetch([SageMakerLlama27B.request(question, context)] * repeats,
+                                      lambda missing: prompt(question, context, len(missing)))
+
+    def _process_one_entry(entry: dict) -> dict:
         NUM_GENERATIONS = 4
         # tag entry with split info
         if isinstance(entry["id"], str) and "pubmed" in entry["id"]:
@@ -150,37 +652,131 @@ if __name__ == "__main__":
         else:
             entry["split"] = "covered"
 
-        # run retrieval if not covered
-        if entry["split"] != "covered":
-            entry["doc_chunk"] = retriever.retrieve(entry["question"])
-
-        start = time.time()
-        entry["generations"] = SageMakerLlama27B.prompt("hw4-endpoint", entry["question"], entry["doc_chunk"], NUM_GENERATIONS)
-        entry["generation_time"] = time.time() - start
-
-        with jsonlines.open(args.output_jsonl, "a") as writer:
-            writer.write(entry)
-
-        global completed_entries, total_entries
-        completed_entries += 1
-        print(f"Processed {completed_entries}/{total_entries}")
-
-    with jsonlines.open(args.output_jsonl, "w") as writer:
-        writer.write(None)
-    futures = []
-    with jsonlines.open(args.input_jsonl, "r") as reader:
-        for entry in reader:
-            total_entries += 1
-            # futures.append(pool.submit(_process_one_entry, entry))
-            try:
-                _process_one_entry(entry)
-            except Exception as e:
-                entry_id = entry["id"]
-                print(f"entry {entry_id} failed.")
-                print(e)
-                traceback.print_exc()
-
-        # for future in futures:
-        #     future.result()
+        with stats_lock:
+            stats = split_stats.setdefault(entry["split"], {"generated": 0, "gated": 0, "generation_time": 0.0})
+
+        # gate on the HalluPAQ confidence score before paying for retrieval and generation
+        if scorer is not None:
+            start = time.time()
+            with _STAGES.span("gating"), scorer_lock:
+                entry["score"] = float(scorer.score_batch([entry["question"]])[1][0, 0])
+            entry["gated"] = entry["score"] > args.gate_threshold
+            entry["gating_time"] = time.time() - start
+
+        if scorer is not None and entry["gated"]:
+            entry["generations"] = [LOW_CONFIDENCE_RESPONSE] * NUM_GENERATIONS
+            entry["generation_time"] = 0.0
+            with stats_lock:
+                stats["gated"] += 1
+        else:
+            # run retrieval if not covered
+            if entry["split"] != "covered":
+                with _STAGES.span("retrieval"):
+                    entry["doc_chunk"] = retriever.retrieve(entry["question"])
+
+            start = time.time()
+            with _STAGES.span("generation"):
+                entry["generations"] = _generate(entry["question"], entry["doc_chunk"], NUM_GENERATIONS)
+            entry["generation_time"] = time.time() - start
+            with stats_lock:
+                stats["generated"] += 1
+                stats["generation_time"] += entry["generation_time"]
+        return entry
+
+    def _timed_entry(entry: dict) -> dict:
+        # spans of a batched request run on the batcher's threads and only reach the summary
+        with _STAGES.collect() as stage_times:
+            with _STAGES.span("entry"):
+                entry = _process_one_entry(entry)
+        if args.stage_times:
+            entry["stage_times"] = stage_times
+        return entry
+
+    def _read_entries(reader):
+        global total_entries, skipped_entries
+        for input_line, entry in enumerate(reader):
+            if input_line in done_lines:
+                skipped_entries += 1
+                continue
+            entry["input_line"] = input_line
+            with counter_lock:
+                total_entries += 1
+            yield entry
+
+    def _write_entry(entry: dict):
+        # only called from the single writer thread, in input order
+        with _STAGES.span("write"):
+            output_writer.write(entry)
+            if checkpoint_file is not None:
+                checkpoint_file.write(json.dumps({"input_line": entry["input_line"], "id": entry["id"],
+                                                  "offset": output_file.tell()}) + "\n")
+                checkpoint_file.flush()
+        global completed_entries
+        with counter_lock:
+            completed_entries += 1
+            print(f"Processed {completed_entries}/{total_entries}")
+
+    def _entry_failed(entry: dict, e: Exception):
+        entry_id = entry["id"]
+        print(f"entry {entry_id} failed.")
+        print(e)
+        traceback.print_exc()
+        failed_entries.append(entry)
+
+    if not args.resume:
+        with jsonlines.open(args.output_jsonl, "w") as writer:
+            writer.write(None)
+        if args.checkpoint:
+            open(args.checkpoint, "w").close()
+    with jsonlines.open(args.input_jsonl, "r") as reader, open(args.output_jsonl, "a") as output_file, \
+            jsonlines.Writer(output_file, flush=True) as output_writer, \
+            (open(args.checkpoint, "a") if args.checkpoint else nullcontext()) as checkpoint_file:
+        ordered_pipeline(_read_entries(reader), _timed_entry, _write_entry, _entry_failed,
+                         concurrency=args.concurrency, max_pending=args.max_pending)
+        if skipped_entries:
+            print(f"Skipped {skipped_entries} entries completed by a previous run")
+
+        # failed entries are retried after the pass and appended after the others, then put back in input order
+        for attempt in range(args.retries):
+            if not failed_entries:
+                break
+            retry_entries = list(failed_entries)
+            failed_entries.clear()
+            retried = True
+            print(f"Retrying {len(retry_entries)} failed entries in {args.retry_wait}s ({attempt + 1}/{args.retries})")
+            time.sleep(args.retry_wait)
+            ordered_pipeline(iter(retry_entries), _timed_entry, _write_entry, _entry_failed,
+                             concurrency=args.concurrency, max_pending=args.max_pending)
+    # only retried entries and resumed runs append out of input order
+    if (retried or skipped_entries) and restore_input_order(args.output_jsonl, args.checkpoint):
+        print(f"Rewrote {args.output_jsonl} in input order")
+
+    if failed_entries:
+        failed_jsonl = args.failed_jsonl or os.path.splitext(args.output_jsonl)[0] + "_failed.jsonl"
+        with jsonlines.open(failed_jsonl, "w") as writer:
+            writer.write_all(failed_entries)
+        print(f"{len(failed_entries)} entries still failed; written to {failed_jsonl}. Rerun with --resume to retry them.")
+
+    if batcher is not None:
+        batcher.close()
+        print(f"Endpoint requests: {batcher.n_requests} for {batcher.n_dialogs} dialogs "
+              f"({batcher.n_dialogs / max(batcher.n_requests, 1):.1f} per request)")
+    print(f"Endpoint client: {runtime.stats()}")
+    stage_report = _STAGES.summary()
+    print(stage_report)
+    if args.stage_report:
+        with open(args.stage_report, "w") as f:
+            print(stage_report, file=f)
+    if generation_cache is not None:
+        print(f"Generation cache: {generation_cache.stats()}")
+        generation_cache.close()
+    if retriever.cache is not None:
+        print(f"Retrieval cache: {retriever.cache_stats()}")
+    if scorer is not None:
+        report = _gating_report(split_stats, args.cost_per_hour)
+        print(report)
+        if args.gate_report:
+            with open(args.gate_report, "w") as f:
+                print(report, file=f)
 
     if args.shut_down: SageMakerLlama27B.shut_down("hw4-endpoint")
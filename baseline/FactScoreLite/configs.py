@@ -14,6 +14,12 @@ max_tokens = 1024
 temp = 0.7
 model_name = "gpt-3.5-turbo"
 
+# Generation cache (hallupaq.generation_cache.GenerationCache) shared by all agents of the process
+# SQLite file, or None to disable; mode is "readwrite", "readonly" or "replay"
+generation_cache_path = None
+generation_cache_mode = "readwrite"
+generation_cache_max_bytes = 1 << 30
+
 # Database path
 # Current folder
 # current_folder = Path(__file__).parent
@@ -5,8 +5,29 @@ from openai import (
 import time
 import logging
 import random
+import threading
 from . import configs
 
+_generation_cache = None
+_generation_cache_lock = threading.Lock()
+
+
+def _shared_generation_cache():
+    """
+    The generation cache configured in `configs`, opened once per process: FactScore creates agents per
+    evaluator and thread.
+    """
+    global _generation_cache
+    if configs.generation_cache_path is None:
+        return None
+    # the cache lives in the hallupaq package; run from the repository root with PYTHONPATH=. to use it
+    from hallupaq.generation_cache import GenerationCache
+    with _generation_cache_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache(configs.generation_cache_path, configs.generation_cache_mode,
+                                                max_bytes=configs.generation_cache_max_bytes)
+    return _generation_cache
+
 
 # define a retry decorator
 def retry_with_exponential_backoff(
@@ -67,16 +88,20 @@ class OpenAIAgent:
         self.max_tokens = configs.max_tokens
         self.temp = configs.temp
         self.model_name = configs.model_name
+        self.generation_cache = _shared_generation_cache()
 
     @retry_with_exponential_backoff
     def generate(self, prompt):
-        response = self.client.chat.completions.create(
+        kwargs = dict(
             model=self.model_name,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=self.max_tokens,
             temperature=self.temp,
         )
-        return response.choices[0].message.content
+        if self.generation_cache is None:
+            return self.client.chat.completions.create(**kwargs).choices[0].message.content
+        from hallupaq.generation_cache import cached_chat_completion
+        return cached_chat_completion(self.generation_cache, self.client, **kwargs)
 
 
 # Ensure proper logging configuration
@@ -1,4 +1,5 @@
 from baseline.factscore_evaluator import FactScoreEvaluator
+import argparse
 import json
 from tqdm import tqdm
 import time
@@ -10,7 +11,7 @@ def task(entry):
     id = entry["id"]
     question = entry["question"]
     answer = entry["answer"]
-    doc = retriever.retrieve(question)
+    doc = entry["retrieved_doc"]
     covered = entry["covered"]
     start_time = time.time()
     factscore = FactScoreEvaluator(db_id = str(id))
@@ -30,12 +31,23 @@ def task(entry):
     f.write(json.dumps(record) + "\n")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser("FactScore of the validation answers against their retrieved documents.")
+    parser.add_argument("--retrieval_cache", required=False, type=str,
+                        help="SQLite file persisting retrieval results across runs; not cached on disk by default.")
+    args = parser.parse_args()
     file_path = "PAQ/validation.jsonl"
     data = read_jsonl(file_path)
     print(f"Total number of entries: {len(data)}")
     n_worker = 3
     executor = ThreadPoolExecutor(max_workers=n_worker)
-    retriever = Retriever()
+    # with --retrieval_cache, reruns read the retrieved documents back from the cache file
+    retriever = Retriever(cache_path=args.retrieval_cache)
+    # retrieve for all questions at once instead of once per task
+    doc_ids = retriever.retrieve_batch([entry["question"] for entry in data], k=1)
+    for entry, doc_id in zip(data, doc_ids[:, 0]):
+        entry["retrieved_doc"] = retriever.document(doc_id)
+    if retriever.cache is not None:
+        print(f"Retrieval cache: {retriever.cache_stats()}")
     score = []
     avg_score = []
 
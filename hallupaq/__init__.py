@@ -0,0 +1,15 @@
+from .hnsw import HNSWIndex
+from .flat import FlatIndex
+from .paq_index import PAQIndex
+from .store import EmbeddingStore
+from .quantization import ScalarQuantizer, ProductQuantizer, QuantizedIndex
+from .sharded import ShardedIndex, build_shards
+from .bm25 import BM25Index
+from .dense_retrieval import DenseChunkIndex
+from .embedder import Embedder, DEFAULT_MODEL
+from .exact_match import ExactMatchTable
+from .embedding_cache import CachedEmbedder
+from .retrieval_cache import RetrievalCache
+from .generation_cache import GenerationCache
+from .latency import LatencyHistogram, StageTimer
+from .scorer import HalluPAQScorer
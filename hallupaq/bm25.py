@@ -0,0 +1,344 @@
+import json
+import os
+import zlib
+from collections import Counter, deque
+import numpy as np
+import scipy.sparse as sp
+from .bm25_builder import MAGIC, BM25Builder, build_index_file, data_start, source_fingerprint
+from .postings import BLOCK_SIZE, decode_blocks
+from .text import normalize_text
+
+
+def process_corpus(corpus: list[str]) -> tuple[list[str], list[list[str]]]:
+    """
+    Drop repeated documents (first copy wins) and tokenize the rest with `normalize_text`.
+    """
+    org_corpus_set = set()
+    org_corpus = deque()
+    tokenized_corpus = deque()
+    for doc in corpus:
+        if doc in org_corpus_set:
+            continue
+
+        tokenized_doc = normalize_text(doc)
+        tokenized_corpus.append(tokenized_doc)
+        org_corpus.append(doc)
+        org_corpus_set.add(doc)
+
+    return list(org_corpus), list(tokenized_corpus)
+
+
+class _SortedVocabulary:
+    """
+    Read-only term -> id map over a memory-mapped, sorted blob of UTF-8 terms; lookups are binary searches,
+    so opening it costs nothing regardless of the vocabulary size.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        # memoryviews index without numpy's per-item overhead
+        self.blob = memoryview(np.ascontiguousarray(blob, dtype=np.uint8))
+        self.offsets = memoryview(np.ascontiguousarray(offsets, dtype=np.int64)).cast("B").cast("q")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _term(self, term_id: int) -> bytes:
+        return bytes(self.blob[self.offsets[term_id]: self.offsets[term_id + 1]])
+
+    def get(self, term: str, default: int = -1) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self._term(lo) == key else default
+
+
+class BM25Index:
+    """
+    Inverted-index BM25 scoring exactly like `rank_bm25.BM25Okapi`, without touching every document per query.
+
+    Postings are stored term-major and compressed (`hallupaq.postings`): the postings of every term are cut into
+    blocks of `BLOCK_SIZE` varint-coded document gaps and term frequencies, with the byte range and the last
+    document of every block kept as skip entries. Queries are evaluated term-at-a-time with MaxScore pruning
+    (Turtle & Flood, 1995): terms are visited by decreasing score upper bound, and once the bounds of the
+    unvisited terms cannot lift a new document above the current k-th score, only the blocks that may hold a
+    surviving candidate are decoded. Survivors are re-scored in query order so that scores are bit-identical to
+    rank_bm25; ties at the top are resolved like rank_bm25 by sorting the full score vector.
+
+    An index built from a JSONL knowledge source (`load_or_build`) is one binary file: a JSON header followed by
+    aligned arrays (sorted vocabulary, compressed postings and skip entries, document lengths and norms, and a
+    doc store of zlib-compressed texts addressed by byte offsets), all memory-mapped when loaded. It is built
+    by `hallupaq.bm25_builder` with memory bounded independently of the corpus size.
+    """
+
+    def __init__(self, vocabulary: "_SortedVocabulary", arrays: dict, avgdl: float, k1: float = 1.5, b: float = 0.75,
+                 source: dict = None, build_id: str = None):
+        self.vocabulary = vocabulary
+        self.idf = arrays["idf"]
+        self.max_weights = arrays["max_weights"]
+        self.df = arrays["df"]
+        self.term_blocks = arrays["term_blocks"]
+        self.block_last_doc = arrays["block_last_doc"]
+        self.block_offsets = arrays["block_offsets"]
+        self.postings = arrays["postings"]
+        self.doc_len = arrays["doc_len"]
+        self.norm = arrays["norm"]
+        self.documents = arrays.get("documents")
+        self.doc_offsets = arrays.get("doc_offsets")
+        self.avgdl = avgdl
+        self.k1 = k1
+        self.b = b
+        self.source = source  # fingerprint of the knowledge source of an index built by load_or_build
+        self.build_id = build_id
+        self._term_doc_weights = None
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, tokenized_corpus: list[list[str]], k1: float = 1.5, b: float = 0.75,
+              epsilon: float = 0.25) -> "BM25Index":
+        """
+        In-memory index over already tokenized documents (no doc store).
+        """
+        builder = BM25Builder()
+        for document in tokenized_corpus:
+            builder.add(document)
+        arrays, avgdl = builder.finish(k1, b, epsilon)
+        return cls(_SortedVocabulary(arrays["vocab_blob"], arrays["vocab_offsets"]), arrays, avgdl, k1, b)
+
+    def _weights(self, tfs: np.ndarray, docs: np.ndarray) -> np.ndarray:
+        tfs = np.asarray(tfs, dtype=np.int64)
+        return tfs * (self.k1 + 1) / (tfs + self.norm[docs])
+
+    def _decode(self, term: int, blocks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # `blocks` are increasing block numbers within the term
+        first = self.term_blocks[term]
+        counts = np.minimum(self.df[term] - blocks * BLOCK_SIZE, BLOCK_SIZE)
+        bases = np.where(blocks > 0, self.block_last_doc[first + blocks - 1], 0)
+        starts, ends = self.block_offsets[first + blocks], self.block_offsets[first + blocks + 1]
+        if len(blocks) and ends[-1] - starts[0] == (ends - starts).sum():
+            data = self.postings[starts[0]:ends[-1]]
+        else:
+            lengths = ends - starts
+            data = self.postings[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())]
+        return decode_blocks(data, counts, bases)
+
+    def _postings(self, term: int) -> tuple[np.ndarray, np.ndarray]:
+        return self._decode(term, np.arange(self.term_blocks[term + 1] - self.term_blocks[term]))
+
+    def _lookup(self, term: int, candidates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Which of the sorted `candidates` contain the term, and their term frequencies. Only the blocks whose
+        skip entries admit a candidate are decoded.
+        """
+        last_docs = self.block_last_doc[self.term_blocks[term]:self.term_blocks[term + 1]]
+        blocks = np.unique(np.searchsorted(last_docs, candidates))
+        docs, tfs = self._decode(term, blocks[blocks < len(last_docs)])
+        positions = np.searchsorted(docs, candidates)
+        hit = positions < len(docs)
+        hit[hit] = docs[positions[hit]] == candidates[hit]
+        return hit, tfs[positions[hit]]
+
+    def _term_ids(self, tokens: list[str]) -> list[int]:
+        # query order and repeats matter: BM25Okapi adds one contribution per query token
+        term_ids = [self.vocabulary.get(token, -1) for token in tokens]
+        return [term for term in term_ids if term >= 0 and self.idf[term] != 0]
+
+    def scores(self, tokens: list[str]) -> np.ndarray:
+        """
+        Scores of all documents, identical to `BM25Okapi.get_scores`.
+        """
+        score = np.zeros(len(self))
+        for term in self._term_ids(tokens):
+            docs, tfs = self._postings(term)
+            q_freq = np.zeros(len(self), dtype=np.int64)
+            q_freq[docs] = tfs
+            score += self.idf[term] * (q_freq * (self.k1 + 1) / (q_freq + self.norm))
+        return score
+
+    def _exhaustive_top_k(self, tokens: list[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        scores = self.scores(tokens)
+        top_k = np.argsort(scores)[::-1][:k]
+        return top_k, scores[top_k]
+
+    def top_k(self, tokens: list[str], k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Indices and scores of the k best documents, in the order `BM25Okapi.get_top_n` returns them.
+        """
+        term_ids = self._term_ids(tokens)
+        if not term_ids or (self.idf[term_ids] < 0).any():
+            # no match, or negative contributions: upper bounds do not hold
+            return self._exhaustive_top_k(tokens, k)
+
+        counts = Counter(term_ids)
+        bounds = {term: count * self.idf[term] * self.max_weights[term] for term, count in counts.items()}
+        remaining = sum(bounds.values())
+        candidates, partial, threshold, closed = None, None, -np.inf, False
+        for term in sorted(bounds, key=bounds.get, reverse=True):
+            remaining -= bounds[term]
+            scale = counts[term] * self.idf[term]
+            if closed:
+                hit, tfs = self._lookup(term, candidates)
+                partial[hit] += scale * self._weights(tfs, candidates[hit])
+            else:
+                docs, tfs = self._postings(term)
+                if candidates is None:
+                    candidates, partial = docs, scale * self._weights(tfs, docs)
+                else:
+                    merged, inverse = np.unique(np.concatenate([candidates, docs]), return_inverse=True)
+                    partial = np.bincount(inverse, np.concatenate([partial, scale * self._weights(tfs, docs)]),
+                                          minlength=len(merged))
+                    candidates = merged
+
+            if len(candidates) >= k:
+                threshold = np.partition(partial, len(partial) - k)[len(partial) - k]
+            # partial sums run in a different order than the final scores, so keep a safety margin for rounding
+            margin = 1e-9 * (1 + abs(threshold))
+            closed = closed or remaining < threshold - margin
+            if closed:
+                keep = partial + remaining >= threshold - margin
+                candidates, partial = candidates[keep], partial[keep]
+
+        if len(candidates) < k:
+            # the top-k includes documents without any query term
+            return self._exhaustive_top_k(tokens, k)
+        exact = np.zeros(len(candidates))
+        for term in term_ids:
+            hit, tfs = self._lookup(term, candidates)
+            exact[hit] += self.idf[term] * self._weights(tfs, candidates[hit])
+
+        order = np.argsort(-exact, kind="stable")[:k + 1]
+        ranked = exact[order]
+        if (ranked[1:] == ranked[:-1]).any():
+            return self._exhaustive_top_k(tokens, k)
+        return candidates[order[:k]], ranked[:k]
+
+    @property
+    def term_doc_weights(self) -> sp.csr_matrix:
+        """
+        Sparse (terms x documents) matrix of the BM25 term-frequency weights, decoded on first use from the postings.
+        """
+        if self._term_doc_weights is None:
+            n_blocks = len(self.block_last_doc)
+            term_of = np.repeat(np.arange(len(self.df)), np.diff(self.term_blocks))
+            block_in_term = np.arange(n_blocks) - self.term_blocks[term_of]
+            counts = np.minimum(self.df[term_of] - block_in_term * BLOCK_SIZE, BLOCK_SIZE)
+            bases = np.where(block_in_term > 0, self.block_last_doc[np.maximum(np.arange(n_blocks) - 1, 0)], 0)
+            docs, tfs = decode_blocks(self.postings, counts, bases)
+            self._term_doc_weights = sp.csr_matrix(
+                (self._weights(tfs, docs), docs, np.concatenate([[0], np.cumsum(self.df)])),
+                shape=(len(self.df), len(self)))
+        return self._term_doc_weights
+
+    def top_k_batch(self, token_lists: list[list[str]], k: int = 1,
+                    max_nonzeros: int = 20000000) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k document indices and scores of many queries, scored with sparse products (query x term idf weights
+        times the term x document weights). Queries are processed in chunks whose score matrix holds at most
+        about `max_nonzeros` entries. Rows where the sparse sums cannot separate the top-k from rounding noise
+        (ties, fewer than k matching documents, negative idf) are answered by `top_k`, so results equal `top_k`.
+        """
+        labels = np.zeros((len(token_lists), k), dtype=np.int64)
+        scores = np.zeros((len(token_lists), k))
+        term_lists = [self._term_ids(tokens) for tokens in token_lists]
+        costs = [int(self.df[term_ids].sum()) for term_ids in term_lists]
+
+        start = 0
+        while start < len(term_lists):
+            end, budget = start + 1, costs[start]
+            while end < len(term_lists) and budget + costs[end] <= max_nonzeros:
+                budget += costs[end]
+                end += 1
+            chunk = term_lists[start:end]
+            rows = np.repeat(np.arange(len(chunk)), [len(term_ids) for term_ids in chunk])
+            cols = np.array([t for term_ids in chunk for t in term_ids], dtype=np.int64)
+            queries = sp.csr_matrix((self.idf[cols], (rows, cols)), shape=(len(chunk), len(self.df)))
+            product = (queries @ self.term_doc_weights).tocsr()
+
+            # best k + 1 entries per row; documents without an entry score 0
+            ranked = np.zeros((len(chunk), k + 1))
+            ranked_labels = np.full((len(chunk), k + 1), -1, dtype=np.int64)
+            n_matched = np.diff(product.indptr)
+            for i in range(len(chunk)):
+                row_scores = product.data[product.indptr[i]: product.indptr[i + 1]]
+                n_top = min(k + 1, len(row_scores))
+                if n_top == 0:
+                    continue
+                top = np.argpartition(-row_scores, n_top - 1)[:n_top]
+                top = top[np.argsort(-row_scores[top], kind="stable")]
+                ranked[i, :n_top] = row_scores[top]
+                ranked_labels[i, :n_top] = product.indices[product.indptr[i] + top]
+
+            margin = 1e-9 * (1 + np.abs(ranked[:, :1]))
+            ambiguous = (n_matched < k) | (ranked[:, :k] - ranked[:, 1:] <= margin).any(axis=1)
+            ambiguous |= np.array([(self.idf[term_ids] < 0).any() if term_ids else True for term_ids in chunk])
+            labels[start:end] = ranked_labels[:, :k]
+            scores[start:end] = ranked[:, :k]
+            for i in np.flatnonzero(ambiguous):
+                labels[start + i], scores[start + i] = self.top_k(token_lists[start + i], k)
+            start = end
+        return labels, scores
+
+    def document(self, doc_id: int) -> str:
+        """
+        Text of a document, from the doc store of an index built by `load_or_build`.
+        """
+        if self.documents is None:
+            raise ValueError("This BM25 index has no doc store; build it with load_or_build")
+        start, end = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        return zlib.decompress(self.documents[start:end]).decode("utf-8", "surrogatepass")
+
+    @staticmethod
+    def _read_header(path: str) -> tuple[dict, int]:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a BM25 index file of the current format")
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len))
+        return header, data_start(header_len)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        header, start = cls._read_header(path)
+        arrays = dict()
+        for name, spec in header["arrays"].items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                # plain ndarray views of the map: same lazily paged memory, cheaper indexing
+                arrays[name] = np.asarray(np.memmap(path, dtype=dtype, mode="r", offset=start + spec["offset"],
+                                                    shape=shape))
+        return cls(_SortedVocabulary(arrays["vocab_blob"], arrays["vocab_offsets"]), arrays, header["avgdl"],
+                   header["k1"], header["b"], header["source"], header["build_id"])
+
+    @classmethod
+    def is_stale(cls, path: str, source: str) -> bool:
+        """
+        Whether `path` is missing, in an older format, or was built from a different version of `source`.
+        """
+        if not os.path.exists(path):
+            return True
+        try:
+            header, _ = cls._read_header(path)
+        except ValueError:
+            return True
+        return "build_id" not in header or header["source"] != source_fingerprint(source)
+
+    @classmethod
+    def load_or_build(cls, source: str, path: str = None, max_postings: int = 1 << 24,
+                      n_workers: int = None) -> "BM25Index":
+        """
+        Load the index saved next to `source` (`<source>.bm25` by default), rebuilding it first if the
+        source JSONL changed since it was built. The build tokenizes with `n_workers` processes (all cores by
+        default) and holds at most about `max_postings` postings in memory.
+        """
+        path = path or os.path.splitext(source)[0] + ".bm25"
+        if cls.is_stale(path, source):
+            build_index_file(source, path, max_postings=max_postings, n_workers=n_workers)
+        return cls.load(path)
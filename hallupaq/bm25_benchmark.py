@@ -0,0 +1,59 @@
+import argparse
+import time
+import jsonlines
+import numpy as np
+from rank_bm25 import BM25Okapi
+from .bm25 import BM25Index, process_corpus
+from .text import normalize_text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Compare the inverted-index BM25 with rank_bm25 on latency and top-k agreement.")
+    parser.add_argument("knowledge_jsonl", help="Path to the knowledge source, e.g. knowledge_source/knowledge_source.jsonl.")
+    parser.add_argument("input_jsonl", help="Path to the questions to retrieve for, e.g. PAQ/validation.jsonl.")
+    parser.add_argument("--k", default=1, type=int, help="Number of documents retrieved per question.")
+    parser.add_argument("--n_queries", default=500, type=int, help="Number of questions timed.")
+    parser.add_argument("--output_file", required=False, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    with jsonlines.open(args.knowledge_jsonl, "r") as reader:
+        org_corpus, tokenized_corpus = process_corpus([entry["text"] for entry in reader])
+    with jsonlines.open(args.input_jsonl, "r") as reader:
+        questions = [normalize_text(entry["question"]) for entry in reader][:args.n_queries]
+
+    start = time.time()
+    rank_bm25 = BM25Okapi(tokenized_corpus)
+    rank_bm25_build = time.time() - start
+    start = time.time()
+    inverted = BM25Index.build(tokenized_corpus)
+    inverted_build = time.time() - start
+
+    rank_bm25_times, inverted_times, n_identical = [], [], 0
+    for question in questions:
+        start = time.time()
+        expected = np.argsort(rank_bm25.get_scores(question))[::-1][:args.k]  # what get_top_n returns
+        rank_bm25_times.append(time.time() - start)
+        start = time.time()
+        doc_ids, _ = inverted.top_k(question, args.k)
+        inverted_times.append(time.time() - start)
+        n_identical += np.array_equal(expected, doc_ids)
+
+    start = time.time()
+    batch_doc_ids, _ = inverted.top_k_batch(questions, args.k)
+    batch_time = (time.time() - start) / max(len(questions), 1)
+    n_identical_batch = sum(np.array_equal(inverted.top_k(question, args.k)[0], doc_ids)
+                            for question, doc_ids in zip(questions, batch_doc_ids))
+
+    lines = [f"{len(org_corpus)} documents, {len(questions)} questions, top-{args.k}",
+             f"{'Backend':<10} {'Build (s)':>9} {'Mean (ms)':>9} {'p95 (ms)':>9}"]
+    for name, build_time, times in (("rank_bm25", rank_bm25_build, rank_bm25_times),
+                                    ("inverted", inverted_build, inverted_times)):
+        lines.append(f"{name:<10} {build_time:>9.2f} {1000 * np.mean(times):>9.3f} {1000 * np.percentile(times, 95):>9.3f}")
+    lines.append(f"{'batch':<10} {'':>9} {1000 * batch_time:>9.3f} {'':>9}  (sparse products, per question)")
+    lines.append(f"Speed-up: {np.mean(rank_bm25_times) / np.mean(inverted_times):.1f}x, "
+                 f"identical top-{args.k}: {n_identical}/{len(questions)}, batch equal to single: {n_identical_batch}/{len(questions)}")
+    report = "\n".join(lines)
+    print(report)
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            print(report, file=f)
@@ -0,0 +1,409 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import uuid
+import zlib
+from array import array
+from collections import Counter
+from multiprocessing import Pool
+import numpy as np
+from .postings import BLOCK_SIZE, encode_blocks
+from .text import normalize_text
+
+MAGIC = b"BM25IDX2"
+ALIGN = 64
+
+
+def source_fingerprint(source: str) -> dict:
+    stat = os.stat(source)
+    return {"path": os.path.abspath(source), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def data_start(header_len: int) -> int:
+    return -(-(len(MAGIC) + 8 + header_len) // ALIGN) * ALIGN
+
+
+def write_index(path: str, header: dict, arrays: dict):
+    """
+    One file: magic, header length, JSON header, then every array aligned to `ALIGN` bytes.
+    An array given as a file path is a raw uint8 blob copied in chunks, so large blobs never sit in memory.
+    """
+    header = dict(header, arrays=dict())
+    offset = 0
+    for name, array_or_path in arrays.items():
+        if isinstance(array_or_path, str):
+            spec = {"dtype": "|u1", "shape": [os.path.getsize(array_or_path)]}
+        else:
+            spec = {"dtype": array_or_path.dtype.str, "shape": list(array_or_path.shape)}
+        spec["offset"] = offset
+        header["arrays"][name] = spec
+        offset += -(-int(np.prod(spec["shape"])) * np.dtype(spec["dtype"]).itemsize // ALIGN) * ALIGN
+    header = json.dumps(header).encode("utf-8")
+
+    # replace instead of overwrite: the previous index may still be memory-mapped
+    with open(path + ".tmp", "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        f.write(b"\0" * (data_start(len(header)) - f.tell()))
+        for array_or_path in arrays.values():
+            if isinstance(array_or_path, str):
+                with open(array_or_path, "rb") as blob:
+                    shutil.copyfileobj(blob, f, 1 << 24)
+                n_bytes = os.path.getsize(array_or_path)
+            else:
+                f.write(np.ascontiguousarray(array_or_path).tobytes())
+                n_bytes = array_or_path.nbytes
+            f.write(b"\0" * (-n_bytes % ALIGN))
+    os.replace(path + ".tmp", path)
+
+
+class _DocumentHashes:
+    """
+    Content-hash dedup: 64-bit hashes of the kept documents with their ids, as sorted arrays plus a small
+    pending dict, so memory grows by 16 bytes per document instead of by its text. Hash matches are confirmed
+    by the caller against the stored text, so collisions never drop a distinct document.
+    """
+
+    def __init__(self, max_pending: int = 1 << 20):
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.doc_ids = np.empty(0, dtype=np.int64)
+        self.pending = dict()
+        self.max_pending = max_pending
+
+    @staticmethod
+    def hash(text: str) -> int:
+        return int.from_bytes(hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+    def lookup(self, h: int) -> list[int]:
+        lo, hi = np.searchsorted(self.hashes, np.uint64(h), side="left"), np.searchsorted(self.hashes, np.uint64(h),
+                                                                                          side="right")
+        return self.doc_ids[lo:hi].tolist() + self.pending.get(h, [])
+
+    def add(self, h: int, doc_id: int):
+        self.pending.setdefault(h, []).append(doc_id)
+        if len(self.pending) >= self.max_pending:
+            items = [(h, doc_id) for h, doc_ids in self.pending.items() for doc_id in doc_ids]
+            hashes = np.concatenate([self.hashes, np.array([h for h, _ in items], dtype=np.uint64)])
+            doc_ids = np.concatenate([self.doc_ids, np.array([doc_id for _, doc_id in items], dtype=np.int64)])
+            order = np.argsort(hashes, kind="stable")
+            self.hashes, self.doc_ids, self.pending = hashes[order], doc_ids[order], dict()
+
+
+class BM25Builder:
+    """
+    Streaming construction of a block-compressed BM25 index (single-pass in-memory inversion with spilled runs).
+
+    Documents are added one at a time. Their postings are buffered and, every `max_postings` postings,
+    written to a run file in `workdir` (kept in memory when `workdir` is None). `finish` renumbers terms in
+    sorted order and merges the runs one range of terms at a time, encoding each range with `encode_blocks`.
+    Memory holds the vocabulary, a few numbers per document and at most about `max_postings` postings.
+    """
+
+    def __init__(self, workdir: str = None, max_postings: int = 1 << 24):
+        self.workdir = workdir
+        self.max_postings = max_postings
+        self.vocabulary = dict()  # term -> id, in order of first appearance like BM25Okapi's document frequencies
+        self.df = array("q")
+        self.doc_len = array("i")
+        self._terms, self._docs, self._tfs = array("i"), array("i"), array("i")
+        self.runs = []
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, tokens: list[str]) -> int:
+        doc_id = len(self.doc_len)
+        self.doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+            if term_id == len(self.df):
+                self.df.append(0)
+            self.df[term_id] += 1
+            self._terms.append(term_id)
+            self._docs.append(doc_id)
+            self._tfs.append(tf)
+        if self.workdir is not None and len(self._terms) >= self.max_postings:
+            self._flush()
+        return doc_id
+
+    def _flush(self):
+        run = np.stack([np.frombuffer(self._terms, dtype=np.int32), np.frombuffer(self._docs, dtype=np.int32),
+                        np.frombuffer(self._tfs, dtype=np.int32)])
+        if self.workdir is None:
+            self.runs.append(run)
+        else:
+            path = os.path.join(self.workdir, f"run{len(self.runs)}.npy")
+            np.save(path, run)
+            self.runs.append(path)
+        self._terms, self._docs, self._tfs = array("i"), array("i"), array("i")
+
+    @classmethod
+    def merge(cls, builders: list["BM25Builder"], keeps: list[np.ndarray], workdir: str = None,
+              max_postings: int = 1 << 24) -> "BM25Builder":
+        """
+        One builder for consecutive parts of a corpus, each built separately, without the documents whose `keeps`
+        entry is False. Term ids follow first appearance across the parts and document frequencies are
+        recounted from the kept postings, so the result matches adding the kept documents to a single builder.
+        """
+        merged = cls(workdir, max_postings)
+        mappings = []
+        for builder in builders:
+            mappings.append(np.array([merged.vocabulary.setdefault(term, len(merged.vocabulary))
+                                      for term in builder.vocabulary], dtype=np.int32))
+        df = np.zeros(len(merged.vocabulary), dtype=np.int64)
+        for builder, keep, mapping in zip(builders, keeps, mappings):
+            doc_ids = (len(merged.doc_len) + np.cumsum(keep) - 1).astype(np.int32)
+            for run in builder.runs:
+                data = np.load(run) if isinstance(run, str) else run
+                data = data[:, keep[data[1]]]
+                data = np.stack([mapping[data[0]], doc_ids[data[1]], data[2]])
+                df += np.bincount(data[0], minlength=len(df))
+                if isinstance(run, str):
+                    os.remove(run)
+                if workdir is None:
+                    merged.runs.append(data)
+                else:
+                    merged.runs.append(os.path.join(workdir, f"run{len(merged.runs)}.npy"))
+                    np.save(merged.runs[-1], data)
+            merged.doc_len.frombytes(np.frombuffer(builder.doc_len, dtype=np.int32)[keep].tobytes())
+        merged.df = array("q", df.tobytes())
+        return merged
+
+    @staticmethod
+    def idf(df: np.ndarray, corpus_size: int, epsilon: float) -> np.ndarray:
+        # BM25Okapi._calc_idf, summed in the same (first appearance) order so the epsilon floor matches
+        idf, idf_sum = [], 0
+        for freq in df.tolist():
+            value = math.log(corpus_size - freq + 0.5) - math.log(freq + 0.5)
+            idf.append(value)
+            idf_sum += value
+        idf = np.array(idf, dtype=np.float64)
+        idf[idf < 0] = epsilon * (idf_sum / len(idf))
+        return idf
+
+    def _sorted_runs(self, rank: np.ndarray) -> list[np.ndarray]:
+        # runs hold first-appearance term ids; re-sort them by sorted-term rank (stable, so documents stay increasing)
+        runs = []
+        for run in self.runs:
+            data = np.load(run) if isinstance(run, str) else run
+            data = np.concatenate([rank[data[:1]].astype(np.int32), data[1:]])
+            data = data[:, np.argsort(data[0], kind="stable")]
+            if isinstance(run, str):
+                np.save(run, data)
+                data = np.load(run, mmap_mode="r")
+            runs.append(data)
+        return runs
+
+    def finish(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+               postings_path: str = None) -> tuple[dict, float]:
+        """
+        Returns the index arrays and avgdl. With `postings_path` the compressed postings are written to that
+        file and the "postings" entry is its path; otherwise they are returned as an array.
+        """
+        if len(self._terms) or not self.runs:
+            self._flush()
+        terms = list(self.vocabulary)
+        order = np.array(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[order] = np.arange(len(terms))
+        encoded_terms = [terms[i].encode("utf-8") for i in order]
+        df = np.frombuffer(self.df, dtype=np.int64)[order] if len(self.df) else np.empty(0, dtype=np.int64)
+
+        doc_len = np.frombuffer(self.doc_len, dtype=np.int32).copy()
+        avgdl = int(doc_len.sum()) / len(doc_len)
+        # same expression (and rounding) as BM25Okapi.get_scores
+        norm = k1 * (1 - b + b * doc_len.astype(np.int64) / avgdl)
+
+        runs = self._sorted_runs(rank)
+        max_weights = np.zeros(len(terms))
+        block_bytes, block_last_doc = [], []
+        sink = open(postings_path, "wb") if postings_path else None
+        chunks = []
+        cumulative = np.cumsum(df)
+        start = 0
+        while start < len(terms):
+            # a range of terms holding about max_postings postings
+            end = max(int(np.searchsorted(cumulative, (cumulative[start - 1] if start else 0) + self.max_postings,
+                                          side="right")), start + 1)
+            parts = []
+            for run in runs:
+                lo, hi = np.searchsorted(run[0], [start, end])
+                parts.append(np.asarray(run[:, lo:hi]))
+            merged = np.concatenate(parts, axis=1)
+            merged = merged[:, np.argsort(merged[0], kind="stable")]
+            docs, tfs = merged[1].astype(np.int64), merged[2].astype(np.int64)
+
+            weights = tfs * (k1 + 1) / (tfs + norm[docs])
+            max_weights[start:end] = np.maximum.reduceat(weights, np.cumsum(df[start:end]) - df[start:end])
+            encoded, n_bytes, last_docs = encode_blocks(df[start:end], docs, tfs)
+            if sink is not None:
+                sink.write(encoded.tobytes())
+            else:
+                chunks.append(encoded)
+            block_bytes.append(n_bytes)
+            block_last_doc.append(last_docs)
+            start = end
+        if sink is not None:
+            sink.close()
+
+        n_blocks = -(-df // BLOCK_SIZE)
+        block_bytes = np.concatenate(block_bytes) if block_bytes else np.empty(0, dtype=np.int64)
+        arrays = {
+            "vocab_blob": np.frombuffer(b"".join(encoded_terms), dtype=np.uint8),
+            "vocab_offsets": np.concatenate([[0], np.cumsum([len(term) for term in encoded_terms])]).astype(np.int64),
+            "idf": self.idf(np.frombuffer(self.df, dtype=np.int64), len(doc_len), epsilon)[order] if len(terms) else
+            np.empty(0),
+            "max_weights": max_weights,
+            "df": df,
+            "term_blocks": np.concatenate([[0], np.cumsum(n_blocks)]).astype(np.int64),
+            "block_last_doc": np.concatenate(block_last_doc) if block_last_doc else np.empty(0, dtype=np.int32),
+            "block_offsets": np.concatenate([[0], np.cumsum(block_bytes)]).astype(np.int64),
+            "postings": postings_path if sink is not None else
+            (np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint8)),
+            "doc_len": doc_len,
+            "norm": norm,
+        }
+        return arrays, avgdl
+
+
+def _line_ranges(source: str, n_parts: int) -> list[tuple[int, int]]:
+    # byte ranges of about equal size, cut at line starts
+    size = os.path.getsize(source)
+    bounds = [0]
+    with open(source, "rb") as f:
+        for i in range(1, n_parts):
+            f.seek(max(size * i // n_parts - 1, bounds[-1]))
+            f.readline()
+            if f.tell() > bounds[-1]:
+                bounds.append(min(f.tell(), size))
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _read_document(fd: int, doc_offsets: np.ndarray, doc_id: int) -> str:
+    start, end = int(doc_offsets[doc_id]), int(doc_offsets[doc_id + 1])
+    return zlib.decompress(os.pread(fd, end - start, start)).decode("utf-8", "surrogatepass")
+
+
+def _ingest(args: tuple) -> tuple[BM25Builder, np.ndarray, np.ndarray, str]:
+    """
+    Tokenize and deduplicate the lines in one byte range of the source (a worker task). Returns the range's
+    builder (runs spilled to its own directory), the doc store offsets and content hashes of the kept documents,
+    and the path of its doc store.
+    """
+    source, start, end, workdir, max_postings = args
+    os.makedirs(workdir, exist_ok=True)
+    builder = BM25Builder(workdir, max_postings)
+    seen = _DocumentHashes()
+    docs_path = os.path.join(workdir, "documents.bin")
+    doc_offsets, hashes = array("q", [0]), array("Q")
+    with open(source, "rb") as reader, open(docs_path, "w+b") as docs:
+        reader.seek(start)
+        offset = start
+        while offset < end:
+            line = reader.readline()
+            offset += len(line)
+            if not line.strip():
+                continue
+            text = json.loads(line)["text"]
+            h = seen.hash(text)
+            matches = seen.lookup(h)
+            if matches:
+                docs.flush()
+                if any(_read_document(docs.fileno(), doc_offsets, i) == text for i in matches):
+                    continue
+            seen.add(h, builder.add(normalize_text(text)))
+            hashes.append(h)
+            docs.write(zlib.compress(text.encode("utf-8", "surrogatepass")))
+            doc_offsets.append(docs.tell())
+    if len(builder._terms):
+        builder._flush()
+    return (builder, np.frombuffer(doc_offsets, dtype=np.int64), np.frombuffer(hashes, dtype=np.uint64),
+            docs_path)
+
+
+def _cross_part_duplicates(parts: list[tuple]) -> list[np.ndarray]:
+    """
+    Keep masks of the documents of every part: a document is dropped when an identical one was kept in an
+    earlier part, so the result equals deduplicating the whole file in order.
+    """
+    keeps = []
+    seen_hashes, seen_keys = np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)  # key: part << 40 | doc
+    fds = [os.open(docs_path, os.O_RDONLY) for _, _, _, docs_path in parts]
+    try:
+        for p, (_, doc_offsets, hashes, _) in enumerate(parts):
+            keep = np.ones(len(hashes), dtype=bool)
+            lo = np.searchsorted(seen_hashes, hashes, side="left")
+            hi = np.searchsorted(seen_hashes, hashes, side="right")
+            for i in np.flatnonzero(hi > lo):
+                text = _read_document(fds[p], doc_offsets, i)
+                for key in seen_keys[lo[i]:hi[i]].tolist():
+                    q, j = key >> 40, key & ((1 << 40) - 1)
+                    if _read_document(fds[q], parts[q][1], j) == text:
+                        keep[i] = False
+                        break
+            keeps.append(keep)
+            kept = np.flatnonzero(keep)
+            seen_hashes = np.concatenate([seen_hashes, hashes[kept]])
+            seen_keys = np.concatenate([seen_keys, (p << 40) | kept])
+            order = np.argsort(seen_hashes, kind="stable")
+            seen_hashes, seen_keys = seen_hashes[order], seen_keys[order]
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return keeps
+
+
+def _merge_documents(parts: list[tuple], keeps: list[np.ndarray], path: str) -> np.ndarray:
+    # concatenate the kept compressed texts of every part; returns the merged offsets
+    lengths = []
+    with open(path, "wb") as out:
+        for (_, doc_offsets, _, docs_path), keep in zip(parts, keeps):
+            lengths.append(np.diff(doc_offsets)[keep])
+            # copy maximal stretches of kept documents
+            edges = np.diff(np.concatenate([[0], keep.astype(np.int8), [0]]))
+            with open(docs_path, "rb") as docs:
+                for first, last in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+                    docs.seek(doc_offsets[first])
+                    remaining = int(doc_offsets[last] - doc_offsets[first])
+                    while remaining:
+                        chunk = docs.read(min(remaining, 1 << 24))
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            os.remove(docs_path)
+    return np.concatenate([[0], np.cumsum(np.concatenate(lengths))]).astype(np.int64)
+
+
+def build_index_file(source: str, path: str, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                     max_postings: int = 1 << 24, n_workers: int = None):
+    """
+    Index the "text" field of a JSONL knowledge source into `path`, with memory bounded by `max_postings`.
+    Repeated documents are dropped (first copy wins) by content hash. Kept documents go to a doc store inside
+    the index: zlib-compressed texts addressed by byte offsets.
+
+    Parsing, deduplication and tokenization run in `n_workers` processes (all cores by default), one byte
+    range of the file each; their vocabularies, postings and doc stores are then merged in file order, so
+    the index is the same for any number of workers.
+    """
+    n_workers = n_workers or os.cpu_count()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as workdir:
+        tasks = [(source, start, end, os.path.join(workdir, f"part{i}"), max(max_postings // n_workers, 1))
+                 for i, (start, end) in enumerate(_line_ranges(source, n_workers))]
+        if len(tasks) > 1:
+            with Pool(min(n_workers, len(tasks))) as pool:
+                parts = pool.map(_ingest, tasks)
+        else:
+            parts = [_ingest(task) for task in tasks]
+
+        keeps = _cross_part_duplicates(parts)
+        builder = BM25Builder.merge([builder for builder, _, _, _ in parts], keeps, workdir, max_postings)
+        doc_offsets = _merge_documents(parts, keeps, os.path.join(workdir, "documents.bin"))
+        arrays, avgdl = builder.finish(k1, b, epsilon, postings_path=os.path.join(workdir, "postings.bin"))
+        arrays["doc_offsets"] = doc_offsets
+        arrays["documents"] = os.path.join(workdir, "documents.bin")
+        # a new id per build lets caches of query results tell builds apart
+        write_index(path, {"k1": k1, "b": b, "avgdl": avgdl, "block_size": BLOCK_SIZE, "build_id": uuid.uuid4().hex,
+                           "source": source_fingerprint(source)}, arrays)
@@ -0,0 +1,29 @@
+import argparse
+import time
+from .embedder import Embedder, DEFAULT_MODEL
+from .exact_match import ExactMatchTable
+from .incremental import read_jsonl_tail, save_checkpoint
+from .paq_index import PAQIndex
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Build a HNSW index over the questions of a PAQ JSONL file.")
+    parser.add_argument("paq_jsonl", help="Path to the PAQ JSONL file, e.g. PAQ/train_sample.jsonl.")
+    parser.add_argument("index_dir", help="Directory to store the index in.")
+    parser.add_argument("--model_name", default=DEFAULT_MODEL, help="HuggingFace encoder used to embed questions.")
+    parser.add_argument("--M", default=16, type=int, help="Maximum number of links per node on the upper layers.")
+    parser.add_argument("--ef_construction", default=100, type=int, help="Beam width used while inserting.")
+    parser.add_argument("--batch_size", default=64, type=int, help="Embedding batch size.")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="Precision of the stored embeddings.")
+    args = parser.parse_args()
+
+    entries, offset = read_jsonl_tail(args.paq_jsonl)
+    print(f"Indexing {len(entries)} PAQ entries from {args.paq_jsonl}...")
+
+    start = time.time()
+    paq_index = PAQIndex.build(entries, Embedder(args.model_name), args.index_dir, M=args.M,
+                               ef_construction=args.ef_construction, batch_size=args.batch_size, dtype=args.dtype)
+    paq_index.save()
+    ExactMatchTable.build(paq_index.store).save(args.index_dir)
+    save_checkpoint(args.index_dir, args.paq_jsonl, offset)
+    print(f"Index written to {args.index_dir} in {time.time() - start:.1f}s")
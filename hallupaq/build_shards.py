@@ -0,0 +1,18 @@
+import argparse
+import time
+from .sharded import build_shards
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Build one HNSW graph per shard of a PAQ index, in parallel processes.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index.")
+    parser.add_argument("--n_shards", nargs="+", default=[4], type=int, help="Shard counts to build.")
+    parser.add_argument("--n_workers", default=None, type=int, help="Build processes (default: one per shard).")
+    parser.add_argument("--M", default=16, type=int, help="Maximum number of neighbours per HNSW node.")
+    parser.add_argument("--ef_construction", default=100, type=int, help="HNSW beam width used while building.")
+    args = parser.parse_args()
+
+    for n_shards in args.n_shards:
+        start = time.time()
+        build_shards(args.index_dir, n_shards, args.n_workers, M=args.M, ef_construction=args.ef_construction)
+        print(f"Built {n_shards} shards in {time.time() - start:.1f}s")
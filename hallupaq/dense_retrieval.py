@@ -0,0 +1,137 @@
+import json
+import os
+import uuid
+import numpy as np
+from .bm25 import BM25Index
+from .embedder import Embedder
+from .flat import FlatIndex
+from .hnsw import HNSWIndex
+from .store import EmbeddingStore
+from .text import normalize_text
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def reciprocal_rank_fusion(rankings: list[np.ndarray], k: int, rrf_k: int = 60) -> np.ndarray:
+    """
+    Reciprocal rank fusion (Cormack et al., 2009) of several rankings of the same queries, each of shape
+    (n_queries, depth) and padded with -1. A document scores sum(1 / (rrf_k + rank)) over the rankings it
+    appears in. Returns the k best documents per query, padded with -1; ties keep the order of the first ranking.
+    """
+    fused = np.full((len(rankings[0]), k), -1, dtype=np.int64)
+    for i in range(len(fused)):
+        scores = dict()
+        for ranking in rankings:
+            for rank, doc_id in enumerate(ranking[i].tolist(), start=1):
+                if doc_id >= 0:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        fused[i, :len(best)] = best
+    return fused
+
+
+class DenseChunkIndex:
+    """
+    Dense retrieval over the documents of a `BM25Index` doc store.
+
+    Every chunk is embedded once and kept in an `EmbeddingStore` whose row i is BM25 document i, so dense and
+    BM25 rankings can be fused and documents are read from the BM25 doc store. Embeddings are L2-normalized,
+    so the squared L2 ranking of `FlatIndex` (exact matrix products) or `HNSWIndex` (approximate) is the cosine
+    ranking. `dense.json` records the BM25 source the chunks came from; the index is stale when it changes.
+    Any object with `name` and `embed(texts, batch_size)` can serve as the embedder.
+    """
+
+    def __init__(self, store: EmbeddingStore, index, embedder=None, build_id: str = None):
+        self.store = store
+        self.index = index
+        self.build_id = build_id
+        self.embedder = embedder if embedder is not None else Embedder(store.embedder_name)
+        if self.embedder.name != store.embedder_name:
+            raise ValueError(f"Index was built with embedder {store.embedder_name}, got {self.embedder.name}")
+
+    def __len__(self):
+        return len(self.store)
+
+    @classmethod
+    def build(cls, bm25: BM25Index, embedder, index_dir: str, batch_size: int = 64, chunk_size: int = 65536,
+              dtype: str = "float32", hnsw: bool = False, M: int = 16, ef_construction: int = 100) -> "DenseChunkIndex":
+        """
+        Embed every document of `bm25`, `chunk_size` documents at a time so memory stays bounded.
+        With `hnsw` a HNSW graph is built and saved next to the embeddings; otherwise search is exact.
+        """
+        store = None
+        for start in range(0, len(bm25), chunk_size):
+            doc_ids = range(start, min(start + chunk_size, len(bm25)))
+            vectors = _normalize(embedder.embed([bm25.document(doc_id) for doc_id in doc_ids], batch_size=batch_size))
+            entries = [{"id": doc_id} for doc_id in doc_ids]
+            if store is None:
+                store = EmbeddingStore.create(index_dir, entries, vectors, embedder.name, dtype=dtype)
+            else:
+                store.append(entries, vectors)
+
+        index = FlatIndex(store.vectors)
+        if hnsw:
+            index = HNSWIndex(store.dim, M=M, ef_construction=ef_construction)
+            index.extend(store.vectors)
+            index.save(index_dir)
+        # written last: an interrupted build stays stale
+        build_id = uuid.uuid4().hex
+        with open(os.path.join(index_dir, "dense.json"), "w") as f:
+            json.dump({"source": bm25.source, "hnsw": hnsw, "build_id": build_id}, f, indent=4)
+        return cls(store, index, embedder, build_id)
+
+    @classmethod
+    def load(cls, index_dir: str, embedder=None, exact: bool = False) -> "DenseChunkIndex":
+        """
+        Open a dense index directory, searching the HNSW graph if one was built unless `exact` is set.
+        """
+        with open(os.path.join(index_dir, "dense.json"), "r") as f:
+            meta = json.load(f)
+        store = EmbeddingStore(index_dir)
+        if meta["hnsw"] and not exact:
+            return cls(store, HNSWIndex.load(index_dir, store.vectors), embedder, meta["build_id"])
+        return cls(store, FlatIndex(store.vectors), embedder, meta["build_id"])
+
+    @staticmethod
+    def is_stale(index_dir: str, bm25: BM25Index, hnsw: bool = False) -> bool:
+        """
+        Whether `index_dir` is missing, was built from a different version of the BM25 knowledge source,
+        or was built with a different `hnsw` setting.
+        """
+        meta_path = os.path.join(index_dir, "dense.json")
+        if not os.path.exists(meta_path):
+            return True
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        return "build_id" not in meta or meta["source"] != bm25.source or meta["hnsw"] != hnsw
+
+    @classmethod
+    def load_or_build(cls, index_dir: str, bm25: BM25Index, embedder=None, hnsw: bool = False,
+                      **kwargs) -> "DenseChunkIndex":
+        """
+        Load `index_dir`, (re)building it first from the documents of `bm25` when it is stale.
+        """
+        if cls.is_stale(index_dir, bm25, hnsw):
+            return cls.build(bm25, embedder if embedder is not None else Embedder(), index_dir, hnsw=hnsw, **kwargs)
+        return cls.load(index_dir, embedder)
+
+    def search(self, questions: list[str], k: int = 1, ef: int = None,
+               batch_size: int = 64) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k document ids (padded with -1) and squared L2 distances between normalized embeddings, nearest first.
+        """
+        return self.index.knn_query(_normalize(self.embedder.embed(questions, batch_size=batch_size)), k, ef)
+
+
+def hybrid_search(bm25: BM25Index, dense: DenseChunkIndex, questions: list[str], k: int = 1,
+                  depth: int = 50) -> np.ndarray:
+    """
+    Top-k document ids of every question from reciprocal rank fusion of the `depth` best BM25 and dense documents.
+    """
+    depth = max(k, depth)
+    lexical, scores = bm25.top_k_batch([normalize_text(question) for question in questions], depth)
+    lexical[scores == 0] = -1  # documents without any query term are not a lexical match
+    return reciprocal_rank_fusion([lexical, dense.search(questions, depth)[0]], k)
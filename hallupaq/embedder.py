@@ -0,0 +1,41 @@
+import numpy as np
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class Embedder:
+    """
+    Mean-pooled sentence embedder on top of a HuggingFace encoder.
+    torch/transformers are imported lazily, so processes that only load an index do not pay for them.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, device: str = None, max_length: int = 128):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.name = model_name
+        self.max_length = max_length
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(self.device).eval()
+        self.dim = self.model.config.hidden_size
+        self._torch = torch
+
+    def embed(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Embed a list of texts into a float32 matrix of shape (len(texts), dim).
+        """
+        torch = self._torch
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            batch = self.tokenizer(texts[i: i + batch_size], padding=True, truncation=True,
+                                   max_length=self.max_length, return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            outputs.append(pooled.cpu().numpy().astype(np.float32))
+
+        if not outputs:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.concatenate(outputs, axis=0)
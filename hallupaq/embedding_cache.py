@@ -0,0 +1,125 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from .text import normalize_question
+
+
+class CachedEmbedder:
+    """
+    Two-tier embedding cache in front of an embedder, with the same `name`/`embed` interface.
+
+    Tier 1 is an in-memory LRU bounded by `max_memory_entries`. Tier 2 (optional) is a SQLite file
+    bounded by `max_disk_entries`, evicting the least recently used rows. Both are keyed by a content
+    hash of the embedder name and the normalized question, so re-cased or re-punctuated copies of a
+    question share the embedding computed for the first copy seen.
+    """
+
+    def __init__(self, embedder, max_memory_entries: int = 100000, cache_path: str = None,
+                 max_disk_entries: int = 10000000):
+        self.embedder = embedder
+        self.name = embedder.name
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = 0
+        self.memory_hits, self.disk_hits, self.misses = 0, 0, 0
+        self.memory_evictions, self.disk_evictions = 0, 0
+
+        self._db = None
+        if cache_path is not None:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                             "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._clock = self._db.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.name}\0{normalize_question(text)}".encode("utf-8")).digest()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        if self.max_memory_entries <= 0:  # memory tier disabled
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.memory_evictions += 1
+
+    def _disk_get(self, keys: list[bytes]) -> dict:
+        found = dict()
+        for i in range(0, len(keys), 500):  # stay below SQLite's bound-parameter limit
+            chunk = keys[i: i + 500]
+            rows = self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                                    chunk).fetchall()
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        if found:
+            self._clock += 1
+            self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                 [(self._clock, key) for key in found])
+        return found
+
+    def _disk_put(self, items: dict):
+        self._clock += 1
+        self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                             [(key, vector.astype(np.float32).tobytes(), self._clock) for key, vector in items.items()])
+        n_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if n_rows > self.max_disk_entries:
+            n_evicted = n_rows - self.max_disk_entries
+            self._db.execute("DELETE FROM embeddings WHERE key IN "
+                             "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (n_evicted,))
+            self.disk_evictions += n_evicted
+
+    def embed(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        keys = [self._key(text) for text in texts]
+        vectors = [None] * len(texts)
+
+        with self._lock:
+            missing = dict()  # key -> positions in `texts`
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                    self.memory_hits += 1
+
+            if missing and self._db is not None:
+                for key, vector in self._disk_get(list(missing)).items():
+                    self._remember(key, vector)
+                    for i in missing.pop(key):
+                        vectors[i] = vector
+                        self.disk_hits += 1
+
+        if missing:
+            computed = self.embedder.embed([texts[positions[0]] for positions in missing.values()], batch_size=batch_size)
+            with self._lock:
+                for (key, positions), vector in zip(missing.items(), computed):
+                    self._remember(key, vector)
+                    for i in positions:
+                        vectors[i] = vector
+                    self.misses += len(positions)
+                if self._db is not None:
+                    self._disk_put(dict(zip(missing, computed)))
+                    self._db.commit()
+        elif self._db is not None:
+            with self._lock:
+                self._db.commit()
+
+        if not vectors:
+            return self.embedder.embed([], batch_size=batch_size)
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "memory_evictions": self.memory_evictions, "disk_evictions": self.disk_evictions,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
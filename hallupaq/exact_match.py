@@ -0,0 +1,77 @@
+import hashlib
+import os
+import numpy as np
+from .store import EmbeddingStore
+from .text import normalize_question
+
+
+def _hash(normalized: str) -> int:
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class ExactMatchTable:
+    """
+    Hash table from normalized PAQ question to store row, checked before embedding and ANN search.
+    Stored as two sorted arrays (64-bit hashes and rows) that are memory-mapped and binary searched;
+    a hash hit is confirmed against the stored question, so collisions cannot produce false matches.
+    """
+
+    def __init__(self, store: EmbeddingStore, hashes: np.ndarray, rows: np.ndarray):
+        self.store = store
+        self.hashes = hashes
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def _hash_rows(store: EmbeddingStore, start: int) -> np.ndarray:
+        return np.array([_hash(normalize_question(store.entry(row)["question"])) for row in range(start, len(store))],
+                        dtype=np.uint64)
+
+    @classmethod
+    def build(cls, store: EmbeddingStore) -> "ExactMatchTable":
+        table = cls(store, np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64))
+        table.extend()
+        return table
+
+    def extend(self):
+        """
+        Hash the store rows appended since the table was built.
+        """
+        n_hashed = len(self.hashes)
+        hashes = np.concatenate([np.asarray(self.hashes), self._hash_rows(self.store, n_hashed)])
+        rows = np.concatenate([np.asarray(self.rows), np.arange(n_hashed, len(self.store), dtype=np.int64)])
+        order = np.lexsort((rows, hashes))
+        self.hashes, self.rows = hashes[order], rows[order]
+
+    def lookup(self, question: str) -> int:
+        """
+        First live row whose normalized question equals that of `question`, or -1.
+        """
+        normalized = normalize_question(question)
+        h = np.uint64(_hash(normalized))
+        i = int(np.searchsorted(self.hashes, h, side="left"))
+        while i < len(self.hashes) and self.hashes[i] == h:
+            row = int(self.rows[i])
+            if row not in self.store.deleted and normalize_question(self.store.entry(row)["question"]) == normalized:
+                return row
+            i += 1
+        return -1
+
+    def save(self, index_dir: str):
+        for name, array in (("exact_hashes", self.hashes), ("exact_rows", self.rows)):
+            # replace instead of overwrite: the previous arrays may still be memory-mapped
+            path = os.path.join(index_dir, f"{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def exists(cls, index_dir: str) -> bool:
+        return os.path.exists(os.path.join(index_dir, "exact_hashes.npy"))
+
+    @classmethod
+    def load(cls, index_dir: str, store: EmbeddingStore) -> "ExactMatchTable":
+        return cls(store, np.load(os.path.join(index_dir, "exact_hashes.npy"), mmap_mode="r"),
+                   np.load(os.path.join(index_dir, "exact_rows.npy"), mmap_mode="r"))
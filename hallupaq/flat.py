@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class FlatIndex:
+    """
+    Exact squared-L2 search for a whole batch of queries as matrix products,
+    ||q||^2 - 2 q.x + ||x||^2, computed one corpus chunk at a time so memory stays bounded.
+    Exposes the same `knn_query` as `HNSWIndex`.
+    """
+
+    def __init__(self, vectors: np.ndarray, chunk_size: int = 65536):
+        self.vectors = vectors
+        self.chunk_size = chunk_size
+        self.deleted = set()
+        self._norms = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def norms(self) -> np.ndarray:
+        # computed on first use so that opening a memory-mapped store stays cheap
+        if self._norms is None:
+            self._norms = np.concatenate([np.einsum("ij,ij->i", chunk, chunk) for chunk in self._chunks()] or
+                                         [np.empty(0, dtype=np.float32)])
+        return self._norms
+
+    def extend(self, vectors: np.ndarray):
+        """
+        Adopt a grown vector matrix; only the norms of the new rows are computed.
+        """
+        old_norms, n_old = self._norms, len(self.vectors)
+        self.vectors, self._norms = vectors, None
+        if old_norms is not None:
+            new_rows = np.asarray(vectors[n_old:], dtype=np.float32)
+            self._norms = np.concatenate([old_norms, np.einsum("ij,ij->i", new_rows, new_rows)])
+
+    def mark_deleted(self, labels):
+        self.deleted.update(int(label) for label in labels)
+
+    def _chunks(self):
+        for start in range(0, len(self.vectors), self.chunk_size):
+            yield np.asarray(self.vectors[start: start + self.chunk_size], dtype=np.float32)
+
+    def knn_query(self, queries: np.ndarray, k: int, ef: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        `ef` is accepted for interface compatibility and ignored, the search is exhaustive.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        norms = self.norms
+        rows = np.arange(len(queries))[:, None]
+        deleted = np.array(sorted(self.deleted), dtype=np.int64)
+
+        best_labels = np.full((len(queries), k), -1, dtype=np.int64)
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for i, chunk in enumerate(self._chunks()):
+            start = i * self.chunk_size
+            distances = query_norms[:, None] - 2 * queries @ chunk.T + norms[None, start: start + len(chunk)]
+            np.maximum(distances, 0, out=distances)
+            chunk_deleted = deleted[(deleted >= start) & (deleted < start + len(chunk))]
+            distances[:, chunk_deleted - start] = np.inf
+
+            chunk_k = min(k, len(chunk))
+            top = np.argpartition(distances, chunk_k - 1, axis=1)[:, :chunk_k]
+            labels = np.concatenate([best_labels, top + start], axis=1)
+            merged = np.concatenate([best_distances, distances[rows, top]], axis=1)
+            order = np.argsort(merged, axis=1, kind="stable")[:, :k]
+            best_labels, best_distances = labels[rows, order], merged[rows, order]
+
+        best_labels[np.isinf(best_distances)] = -1
+        return best_labels, best_distances
+
+    def save(self, index_dir: str):
+        # nothing to persist: the index is the embedding store itself
+        pass
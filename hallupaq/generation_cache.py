@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+class GenerationCache:
+    """
+    Disk-backed cache of LLM generations (SageMaker or OpenAI), laid out like `RetrievalCache`.
+
+    A request is any JSON-serializable dict describing the call: model or endpoint, messages and sampling
+    parameters. Entries are content-addressed by the SHA-256 of the canonical JSON of the request and its
+    sample index, the number of identical requests before it in the same `get`/`fetch` call, so the 4
+    repeats of a prompt are 4 cached samples, not 1. Entries live in a SQLite file whose total size is
+    bounded by `max_bytes`, evicting the least recently used ones.
+
+    `mode` is "readwrite" (the default), "readonly" (misses are generated but not stored and the file is
+    opened read-only) or "replay" (read-only, and a miss raises KeyError so a rerun never calls the endpoint).
+    """
+
+    MODES = ("readwrite", "readonly", "replay")
+
+    def __init__(self, cache_path: str, mode: str = "readwrite", max_bytes: int = 1 << 30):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown generation cache mode {mode}; expected one of {self.MODES}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits, self.misses, self.writes, self.evictions = 0, 0, 0, 0
+
+        if mode == "readwrite":
+            # several processes may share the file; wait for their writes instead of failing
+            self._db = sqlite3.connect(cache_path, check_same_thread=False, timeout=60)
+            self._db.execute("CREATE TABLE IF NOT EXISTS generations (key BLOB PRIMARY KEY, response TEXT NOT NULL, "
+                             "size INTEGER NOT NULL, last_used INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+            self._db.commit()
+        else:
+            if not os.path.exists(cache_path):
+                raise ValueError(f"Generation cache {cache_path} does not exist")
+            self._db = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True, check_same_thread=False)
+        self._clock, self._bytes = self._db.execute(
+            "SELECT COALESCE(MAX(last_used), 0), COALESCE(SUM(size), 0) FROM generations").fetchone()
+
+    @staticmethod
+    def _keys(requests: list[dict]) -> list[bytes]:
+        keys, samples = [], dict()
+        for request in requests:
+            canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+            sample = samples.get(canonical, 0)
+            samples[canonical] = sample + 1
+            keys.append(hashlib.sha256(f"{canonical}\0{sample}".encode("utf-8", "surrogatepass")).digest())
+        return keys
+
+    def get(self, requests: list[dict]) -> tuple[list, list[int]]:
+        """
+        Cached response of every request (None where missing) and the positions of the missing ones.
+        """
+        keys = self._keys(requests)
+        found = dict()
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay below SQLite's bound-parameter limit
+                chunk = keys[i: i + 500]
+                rows = self._db.execute(f"SELECT key, response FROM generations WHERE key IN "
+                                        f"({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update((key, json.loads(response)) for key, response in rows)
+            if found and self.mode == "readwrite":
+                self._clock += 1
+                self._db.executemany("UPDATE generations SET last_used = ? WHERE key = ?",
+                                     [(self._clock, key) for key in found])
+                self._db.commit()
+            missing = [i for i, key in enumerate(keys) if key not in found]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return [found.get(key) for key in keys], missing
+
+    def put(self, requests: list[dict], responses: list, positions: list[int] = None):
+        """
+        Store `responses[j]` as the response of `requests[positions[j]]` (of every request if `positions` is None);
+        a no-op unless the mode is "readwrite". `requests` is the full list given to `get`, so sample indices line up.
+        """
+        if self.mode != "readwrite":
+            return
+        keys = self._keys(requests)
+        rows = []
+        for i, response in zip(positions if positions is not None else range(len(requests)), responses):
+            response = json.dumps(response, ensure_ascii=False)
+            rows.append((keys[i], response, len(keys[i]) + len(response.encode("utf-8", "surrogatepass"))))
+        with self._lock:
+            existing = dict()
+            for i in range(0, len(rows), 500):  # stay below SQLite's bound-parameter limit
+                chunk = [key for key, _, _ in rows[i: i + 500]]
+                existing.update(self._db.execute(f"SELECT key, size FROM generations WHERE key IN "
+                                                 f"({','.join('?' * len(chunk))})", chunk).fetchall())
+            self._clock += 1
+            self._db.executemany("INSERT OR REPLACE INTO generations (key, response, size, last_used) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 [(key, response, size, self._clock) for key, response, size in rows])
+            self._bytes += sum(size - existing.get(key, 0) for key, _, size in rows)
+            self.writes += len(rows)
+            if self._bytes > self.max_bytes:
+                victims = []
+                for key, size in self._db.execute("SELECT key, size FROM generations ORDER BY last_used"):
+                    if self._bytes <= self.max_bytes:
+                        break
+                    victims.append((key,))
+                    self._bytes -= size
+                self._db.executemany("DELETE FROM generations WHERE key = ?", victims)
+                self.evictions += len(victims)
+            self._db.commit()
+
+    def fetch(self, requests: list[dict], generate) -> list:
+        """
+        Responses of all requests, calling `generate(missing_positions)` for the uncached ones only; it must
+        return their responses in order.
+        """
+        responses, missing = self.get(requests)
+        if missing:
+            if self.mode == "replay":
+                raise KeyError(f"{len(missing)} of {len(requests)} generations are not cached (replay mode)")
+            generated = generate(missing)
+            self.put(requests, generated, missing)
+            for i, response in zip(missing, generated):
+                responses[i] = response
+        return responses
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions,
+                "bytes": self._bytes, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def cached_chat_completion(cache: GenerationCache, client, **kwargs) -> str:
+    """
+    Content of the first choice of `client.chat.completions.create(**kwargs)`, answered from `cache` (if not
+    None) when the same request to the same base URL was made before.
+    """
+    def _generate(missing):
+        return [client.chat.completions.create(**kwargs).choices[0].message.content]
+
+    if cache is None:
+        return _generate([0])[0]
+    return cache.fetch([{"base_url": str(client.base_url), **kwargs}], _generate)[0]
@@ -0,0 +1,248 @@
+import heapq
+import math
+import os
+import numpy as np
+
+
+class HNSWIndex:
+    """
+    Hierarchical Navigable Small World graph over squared-L2 distance.
+    Follows Malkov & Yashunin (2016): greedy descent through the sparse upper layers,
+    then a beam search of width `ef` on the bottom layer. Labels are insertion order.
+    """
+
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 100, seed: int = 42):
+        self.dim = dim
+        self.M = M
+        self.max_links0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef = 64
+        self.level_mult = 1 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.links = []  # links[node][level] -> list of neighbour labels
+        self.entry_point = -1
+        self.max_level = -1
+        self.deleted = set()
+
+    def __len__(self):
+        return len(self.links)
+
+    def _distances(self, query: np.ndarray, labels) -> np.ndarray:
+        diff = self.vectors[labels] - query
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+
+    def _search_layer(self, query: np.ndarray, entry_points: list[tuple[float, int]], ef: int, level: int,
+                      skip_deleted: bool = False) -> list[tuple[float, int]]:
+        """
+        Beam search on one layer; returns up to `ef` (distance, label) pairs sorted by distance.
+        With `skip_deleted`, tombstoned nodes are still traversed but never returned, and the search
+        keeps going until `ef` live results are found.
+        """
+        visited = set(label for _, label in entry_points)
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        results = [(-dist, label) for dist, label in entry_points if not (skip_deleted and label in self.deleted)]
+        heapq.heapify(results)
+
+        while candidates:
+            dist, label = heapq.heappop(candidates)
+            bound = -results[0][0] if results else math.inf
+            if dist > bound and (len(results) >= ef or not skip_deleted):
+                break
+
+            neighbours = [n for n in self.links[label][level] if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+
+            for n, n_dist in zip(neighbours, self._distances(query, neighbours).tolist()):
+                if len(results) < ef or n_dist < -results[0][0]:
+                    heapq.heappush(candidates, (n_dist, n))
+                    if skip_deleted and n in self.deleted:
+                        continue
+                    heapq.heappush(results, (-n_dist, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted((-neg_dist, label) for neg_dist, label in results)
+
+    def _select_neighbours(self, candidates: list[tuple[float, int]], m: int) -> list[int]:
+        """
+        Neighbour selection heuristic: keep a candidate only if it is closer to the base
+        element than to every neighbour selected so far, which keeps the graph navigable.
+        """
+        selected = []
+        for dist, label in candidates:
+            if len(selected) >= m:
+                break
+            if not selected or (self._distances(self.vectors[label], selected) > dist).all():
+                selected.append(label)
+        return selected
+
+    def _greedy_descent(self, query: np.ndarray, target_level: int) -> tuple[float, int]:
+        ep = self.entry_point
+        ep_dist = float(self._distances(query, [ep])[0])
+        for level in range(self.max_level, target_level, -1):
+            changed = True
+            while changed:
+                changed = False
+                neighbours = self.links[ep][level]
+                if not neighbours:
+                    break
+                dists = self._distances(query, neighbours)
+                best = int(np.argmin(dists))
+                if dists[best] < ep_dist:
+                    ep, ep_dist, changed = neighbours[best], float(dists[best]), True
+        return ep_dist, ep
+
+    def _insert(self, label: int):
+        query = self.vectors[label]
+        level = self._random_level()
+        self.links.append([[] for _ in range(level + 1)])
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = label, level
+            return
+
+        entry_points = [self._greedy_descent(query, level)]
+        for lc in range(min(level, self.max_level), -1, -1):
+            max_links = self.max_links0 if lc == 0 else self.M
+            candidates = self._search_layer(query, entry_points, self.ef_construction, lc)
+            neighbours = self._select_neighbours(candidates, self.M)
+            self.links[label][lc] = neighbours
+
+            for n in neighbours:
+                n_links = self.links[n][lc]
+                n_links.append(label)
+                if len(n_links) > max_links:
+                    dists = self._distances(self.vectors[n], n_links)
+                    self.links[n][lc] = self._select_neighbours(sorted(zip(dists.tolist(), n_links)), max_links)
+            entry_points = candidates
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = label, level
+
+    def add(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Insert a matrix of vectors; returns the labels assigned to them.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        return self.extend(np.concatenate([self.vectors, vectors], axis=0))
+
+    def extend(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Adopt `vectors` (e.g. a re-mapped, grown store) whose leading rows are already in the graph,
+        and insert the remaining rows; returns their labels.
+        """
+        start = len(self.links)
+        self.vectors = vectors
+        for label in range(start, len(vectors)):
+            self._insert(label)
+        return np.arange(start, len(vectors))
+
+    def mark_deleted(self, labels):
+        """
+        Tombstone labels: they keep their links so the graph stays navigable, but are never returned.
+        """
+        self.deleted.update(int(label) for label in labels)
+
+    def search(self, query: np.ndarray, k: int, ef: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest neighbours of a single query; returns (labels, squared L2 distances).
+        """
+        if self.entry_point < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        entry_points = [self._greedy_descent(query, 0)]
+        results = self._search_layer(query, entry_points, max(ef or self.ef, k), 0, bool(self.deleted))[:k]
+        return (np.array([label for _, label in results], dtype=np.int64),
+                np.array([dist for dist, _ in results], dtype=np.float32))
+
+    def knn_query(self, queries: np.ndarray, k: int, ef: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Batched search; rows with fewer than k results are padded with label -1 and distance inf.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            row_labels, row_distances = self.search(query, k, ef)
+            labels[i, :len(row_labels)] = row_labels
+            distances[i, :len(row_distances)] = row_distances
+        return labels, distances
+
+    def save(self, index_dir: str, prefix: str = "hnsw"):
+        """
+        Write the graph as flat .npy arrays so that `load` can memory-map it; vectors are not written,
+        they belong to the embedding store.
+        """
+        levels = np.array([len(node_links) - 1 for node_links in self.links], dtype=np.int64)
+        counts = np.array([len(level_links) for node_links in self.links for level_links in node_links], dtype=np.int64)
+        flat_links = np.array([n for node_links in self.links for level_links in node_links for n in level_links],
+                              dtype=np.int32)
+        params = np.array([self.dim, self.M, self.ef_construction, self.ef, self.entry_point, self.max_level],
+                          dtype=np.int64)
+        arrays = {"params": params,
+                  "node_slots": np.concatenate([[0], np.cumsum(levels + 1)]),
+                  "slot_offsets": np.concatenate([[0], np.cumsum(counts)]),
+                  "links": flat_links}
+        for name, array in arrays.items():
+            # replace instead of overwrite: the previous arrays may still be memory-mapped
+            path = os.path.join(index_dir, f"{prefix}_{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_dir: str, vectors: np.ndarray, prefix: str = "hnsw") -> "HNSWIndex":
+        """
+        Memory-map a graph written by `save`; adjacency lists are only materialized for visited nodes.
+        """
+        dim, M, ef_construction, ef, entry_point, max_level = \
+            np.load(os.path.join(index_dir, f"{prefix}_params.npy")).tolist()
+        index = cls(dim, M=M, ef_construction=ef_construction)
+        index.ef, index.entry_point, index.max_level = ef, entry_point, max_level
+        index.vectors = vectors
+        index.links = _LazyLinks(*(np.load(os.path.join(index_dir, f"{prefix}_{name}.npy"), mmap_mode="r")
+                                   for name in ("node_slots", "slot_offsets", "links")))
+        return index
+
+
+class _LazyLinks(object):
+    """
+    List-like view over a memory-mapped adjacency structure. A node's links are converted to
+    Python lists on first access and kept, so that later insertions can mutate them.
+    """
+
+    def __init__(self, node_slots: np.ndarray, slot_offsets: np.ndarray, flat_links: np.ndarray):
+        self.node_slots = node_slots
+        self.slot_offsets = slot_offsets
+        self.flat_links = flat_links
+        self.n_stored = len(node_slots) - 1
+        self.materialized = {}
+        self.appended = []
+
+    def __len__(self):
+        return self.n_stored + len(self.appended)
+
+    def __getitem__(self, label: int) -> list[list[int]]:
+        if label >= self.n_stored:
+            return self.appended[label - self.n_stored]
+        node_links = self.materialized.get(label)
+        if node_links is None:
+            node_links = [self.flat_links[self.slot_offsets[slot]: self.slot_offsets[slot + 1]].tolist()
+                          for slot in range(self.node_slots[label], self.node_slots[label + 1])]
+            self.materialized[label] = node_links
+        return node_links
+
+    def __iter__(self):
+        for label in range(len(self)):
+            yield self[label]
+
+    def append(self, node_links: list[list[int]]):
+        self.appended.append(node_links)
@@ -0,0 +1,39 @@
+import json
+import os
+
+_CHECKPOINT = "checkpoint.json"
+
+
+def read_jsonl_tail(path: str, offset: int = 0) -> tuple[list[dict], int]:
+    """
+    Read the complete JSONL lines of `path` starting at byte `offset`.
+    A trailing line without newline is still being written by the producer and is left for the next read.
+    Returns the entries and the offset to resume from.
+    """
+    if os.path.getsize(path) < offset:
+        raise ValueError(f"{path} is shorter than the checkpoint offset {offset}; it was rewritten, rebuild the index")
+
+    entries = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries, offset
+
+
+def load_checkpoint(index_dir: str) -> dict:
+    with open(os.path.join(index_dir, _CHECKPOINT), "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(index_dir: str, source: str, offset: int):
+    """
+    Record how far `source` has been indexed. Written after the index itself, so a crash in between
+    at worst re-reads entries that are then indexed twice rather than skipped.
+    """
+    with open(os.path.join(index_dir, _CHECKPOINT), "w") as f:
+        json.dump({"source": os.path.abspath(source), "offset": offset}, f, indent=4)
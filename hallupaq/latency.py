@@ -0,0 +1,115 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class LatencyHistogram:
+    """
+    Latency histogram in the style of HdrHistogram. Values are counted in logarithmic buckets each `precision`
+    wider than the previous one, so every percentile is reported to within that relative error in memory that
+    grows with the range of the values, not their number. Values below `lowest` share the first bucket.
+    """
+
+    def __init__(self, precision: float = 0.01, lowest: float = 1e-6):
+        self.precision = precision
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        self._buckets = dict()
+        self.count, self.total = 0, 0.0
+        self.min, self.max = math.inf, 0.0
+
+    def record(self, value: float):
+        bucket = int(math.log(max(value, self.lowest) / self.lowest) / self._log_base)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        if (other.precision, other.lowest) != (self.precision, self.lowest):
+            raise ValueError("Cannot merge histograms with different buckets")
+        for bucket, count in other._buckets.items():
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """
+        Value at or below which `q` percent of the recorded values fall: the upper edge of its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = max(1, math.ceil(q / 100 * self.count)), 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(max(self.lowest * (1 + self.precision) ** (bucket + 1), self.min), self.max)
+        return self.max
+
+
+class StageTimer:
+    """
+    Named latency spans, aggregated into one `LatencyHistogram` per stage. Spans may be recorded from any
+    thread. Inside `collect()`, the spans of the calling thread are also summed per stage into a dict, which
+    gives the breakdown of one unit of work (e.g. one entry) processed by that thread.
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self.histograms = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram(self.precision)
+            histogram.record(seconds)
+        breakdown = getattr(self._local, "breakdown", None)
+        if breakdown is not None:
+            breakdown[stage] = breakdown.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Time the enclosed block as one span of `stage`, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def collect(self):
+        """
+        Yield a dict that receives the seconds spent per stage by the spans of this thread inside the block.
+        """
+        previous = getattr(self._local, "breakdown", None)
+        breakdown = self._local.breakdown = dict()
+        try:
+            yield breakdown
+        finally:
+            self._local.breakdown = previous
+
+    def summary(self) -> str:
+        """
+        Count, mean, p50/p95/p99, max and total time per stage, in the order the stages were first seen.
+        """
+        lines = [f"{'Stage':<12} {'Count':>7} {'Mean (ms)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} "
+                 f"{'Max (ms)':>10} {'Total (s)':>10}"]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                lines.append(f"{stage:<12} {histogram.count:>7} {1000 * histogram.mean:>10.3f} " +
+                             " ".join(f"{1000 * histogram.percentile(q):>10.3f}" for q in (50, 95, 99)) +
+                             f" {1000 * histogram.max:>10.3f} {histogram.total:>10.2f}")
+        return "\n".join(lines)
@@ -0,0 +1,123 @@
+import numpy as np
+from .flat import FlatIndex
+from .hnsw import HNSWIndex
+from .quantization import QuantizedIndex
+from .sharded import ShardedIndex
+from .store import EmbeddingStore
+
+_ENTRY_FIELDS = ("id", "question", "answer")
+
+
+class PAQIndex:
+    """
+    Probable-Asked-Question corpus indexed by question embedding.
+    The confidence score of a question is the squared L2 distance to its nearest PAQ question,
+    so a larger score means less confident.
+    Embeddings and entries live in an `EmbeddingStore` inside the index directory; the HNSW graph is saved next to it.
+    """
+
+    def __init__(self, store: EmbeddingStore, index: HNSWIndex):
+        self.store = store
+        self.index = index
+        if len(store.deleted):
+            index.mark_deleted(store.deleted)
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def embedder_name(self) -> str:
+        return self.store.embedder_name
+
+    @classmethod
+    def build(cls, entries: list[dict], embedder, index_dir: str, M: int = 16, ef_construction: int = 100,
+              batch_size: int = 64, dtype: str = "float32") -> "PAQIndex":
+        entries = [{field: entry.get(field) for field in _ENTRY_FIELDS} for entry in entries]
+        vectors = embedder.embed([entry["question"] for entry in entries], batch_size=batch_size)
+        store = EmbeddingStore.create(index_dir, entries, vectors, embedder.name, dtype=dtype)
+        index = HNSWIndex(store.dim, M=M, ef_construction=ef_construction)
+        # build over the stored (possibly float16) values so graph and search see the same vectors
+        index.extend(store.vectors)
+        return cls(store, index)
+
+    def insert(self, entries: list[dict], embedder, batch_size: int = 64) -> int:
+        """
+        Embed new PAQ entries, append them to the store and link them into the search index.
+        Returns the number of inserted entries.
+        """
+        if embedder.name != self.embedder_name:
+            raise ValueError(f"Index was built with embedder {self.embedder_name}, got {embedder.name}")
+        if not entries:
+            return 0
+        entries = [{field: entry.get(field) for field in _ENTRY_FIELDS} for entry in entries]
+        vectors = embedder.embed([entry["question"] for entry in entries], batch_size=batch_size)
+        self.store.append(entries, vectors)
+        self.index.extend(self.store.vectors)
+        return len(entries)
+
+    def delete(self, entries: list[dict]) -> int:
+        """
+        Tombstone one row per given entry, matched on both `id` and `question` since ids alone are not unique.
+        Deletion is idempotent: an (id, question) listed n times ends up with n tombstoned rows in total, so
+        re-applying the same or a cumulative removed file only deletes what is new. Live matches are removed
+        from the last one, mirroring dedup.py which keeps the first occurrence.
+        Returns the number of newly deleted rows.
+        """
+        requested = dict()
+        for entry in entries:
+            key = (entry["id"], entry["question"])
+            requested[key] = requested.get(key, 0) + 1
+
+        deleted = set(self.store.deleted.tolist())
+        rows = []
+        for (entry_id, question), count in requested.items():
+            matches = [row for row in self.store.rows_of(entry_id) if self.store.entry(row)["question"] == question]
+            live = [row for row in matches if row not in deleted]
+            n_new = min(count - (len(matches) - len(live)), len(live))
+            if n_new > 0:
+                rows.extend(live[len(live) - n_new:])
+        if rows:
+            self.store.delete(rows)
+            self.index.mark_deleted(rows)
+        return len(rows)
+
+    def search(self, vectors: np.ndarray, k: int = 1, ef: int = None) -> list[list[dict]]:
+        """
+        Search question embeddings; returns the `retrieved_qas` list for each row, nearest first.
+        `ef` is the search effort: beam width for HNSW, number of re-ranked candidates for quantized codes.
+        """
+        labels, distances = self.index.knn_query(vectors, k, ef)
+        results = []
+        for row_labels, row_distances in zip(labels.tolist(), distances.tolist()):
+            results.append([dict(self.store.entry(label), score=dist)
+                            for label, dist in zip(row_labels, row_distances) if label >= 0])
+        return results
+
+    def query(self, questions: list[str], embedder, k: int = 1, ef: int = None,
+              batch_size: int = 64) -> list[list[dict]]:
+        if embedder.name != self.embedder_name:
+            raise ValueError(f"Index was built with embedder {self.embedder_name}, got {embedder.name}")
+        return self.search(embedder.embed(questions, batch_size=batch_size), k, ef)
+
+    def save(self):
+        self.index.save(self.store.store_dir)
+
+    @classmethod
+    def load(cls, index_dir: str, codec: str = None, exact: bool = False, n_shards: int = 0,
+             n_workers: int = None) -> "PAQIndex":
+        """
+        Open an index directory. With `codec` (sq8/pq) the compressed codes are searched instead of the
+        HNSW graph and candidates are re-ranked against the stored embeddings. With `exact` the stored
+        embeddings are scanned with matrix products. With `n_shards` the search (HNSW or exact) is
+        split across shards and run by `n_workers` processes.
+        """
+        store = EmbeddingStore(index_dir)
+        if n_shards:
+            if codec is not None:
+                raise ValueError("Sharded search supports HNSW and exact shards, not quantized codes")
+            return cls(store, ShardedIndex.load(index_dir, n_shards, n_workers, exact=exact))
+        if exact:
+            return cls(store, FlatIndex(store.vectors))
+        if codec is not None:
+            return cls(store, QuantizedIndex.load(index_dir, codec, store.vectors))
+        return cls(store, HNSWIndex.load(index_dir, store.vectors))
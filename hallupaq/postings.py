@@ -0,0 +1,77 @@
+import numpy as np
+
+BLOCK_SIZE = 128
+
+
+def _varint_lengths(values: np.ndarray) -> np.ndarray:
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        n_bytes += values >= np.uint64(1 << shift)
+    return n_bytes
+
+
+def encode_varints(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    LEB128 varints: 7 bits per byte, low bits first, high bit set on every byte but the last of a value.
+    Returns the bytes and the number of bytes of every value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = _varint_lengths(values)
+    owner = np.repeat(np.arange(len(values)), n_bytes)
+    byte_index = np.arange(len(owner)) - np.repeat(np.cumsum(n_bytes) - n_bytes, n_bytes)
+    encoded = ((values[owner] >> (7 * byte_index).astype(np.uint64)) & np.uint64(127)).astype(np.uint8)
+    encoded[byte_index < n_bytes[owner] - 1] |= 128
+    return encoded, n_bytes
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    data = np.asarray(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+    last = data < 128
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    value_of = np.concatenate([[0], np.cumsum(last)[:-1]])
+    shifts = 7 * (np.arange(len(data)) - starts[value_of])
+    return np.bitwise_or.reduceat((data & 127).astype(np.int64) << shifts, starts)
+
+
+def encode_blocks(df: np.ndarray, docs: np.ndarray, tfs: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compress the postings of consecutive terms (`df[t]` postings each, documents increasing within a term).
+    Every term is cut into blocks of `BLOCK_SIZE` postings; a block holds the varint document gaps followed by
+    the varint term frequencies. Gaps chain across the blocks of a term (the first one is the document id).
+    Returns the bytes, the byte length of every block and the last document of every block (the skip entries).
+    """
+    df = np.asarray(df, dtype=np.int64)
+    docs = np.asarray(docs, dtype=np.int64)
+    term_of = np.repeat(np.arange(len(df)), df)
+    position = np.arange(len(docs)) - np.repeat(np.cumsum(df) - df, df)
+    n_blocks = -(-df // BLOCK_SIZE)
+    block_of = np.repeat(np.cumsum(n_blocks) - n_blocks, df) + position // BLOCK_SIZE
+
+    gaps = docs - np.where(position == 0, 0, np.concatenate([[0], docs[:-1]]))
+    values = np.concatenate([gaps, tfs])
+    blocks = np.concatenate([block_of, block_of])
+    order = np.lexsort((np.repeat([0, 1], len(docs)), blocks))  # stable: (block, gaps before tfs, position)
+    encoded, n_bytes = encode_varints(values[order])
+    block_bytes = np.bincount(blocks[order], weights=n_bytes, minlength=int(n_blocks.sum())).astype(np.int64)
+    block_last_doc = docs[np.cumsum(np.bincount(block_of, minlength=int(n_blocks.sum()))) - 1]
+    return encoded, block_bytes, block_last_doc.astype(np.int32)
+
+
+def decode_blocks(data: np.ndarray, counts: np.ndarray, bases: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Inverse of `encode_blocks` for the concatenated bytes of any blocks holding `counts` postings each.
+    `bases` is, per block, the last document of the block before it in its term (0 for the first block of a term).
+    """
+    values = decode_varints(data)
+    counts = np.asarray(counts, dtype=np.int64)
+    block_of = np.repeat(np.arange(len(counts)), 2 * counts)
+    position = np.arange(len(values)) - np.repeat(np.cumsum(2 * counts) - 2 * counts, 2 * counts)
+    is_gap = position < counts[block_of]
+    gaps = values[is_gap]
+    # cumulative sum restarted at every block
+    docs = np.cumsum(gaps)
+    starts = np.cumsum(counts) - counts
+    docs += np.repeat(np.asarray(bases, dtype=np.int64) - (docs[starts] - gaps[starts]), counts)
+    return docs, values[~is_gap]
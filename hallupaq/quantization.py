@@ -0,0 +1,214 @@
+import os
+import numpy as np
+
+
+class ScalarQuantizer:
+    """
+    8-bit scalar quantizer: every dimension is mapped linearly from its [min, max] range onto 256 levels.
+    Codes take 1 byte per dimension, a quarter of float32.
+    """
+    name = "sq8"
+
+    def __init__(self):
+        self.vmin = None
+        self.scale = None
+
+    def train(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.vmin = vectors.min(axis=0)
+        self.scale = np.maximum(vectors.max(axis=0) - self.vmin, 1e-12) / 255
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.vmin
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Approximate squared L2 distances between one query and all codes.
+        """
+        diff = (codes.astype(np.float32) - (query - self.vmin) / self.scale) * self.scale
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def params(self) -> dict:
+        return {"vmin": self.vmin, "scale": self.scale}
+
+    @classmethod
+    def from_params(cls, params: dict) -> "ScalarQuantizer":
+        quantizer = cls()
+        quantizer.vmin, quantizer.scale = params["vmin"], params["scale"]
+        return quantizer
+
+
+class ProductQuantizer:
+    """
+    Product quantizer (Jegou et al., 2011): vectors are split into `n_subvectors` slices and every slice is
+    replaced by the id of its nearest k-means centroid, so a vector costs `n_subvectors` bytes.
+    Distances are computed asymmetrically from per-query lookup tables.
+    """
+    name = "pq"
+
+    def __init__(self, n_subvectors: int = 8, n_centroids: int = 256, n_iter: int = 20, max_train: int = 50000,
+                 seed: int = 42):
+        if n_centroids > 256:
+            raise ValueError("Codes are stored as uint8, so n_centroids must be at most 256")
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.max_train = max_train
+        self.seed = seed
+        self.centroids = None  # (n_subvectors, n_centroids, sub_dim)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        if dim % self.n_subvectors:
+            raise ValueError(f"Dimension {dim} is not divisible by n_subvectors={self.n_subvectors}")
+        return vectors.reshape(n, self.n_subvectors, dim // self.n_subvectors)
+
+    @staticmethod
+    def _assign(sub_vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        dists = (centroids ** 2).sum(axis=1)[None, :] - 2 * sub_vectors @ centroids.T
+        return dists.argmin(axis=1)
+
+    def train(self, vectors: np.ndarray) -> "ProductQuantizer":
+        rng = np.random.default_rng(self.seed)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > self.max_train:
+            vectors = vectors[np.sort(rng.choice(len(vectors), self.max_train, replace=False))]
+        sub_vectors = self._split(vectors)
+        n_centroids = min(self.n_centroids, len(vectors))
+
+        self.centroids = np.zeros((self.n_subvectors, self.n_centroids, sub_vectors.shape[2]), dtype=np.float32)
+        for m in range(self.n_subvectors):
+            data = sub_vectors[:, m, :]
+            centroids = data[rng.choice(len(data), n_centroids, replace=False)].copy()
+            for _ in range(self.n_iter):
+                assignment = self._assign(data, centroids)
+                counts = np.bincount(assignment, minlength=n_centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, data)
+                non_empty = counts > 0
+                centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+            self.centroids[m, :n_centroids] = centroids
+            # unused slots (tiny corpora) repeat the first centroid so they never win an assignment tie
+            self.centroids[m, n_centroids:] = centroids[0]
+        return self
+
+    def encode(self, vectors: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for i in range(0, len(vectors), batch_size):
+            sub_vectors = self._split(np.asarray(vectors[i: i + batch_size], dtype=np.float32))
+            for m in range(self.n_subvectors):
+                codes[i: i + batch_size, m] = self._assign(sub_vectors[:, m, :], self.centroids[m])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.centroids[m][codes[:, m]] for m in range(self.n_subvectors)]
+        return np.concatenate(parts, axis=1)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        sub_query = np.asarray(query, dtype=np.float32).reshape(self.n_subvectors, 1, -1)
+        table = ((self.centroids - sub_query) ** 2).sum(axis=2)  # (n_subvectors, n_centroids)
+        return table[np.arange(self.n_subvectors), codes].sum(axis=1)
+
+    def params(self) -> dict:
+        return {"centroids": self.centroids}
+
+    @classmethod
+    def from_params(cls, params: dict) -> "ProductQuantizer":
+        centroids = params["centroids"]
+        quantizer = cls(n_subvectors=centroids.shape[0], n_centroids=centroids.shape[1])
+        quantizer.centroids = centroids
+        return quantizer
+
+
+QUANTIZERS = {ScalarQuantizer.name: ScalarQuantizer, ProductQuantizer.name: ProductQuantizer}
+
+
+class QuantizedIndex:
+    """
+    Brute-force search over compressed codes followed by exact re-ranking.
+    The `rerank` best candidates by approximate distance are re-scored against the full-precision
+    vectors (usually the memory-mapped store), so only those rows are paged in.
+    Exposes the same `knn_query` as `HNSWIndex`.
+    """
+
+    def __init__(self, quantizer, codes: np.ndarray, vectors: np.ndarray = None, rerank: int = 32):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.vectors = vectors
+        self.rerank = rerank
+        self.deleted = set()
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, quantizer, vectors: np.ndarray, rerank: int = 32) -> "QuantizedIndex":
+        quantizer.train(vectors)
+        return cls(quantizer, quantizer.encode(vectors), vectors, rerank)
+
+    def extend(self, vectors: np.ndarray):
+        """
+        Adopt a grown vector matrix and encode its new rows with the already trained codec.
+        """
+        new_codes = self.quantizer.encode(np.asarray(vectors[len(self.codes):], dtype=np.float32))
+        self.codes = np.concatenate([self.codes, new_codes], axis=0)
+        self.vectors = vectors
+
+    def mark_deleted(self, labels):
+        self.deleted.update(int(label) for label in labels)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Resident size of the codes and codec parameters.
+        """
+        return self.codes.nbytes + sum(v.nbytes for v in self.quantizer.params().values())
+
+    def search(self, query: np.ndarray, k: int, rerank: int = None) -> tuple[np.ndarray, np.ndarray]:
+        query = np.asarray(query, dtype=np.float32)
+        approx = self.quantizer.distances(query, self.codes)
+        if self.deleted:
+            approx[list(self.deleted)] = np.inf
+        n_candidates = min(max(rerank or self.rerank, k), len(approx) - len(self.deleted))
+        if n_candidates == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidates = np.argpartition(approx, n_candidates - 1)[:n_candidates]
+
+        if self.vectors is None:
+            distances = approx[candidates]
+        else:
+            order = np.sort(candidates)  # sorted rows read the memory map sequentially
+            diff = np.asarray(self.vectors[order], dtype=np.float32) - query
+            candidates, distances = order, np.einsum("ij,ij->i", diff, diff)
+        best = np.argsort(distances, kind="stable")[:k]
+        return candidates[best].astype(np.int64), distances[best].astype(np.float32)
+
+    def knn_query(self, queries: np.ndarray, k: int, rerank: int = None) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            row_labels, row_distances = self.search(query, k, rerank)
+            labels[i, :len(row_labels)] = row_labels
+            distances[i, :len(row_distances)] = row_distances
+        return labels, distances
+
+    def save(self, index_dir: str):
+        np.save(os.path.join(index_dir, f"{self.quantizer.name}_codes.npy"), self.codes)
+        np.savez(os.path.join(index_dir, f"{self.quantizer.name}_params.npz"), **self.quantizer.params())
+
+    @classmethod
+    def load(cls, index_dir: str, codec: str, vectors: np.ndarray = None, rerank: int = 32) -> "QuantizedIndex":
+        if codec not in QUANTIZERS:
+            raise ValueError(f"Unknown codec {codec}; expected one of {list(QUANTIZERS)}")
+        with np.load(os.path.join(index_dir, f"{codec}_params.npz")) as data:
+            quantizer = QUANTIZERS[codec].from_params(dict(data))
+        # codes are read into memory on purpose: they are the part meant to stay resident
+        codes = np.load(os.path.join(index_dir, f"{codec}_codes.npy"))
+        return cls(quantizer, codes, vectors, rerank)
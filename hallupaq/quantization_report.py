@@ -0,0 +1,50 @@
+import argparse
+import time
+import jsonlines
+import numpy as np
+from sklearn.metrics import roc_auc_score
+from .embedder import Embedder
+from .quantization import QuantizedIndex
+from .paq_index import PAQIndex
+
+
+def _evaluate(index, vectors: np.ndarray, labels: list[bool], ef: int) -> tuple[float, float]:
+    start = time.time()
+    _, distances = index.knn_query(vectors, 1, ef)
+    search_time = (time.time() - start) / max(len(vectors), 1)
+    return roc_auc_score(labels, distances[:, 0]), search_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Compare ROC-AUC and memory of the full-precision and quantized PAQ indexes.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index and hallupaq.quantize_index.")
+    parser.add_argument("input_jsonl", help="Path to a labelled split, e.g. PAQ/test.jsonl. Uncovered entries are the positive class.")
+    parser.add_argument("--codecs", nargs="+", default=["sq8", "pq"], help="Codecs to evaluate.")
+    parser.add_argument("--rerank", default=32, type=int, help="Number of candidates re-ranked exactly.")
+    parser.add_argument("--ef", default=64, type=int, help="HNSW beam width for the full-precision baseline.")
+    parser.add_argument("--output_file", required=False, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    paq_index = PAQIndex.load(args.index_dir)
+    with jsonlines.open(args.input_jsonl, "r") as reader:
+        entries = list(reader)
+    labels = [not entry["covered"] for entry in entries]
+    vectors = Embedder(paq_index.embedder_name).embed([entry["question"] for entry in entries])
+
+    full_bytes = paq_index.store.vectors.nbytes
+    rows = [("HNSW " + paq_index.store.dtype, full_bytes) + _evaluate(paq_index.index, vectors, labels, args.ef)]
+    for codec in args.codecs:
+        index = QuantizedIndex.load(args.index_dir, codec, paq_index.store.vectors)
+        rows.append((f"{codec} + re-rank {args.rerank}", index.nbytes) + _evaluate(index, vectors, labels, args.rerank))
+        index.vectors = None  # codes only
+        rows.append((f"{codec} codes only", index.nbytes) + _evaluate(index, vectors, labels, args.rerank))
+
+    lines = [f"{'Index':<24} {'Resident MiB':>12} {'Saving':>8} {'ROC-AUC':>8} {'Search (s)':>11}"]
+    for name, nbytes, roc_auc, search_time in rows:
+        lines.append(f"{name:<24} {nbytes / 2 ** 20:>12.2f} {full_bytes / nbytes:>7.1f}x {roc_auc:>8.5f} {search_time:>11.5f}")
+    lines.append("Re-ranked rows are read from the memory-mapped store on demand and are not counted as resident.")
+    report = "\n".join(lines)
+    print(report)
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            print(report, file=f)
@@ -0,0 +1,25 @@
+import argparse
+import time
+from .quantization import ScalarQuantizer, ProductQuantizer, QuantizedIndex
+from .store import EmbeddingStore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Compress the embeddings of a PAQ index with int8 scalar or product quantization.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index.")
+    parser.add_argument("--codec", default="sq8", choices=["sq8", "pq"], help="Quantization codec.")
+    parser.add_argument("--n_subvectors", default=8, type=int, help="Number of PQ sub-vectors (bytes per vector).")
+    parser.add_argument("--n_centroids", default=256, type=int, help="Number of k-means centroids per PQ sub-vector.")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.index_dir)
+    if args.codec == "sq8":
+        quantizer = ScalarQuantizer()
+    else:
+        quantizer = ProductQuantizer(n_subvectors=args.n_subvectors, n_centroids=args.n_centroids)
+
+    start = time.time()
+    index = QuantizedIndex.build(quantizer, store.vectors)
+    index.save(args.index_dir)
+    print(f"Encoded {len(store)} embeddings with {args.codec} in {time.time() - start:.1f}s: "
+          f"{store.vectors.nbytes / 2 ** 20:.2f} MiB -> {index.nbytes / 2 ** 20:.2f} MiB")
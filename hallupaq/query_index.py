@@ -0,0 +1,39 @@
+import argparse
+import time
+import jsonlines
+from .embedder import Embedder
+from .paq_index import PAQIndex
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Query a PAQ index with the questions of a JSONL file.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index.")
+    parser.add_argument("input_jsonl", help="Path to the questions to score, e.g. PAQ/test.jsonl.")
+    parser.add_argument("output_jsonl", help="Path to the retrieval result JSONL file.")
+    parser.add_argument("--k", default=1, type=int, help="Number of PAQ neighbours to retrieve per question.")
+    parser.add_argument("--ef", default=64, type=int, help="Beam width used at search time.")
+    parser.add_argument("--batch_size", default=64, type=int, help="Number of questions embedded and searched at once.")
+    args = parser.parse_args()
+
+    paq_index = PAQIndex.load(args.index_dir)
+    embedder = Embedder(paq_index.embedder_name)
+    with jsonlines.open(args.input_jsonl, "r") as reader:
+        entries = list(reader)
+
+    embed_time, search_time = 0.0, 0.0
+    with jsonlines.open(args.output_jsonl, "w") as writer:
+        for i in range(0, len(entries), args.batch_size):
+            batch = entries[i: i + args.batch_size]
+            start = time.time()
+            vectors = embedder.embed([entry["question"] for entry in batch], batch_size=args.batch_size)
+            embed_time += time.time() - start
+
+            start = time.time()
+            retrieved = paq_index.search(vectors, k=args.k, ef=args.ef)
+            search_time += time.time() - start
+
+            writer.write_all({"input_qa": entry, "retrieved_qas": retrieved_qas}
+                             for entry, retrieved_qas in zip(batch, retrieved))
+
+    n = max(len(entries), 1)
+    print(f"Average time per question: {embed_time / n:.5f} (embed) + {search_time / n:.5f} (HNSW search)")
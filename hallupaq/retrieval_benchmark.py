@@ -0,0 +1,80 @@
+import argparse
+import os
+import time
+import jsonlines
+import numpy as np
+from .bm25 import BM25Index
+from .dense_retrieval import DenseChunkIndex, hybrid_search
+from .embedder import Embedder, DEFAULT_MODEL
+from .text import normalize_text
+
+
+def _split(entry: dict) -> str:
+    # same split rule as analysis_scripts/simulated_rag.py
+    if isinstance(entry["id"], str) and "pubmed" in entry["id"]:
+        return "pubmed"
+    if isinstance(entry["id"], int):
+        return "surreal"
+    return "covered"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Compare BM25, dense and hybrid chunk retrieval on latency and recall.")
+    parser.add_argument("knowledge_jsonl", help="Path to the knowledge source, e.g. knowledge_source/knowledge_source.jsonl.")
+    parser.add_argument("input_jsonl", help="Questions with their gold `doc_chunk`, e.g. PAQ/validation.jsonl.")
+    parser.add_argument("--dense_index", required=False,
+                        help="Dense chunk index directory, built if missing; defaults to <knowledge source>_dense.")
+    parser.add_argument("--model_name", default=DEFAULT_MODEL, help="HuggingFace encoder used to embed chunks and questions.")
+    parser.add_argument("--max_length", default=256, type=int, help="Encoder truncation length in tokens.")
+    parser.add_argument("--hnsw", action="store_true", help="Search the chunk embeddings with HNSW instead of exactly.")
+    parser.add_argument("--ef", default=None, type=int, help="HNSW beam width.")
+    parser.add_argument("--k", nargs="+", default=[1, 5, 10], type=int, help="Cut-offs at which recall is reported.")
+    parser.add_argument("--fusion_depth", default=50, type=int, help="Documents per ranking fused by the hybrid retriever.")
+    parser.add_argument("--n_queries", default=200, type=int, help="Number of questions timed one at a time.")
+    parser.add_argument("--output_file", required=False, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    bm25 = BM25Index.load_or_build(args.knowledge_jsonl)
+    dense_dir = args.dense_index or os.path.splitext(args.knowledge_jsonl)[0] + "_dense"
+    embedder = Embedder(args.model_name, max_length=args.max_length)
+    start = time.time()
+    dense = DenseChunkIndex.load_or_build(dense_dir, bm25, embedder, hnsw=args.hnsw)
+    print(f"Dense index over {len(dense)} chunks ready in {time.time() - start:.1f}s")
+
+    # gold document of every question whose chunk is in the knowledge source
+    doc_ids = {bm25.document(doc_id): doc_id for doc_id in range(len(bm25))}
+    with jsonlines.open(args.input_jsonl, "r") as reader:
+        entries = list(reader)
+    questions = [entry["question"] for entry in entries]
+    splits = np.array([_split(entry) for entry in entries])
+    gold = np.array([doc_ids.get(entry.get("doc_chunk"), -1) for entry in entries])
+
+    max_k = max(args.k)
+    methods = {
+        "bm25": lambda batch, k: bm25.top_k_batch([normalize_text(question) for question in batch], k)[0],
+        "dense": lambda batch, k: dense.search(batch, k, args.ef)[0],
+        "hybrid": lambda batch, k: hybrid_search(bm25, dense, batch, k, args.fusion_depth),
+    }
+    split_names = [name for name in ("covered", "pubmed", "surreal") if ((splits == name) & (gold >= 0)).any()]
+    lines = [f"{len(bm25)} chunks, {len(questions)} questions, "
+             f"{(gold >= 0).sum()} with their chunk in the knowledge source",
+             f"{'Method':<8} {'Mean (ms)':>9} {'p95 (ms)':>9} " +
+             " ".join(f"{f'{split} R@{k}':>14}" for split in split_names for k in args.k)]
+    for name, method in methods.items():
+        times = []
+        for question in questions[:args.n_queries]:
+            start = time.time()
+            method([question], 1)
+            times.append(time.time() - start)
+        ranked = method(questions, max_k)
+        hits = ranked == gold[:, None]
+        recalls = [hits[(splits == split) & (gold >= 0), :k].any(axis=1).mean()
+                   for split in split_names for k in args.k]
+        lines.append(f"{name:<8} {1000 * np.mean(times):>9.3f} {1000 * np.percentile(times, 95):>9.3f} " +
+                     " ".join(f"{recall:>14.4f}" for recall in recalls))
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            print(report, file=f)
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class RetrievalCache:
+    """
+    Two-tier cache of retrieval results (top-k document ids), laid out like `CachedEmbedder`.
+
+    Tier 1 is an in-memory LRU bounded by `max_memory_entries`. Tier 2 (optional) is a SQLite file bounded by
+    `max_disk_entries`, evicting the least recently used rows. Keys are hashes of the query key (e.g. the
+    normalized token tuple), k and `version`, the build id of the index that produced the results, so results
+    of another build are never returned. Rows of older versions of the same `scope` (backend and knowledge
+    source) are deleted when the cache is opened, so a rebuilt index starts from an empty cache.
+    """
+
+    def __init__(self, scope: str, version: str, max_memory_entries: int = 100000, cache_path: str = None,
+                 max_disk_entries: int = 10000000):
+        self.scope = scope
+        self.version = version
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = 0
+        self.memory_hits, self.disk_hits, self.misses = 0, 0, 0
+        self.memory_evictions, self.disk_evictions, self.invalidated = 0, 0, 0
+
+        self._db = None
+        if cache_path is not None:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, scope TEXT NOT NULL, "
+                             "version TEXT NOT NULL, doc_ids BLOB NOT NULL, last_used INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.invalidated = self._db.execute("DELETE FROM results WHERE scope = ? AND version != ?",
+                                                (scope, version)).rowcount
+            self._db.commit()
+            self._clock = self._db.execute("SELECT COALESCE(MAX(last_used), 0) FROM results").fetchone()[0]
+
+    def _key(self, query: tuple, k: int) -> bytes:
+        key = json.dumps([self.scope, self.version, k, list(query)])
+        return hashlib.sha1(key.encode("utf-8", "surrogatepass")).digest()
+
+    def _remember(self, key: bytes, doc_ids: np.ndarray):
+        if self.max_memory_entries <= 0:  # memory tier disabled
+            return
+        self._memory[key] = doc_ids
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.memory_evictions += 1
+
+    def get(self, queries: list[tuple], k: int) -> tuple[list, list[int]]:
+        """
+        Cached top-k document ids of every query (None where missing) and the positions of the missing ones.
+        """
+        keys = [self._key(query, k) for query in queries]
+        results = [None] * len(queries)
+        with self._lock:
+            missing = dict()  # key -> positions in `queries`
+            for i, key in enumerate(keys):
+                doc_ids = self._memory.get(key)
+                if doc_ids is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    results[i] = doc_ids
+                    self.memory_hits += 1
+
+            if missing and self._db is not None:
+                found = dict()
+                missing_keys = list(missing)
+                for i in range(0, len(missing_keys), 500):  # stay below SQLite's bound-parameter limit
+                    chunk = missing_keys[i: i + 500]
+                    rows = self._db.execute(f"SELECT key, doc_ids FROM results WHERE key IN "
+                                            f"({','.join('?' * len(chunk))})", chunk).fetchall()
+                    found.update((key, np.frombuffer(doc_ids, dtype=np.int64)) for key, doc_ids in rows)
+                if found:
+                    self._clock += 1
+                    self._db.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                         [(self._clock, key) for key in found])
+                    self._db.commit()
+                for key, doc_ids in found.items():
+                    self._remember(key, doc_ids)
+                    for i in missing.pop(key):
+                        results[i] = doc_ids
+                        self.disk_hits += 1
+            self.misses += sum(len(positions) for positions in missing.values())
+        return results, sorted(i for positions in missing.values() for i in positions)
+
+    def put(self, queries: list[tuple], k: int, doc_ids: np.ndarray):
+        items = {self._key(query, k): np.asarray(row, dtype=np.int64) for query, row in zip(queries, doc_ids)}
+        with self._lock:
+            for key, row in items.items():
+                self._remember(key, row)
+            if self._db is None:
+                return
+            self._clock += 1
+            self._db.executemany("INSERT OR REPLACE INTO results (key, scope, version, doc_ids, last_used) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 [(key, self.scope, self.version, row.tobytes(), self._clock)
+                                  for key, row in items.items()])
+            n_rows = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if n_rows > self.max_disk_entries:
+                n_evicted = n_rows - self.max_disk_entries
+                self._db.execute("DELETE FROM results WHERE key IN "
+                                 "(SELECT key FROM results ORDER BY last_used LIMIT ?)", (n_evicted,))
+                self.disk_evictions += n_evicted
+            self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "memory_evictions": self.memory_evictions, "disk_evictions": self.disk_evictions,
+                "invalidated": self.invalidated,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,61 @@
+import argparse
+import time
+import jsonlines
+from .embedding_cache import CachedEmbedder
+from .scorer import HalluPAQScorer
+
+
+def _read_batches(path: str, batch_size: int):
+    batch = []
+    with jsonlines.open(path, "r") as reader:
+        for entry in reader:
+            batch.append(entry)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Stream a QA split through the HalluPAQ scorer in batches.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index.")
+    parser.add_argument("input_jsonl", help="Path to the questions to score, e.g. PAQ/validation.jsonl or PAQ/test.jsonl.")
+    parser.add_argument("output_jsonl", help="Path to the retrieval result JSONL file.")
+    parser.add_argument("--batch_size", default=512, type=int, help="Number of questions scored per call.")
+    parser.add_argument("--k", default=1, type=int, help="Number of PAQ neighbours to keep per question.")
+    parser.add_argument("--ef", default=None, type=int, help="Search effort (HNSW beam width or re-rank size).")
+    parser.add_argument("--codec", default=None, choices=["sq8", "pq"], help="Search quantized codes instead of HNSW.")
+    parser.add_argument("--exact", action="store_true", help="Exact search with matrix products instead of HNSW.")
+    parser.add_argument("--exact_match", action="store_true",
+                        help="Answer questions matching a PAQ question after normalization from a hash table, without embedding.")
+    parser.add_argument("--memory_cache_size", default=0, type=int, help="Number of embeddings kept in the in-memory LRU.")
+    parser.add_argument("--embedding_cache", required=False, help="SQLite file persisting embeddings across runs.")
+    parser.add_argument("--n_shards", default=0, type=int,
+                        help="Search the index in this many shards (HNSW shards come from hallupaq.build_shards).")
+    parser.add_argument("--n_workers", default=None, type=int, help="Worker processes of the sharded search (default: n_shards).")
+    args = parser.parse_args()
+
+    scorer = HalluPAQScorer.load(args.index_dir, codec=args.codec, exact=args.exact, exact_match=args.exact_match,
+                                 memory_cache_size=args.memory_cache_size, embedding_cache=args.embedding_cache,
+                                 n_shards=args.n_shards, n_workers=args.n_workers, k=args.k, ef=args.ef)
+
+    n_scored, start = 0, time.time()
+    with jsonlines.open(args.output_jsonl, "w") as writer:
+        for batch in _read_batches(args.input_jsonl, args.batch_size):
+            ids, scores = scorer.score_batch([entry["question"] for entry in batch])
+            for entry, row_ids, row_scores in zip(batch, ids.tolist(), scores.tolist()):
+                writer.write({"input_qa": entry,
+                              "retrieved_qas": [{"id": paq_id, "score": score}
+                                                for paq_id, score in zip(row_ids, row_scores) if paq_id is not None]})
+            n_scored += len(batch)
+
+    elapsed = time.time() - start
+    print(f"Scored {n_scored} QA pairs in {elapsed:.2f}s ({n_scored / max(elapsed, 1e-9):.1f} QA pairs/s)")
+    if args.exact_match:
+        print(f"Exact-match hit rate: {scorer.exact_hit_rate:.4f} ({scorer.exact_hits}/{scorer.exact_lookups} questions not embedded)")
+    if isinstance(scorer.embedder, CachedEmbedder):
+        print(f"Embedding cache: {scorer.embedder.stats()}")
+        scorer.embedder.close()
+    if args.n_shards:
+        scorer.paq_index.index.close()
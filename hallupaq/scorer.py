@@ -0,0 +1,88 @@
+import numpy as np
+from .embedder import Embedder
+from .embedding_cache import CachedEmbedder
+from .exact_match import ExactMatchTable
+from .paq_index import PAQIndex
+
+
+class HalluPAQScorer:
+    """
+    Batched HalluPAQ confidence scoring: a whole batch of questions is embedded in one forward pass
+    and searched in one `knn_query` call. A larger score means less confident.
+    With an `ExactMatchTable`, questions that match a PAQ question after normalization are answered
+    from the hash table with score 0 and never reach the embedder.
+    """
+
+    def __init__(self, paq_index: PAQIndex, embedder=None, k: int = 1, ef: int = None,
+                 exact_match: ExactMatchTable = None):
+        self.paq_index = paq_index
+        self.embedder = embedder if embedder is not None else Embedder(paq_index.embedder_name)
+        if self.embedder.name != paq_index.embedder_name:
+            raise ValueError(f"Index was built with embedder {paq_index.embedder_name}, got {self.embedder.name}")
+        self.k = k
+        self.ef = ef
+        self.exact_match = exact_match
+        self.exact_lookups, self.exact_hits = 0, 0
+        self._id_table = None
+
+    @classmethod
+    def load(cls, index_dir: str, codec: str = None, exact: bool = False, exact_match: bool = False,
+             memory_cache_size: int = 0, embedding_cache: str = None, n_shards: int = 0, n_workers: int = None,
+             **kwargs) -> "HalluPAQScorer":
+        """
+        Open a scorer over an index directory. `memory_cache_size` and/or `embedding_cache`
+        (a SQLite path) put a `CachedEmbedder` in front of the embedder.
+        `n_shards`/`n_workers` search the index with a `ShardedIndex`.
+        """
+        paq_index = PAQIndex.load(index_dir, codec=codec, exact=exact, n_shards=n_shards, n_workers=n_workers)
+        if memory_cache_size or embedding_cache:
+            embedder = kwargs.pop("embedder", None) or Embedder(paq_index.embedder_name)
+            kwargs["embedder"] = CachedEmbedder(embedder, max_memory_entries=memory_cache_size,
+                                                cache_path=embedding_cache)
+        table = None
+        if exact_match:
+            table = ExactMatchTable.load(index_dir, paq_index.store) if ExactMatchTable.exists(index_dir) \
+                else ExactMatchTable.build(paq_index.store)
+        return cls(paq_index, exact_match=table, **kwargs)
+
+    @property
+    def exact_hit_rate(self) -> float:
+        return self.exact_hits / self.exact_lookups if self.exact_lookups else 0.0
+
+    @property
+    def id_table(self) -> np.ndarray:
+        # PAQ ids by row, with a trailing None so that padding label -1 maps to None
+        if self._id_table is None or len(self._id_table) != len(self.paq_index.store) + 1:
+            self._id_table = np.array(list(self.paq_index.store.ids) + [None], dtype=object)
+        return self._id_table
+
+    def search_batch(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        labels, scores = self.paq_index.index.knn_query(vectors, self.k, self.ef)
+        return self.id_table[labels], scores
+
+    def score_batch(self, questions: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score a batch of questions against PAQ.
+        Returns (ids, scores), both of shape (len(questions), k): the PAQ ids of the nearest neighbours
+        (object array) and their squared L2 distances (float32), nearest first.
+        Exact-match hits only fill the first column; the remaining columns are None/inf.
+        """
+        if self.exact_match is None:
+            return self.search_batch(self.embedder.embed(questions, batch_size=max(len(questions), 1)))
+
+        ids = np.full((len(questions), self.k), None, dtype=object)
+        scores = np.full((len(questions), self.k), np.inf, dtype=np.float32)
+        misses = []
+        for i, question in enumerate(questions):
+            row = self.exact_match.lookup(question)
+            if row < 0:
+                misses.append(i)
+            else:
+                ids[i, 0], scores[i, 0] = self.id_table[row], 0.0
+        self.exact_lookups += len(questions)
+        self.exact_hits += len(questions) - len(misses)
+
+        if misses:
+            vectors = self.embedder.embed([questions[i] for i in misses], batch_size=len(misses))
+            ids[misses], scores[misses] = self.search_batch(vectors)
+        return ids, scores
@@ -0,0 +1,53 @@
+import argparse
+import time
+import jsonlines
+from .embedder import Embedder
+from .store import EmbeddingStore
+from .sharded import ShardedIndex, built_shard_counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Measure sharded PAQ search throughput as the shard and worker counts change.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index (and hallupaq.build_shards).")
+    parser.add_argument("input_jsonl", help="Path to the questions to search, e.g. PAQ/validation.jsonl.")
+    parser.add_argument("--n_shards", nargs="+", default=None, type=int,
+                        help="Shard counts to measure; defaults to the counts built in index_dir (1 2 4 8 with --exact).")
+    parser.add_argument("--n_workers", nargs="+", default=[1, 2, 4, 8], type=int, help="Worker counts to measure.")
+    parser.add_argument("--k", default=1, type=int, help="Number of PAQ neighbours to keep per question.")
+    parser.add_argument("--ef", default=None, type=int, help="HNSW beam width.")
+    parser.add_argument("--batch_size", default=512, type=int, help="Number of questions per search call.")
+    parser.add_argument("--exact", action="store_true", help="Exact shards scanned with matrix products instead of HNSW.")
+    parser.add_argument("--output_file", required=False, help="Also write the report to this file.")
+    args = parser.parse_args()
+    if args.n_shards is None:
+        args.n_shards = [1, 2, 4, 8] if args.exact else built_shard_counts(args.index_dir)
+        if not args.n_shards:
+            parser.error(f"No shards built in {args.index_dir}; run hallupaq.build_shards or pass --exact")
+    elif not args.exact:
+        missing = sorted(set(args.n_shards) - set(built_shard_counts(args.index_dir)))
+        if missing:
+            parser.error(f"Shard counts {missing} are not built in {args.index_dir}; "
+                         f"run hallupaq.build_shards --n_shards {' '.join(map(str, missing))}")
+
+    with jsonlines.open(args.input_jsonl, "r") as reader:
+        questions = [entry["question"] for entry in reader]
+    # embeddings are computed once, so only the search is timed
+    vectors = Embedder(EmbeddingStore(args.index_dir).embedder_name).embed(questions)
+
+    lines = [f"{'Shards':>6} {'Workers':>7} {'Search (s)':>10} {'QPS':>10}"]
+    print(lines[0])
+    for n_shards in args.n_shards:
+        for n_workers in args.n_workers:
+            index = ShardedIndex.load(args.index_dir, n_shards, n_workers, exact=args.exact)
+            index.knn_query(vectors[:1], args.k, args.ef)  # warm-up: workers open the shards lazily on first use
+            start = time.time()
+            for i in range(0, len(vectors), args.batch_size):
+                index.knn_query(vectors[i: i + args.batch_size], args.k, args.ef)
+            elapsed = time.time() - start
+            index.close()
+            lines.append(f"{n_shards:>6} {n_workers:>7} {elapsed:>10.2f} {len(vectors) / max(elapsed, 1e-9):>10.1f}")
+            print(lines[-1])
+    report = "\n".join(lines)
+    if args.output_file:
+        with open(args.output_file, "w") as f:
+            print(report, file=f)
@@ -0,0 +1,150 @@
+import json
+import os
+import re
+from multiprocessing import Pool
+import numpy as np
+from .flat import FlatIndex
+from .hnsw import HNSWIndex
+from .store import EmbeddingStore
+
+# per-process state of pool workers: the opened store and shard indexes
+_WORKER = dict()
+
+
+def shard_bounds(size: int, n_shards: int) -> list[tuple[int, int]]:
+    """
+    Contiguous, near-equal row ranges covering [0, size).
+    """
+    edges = np.linspace(0, size, n_shards + 1).astype(int).tolist()
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def built_shard_counts(index_dir: str) -> list[int]:
+    """
+    Shard counts that `build_shards` has built in `index_dir`, in increasing order.
+    """
+    counts = []
+    for name in os.listdir(index_dir):
+        match = re.fullmatch(r"shards(\d+)\.json", name)
+        if match:
+            counts.append(int(match.group(1)))
+    return sorted(counts)
+
+
+def _shard_prefix(shard_id: int, n_shards: int) -> str:
+    return f"shard{shard_id}of{n_shards}_hnsw"
+
+
+def _build_shard(args) -> int:
+    index_dir, shard_id, n_shards, start, end, M, ef_construction = args
+    store = EmbeddingStore(index_dir)
+    index = HNSWIndex(store.dim, M=M, ef_construction=ef_construction)
+    index.extend(store.vectors[start:end])
+    index.save(index_dir, prefix=_shard_prefix(shard_id, n_shards))
+    return end - start
+
+
+def build_shards(index_dir: str, n_shards: int, n_workers: int = None, M: int = 16, ef_construction: int = 100):
+    """
+    Build one HNSW graph per contiguous row range of the store, in parallel processes.
+    Shard graphs only hold links; every shard reads its rows from the shared memory-mapped store.
+    """
+    store = EmbeddingStore(index_dir)
+    bounds = shard_bounds(len(store), n_shards)
+    tasks = [(index_dir, shard_id, n_shards, start, end, M, ef_construction)
+             for shard_id, (start, end) in enumerate(bounds)]
+    with Pool(n_workers or n_shards) as pool:
+        pool.map(_build_shard, tasks)
+    with open(os.path.join(index_dir, f"shards{n_shards}.json"), "w") as f:
+        json.dump({"n_shards": n_shards, "bounds": bounds, "size": len(store)}, f, indent=4)
+
+
+def _init_worker(index_dir: str, bounds: list, exact: bool):
+    store = EmbeddingStore(index_dir)
+    shards = []
+    for shard_id, (start, end) in enumerate(bounds):
+        if exact:
+            shards.append(FlatIndex(store.vectors[start:end]))
+        else:
+            shards.append(HNSWIndex.load(index_dir, store.vectors[start:end], prefix=_shard_prefix(shard_id, len(bounds))))
+    _WORKER.update(store=store, shards=shards, bounds=bounds)
+
+
+def _search_shard(args) -> tuple[np.ndarray, np.ndarray]:
+    shard_id, queries, k, ef, deleted = args
+    start, end = _WORKER["bounds"][shard_id]
+    shard = _WORKER["shards"][shard_id]
+    local_deleted = set((deleted[(deleted >= start) & (deleted < end)] - start).tolist())
+    if local_deleted != shard.deleted:
+        shard.deleted = local_deleted
+    labels, distances = shard.knn_query(queries, k, ef)
+    return np.where(labels >= 0, labels + start, -1), distances
+
+
+class ShardedIndex:
+    """
+    PAQ search partitioned into contiguous row shards, searched by a pool of worker processes.
+    Workers map the same store files, so the embeddings are shared through the OS page cache.
+    Each call fans out (shard, query chunk) tasks and merges the per-shard top-k into the global top-k.
+    Exposes the same `knn_query` as `HNSWIndex`.
+    """
+
+    def __init__(self, index_dir: str, bounds: list, n_workers: int, exact: bool = False):
+        self.bounds = bounds
+        self.n_workers = n_workers
+        self.exact = exact
+        self.deleted = set()
+        self.pool = Pool(n_workers, initializer=_init_worker, initargs=(index_dir, bounds, exact))
+
+    def __len__(self):
+        return self.bounds[-1][1] if self.bounds else 0
+
+    @classmethod
+    def load(cls, index_dir: str, n_shards: int, n_workers: int = None, exact: bool = False) -> "ShardedIndex":
+        """
+        HNSW shards must have been built with `build_shards`; exact shards are plain row ranges of the store.
+        """
+        shards_file = os.path.join(index_dir, f"shards{n_shards}.json")
+        if exact:
+            # exact shards have nothing built, so they always cover the store as it is now
+            bounds = shard_bounds(len(EmbeddingStore(index_dir)), n_shards)
+        elif os.path.exists(shards_file):
+            with open(shards_file, "r") as f:
+                meta = json.load(f)
+            if meta["size"] != len(EmbeddingStore(index_dir)):
+                raise ValueError(f"Store grew since {shards_file} was built; rebuild the shards")
+            bounds = [tuple(b) for b in meta["bounds"]]
+        else:
+            raise FileNotFoundError(f"{shards_file} not found; build the shards with hallupaq.build_shards first")
+        return cls(index_dir, bounds, n_workers or n_shards, exact)
+
+    def mark_deleted(self, labels):
+        self.deleted.update(int(label) for label in labels)
+
+    def knn_query(self, queries: np.ndarray, k: int, ef: int = None) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not self.bounds:
+            return labels, distances
+        deleted = np.array(sorted(self.deleted), dtype=np.int64)
+        # split queries too, so that idle workers help when there are fewer shards than workers
+        n_chunks = min(max(1, self.n_workers // len(self.bounds)), max(len(queries), 1))
+        chunks = np.array_split(np.arange(len(queries)), n_chunks)
+        tasks = [(shard_id, queries[chunk], k, ef, deleted) for chunk in chunks for shard_id in range(len(self.bounds))]
+        results = self.pool.map(_search_shard, tasks)
+
+        n_shards = len(self.bounds)
+        for i, chunk in enumerate(chunks):
+            chunk_results = results[i * n_shards: (i + 1) * n_shards]
+            merged_labels = np.concatenate([r[0] for r in chunk_results], axis=1)
+            merged_distances = np.concatenate([r[1] for r in chunk_results], axis=1)
+            order = np.argsort(merged_distances, axis=1, kind="stable")[:, :k]
+            rows = np.arange(len(chunk))[:, None]
+            labels[chunk] = merged_labels[rows, order]
+            distances[chunk] = merged_distances[rows, order]
+        return labels, distances
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,163 @@
+import json
+import os
+import numpy as np
+
+_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+class EmbeddingStore:
+    """
+    On-disk PAQ embedding matrix keyed by the PAQ `id` field.
+
+    A store directory holds:
+        embeddings.bin  row-major float32/float16 matrix, opened with numpy.memmap
+        entries.jsonl   the PAQ entry of every row, in row order
+        offsets.npy     byte offset of every row in entries.jsonl (size + 1 values)
+        ids.json        PAQ ids in row order
+        tombstones.npy  rows deleted since the store was built (optional)
+        meta.json       dtype, dimension, size and embedder name
+
+    Opening a store only maps files; pages are loaded on demand and shared through the OS page cache.
+    The store is append-only: `append` adds rows and `delete` tombstones them.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self._entries_fd = None
+        self._open()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def _open(self):
+        with open(self._path("meta.json"), "r") as f:
+            meta = json.load(f)
+        self.embedder_name = meta["embedder"]
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        self.size = meta["size"]
+
+        self.vectors = np.memmap(self._path("embeddings.bin"), dtype=_DTYPES[self.dtype], mode="r",
+                                 shape=(self.size, self.dim)) if self.size else np.empty((0, self.dim), _DTYPES[self.dtype])
+        self.offsets = np.load(self._path("offsets.npy"), mmap_mode="r")
+        if os.path.exists(self._path("tombstones.npy")):
+            self.deleted = np.load(self._path("tombstones.npy"))
+        else:
+            self.deleted = np.empty(0, dtype=np.int64)
+
+        if self._entries_fd is not None:
+            os.close(self._entries_fd)
+        self._entries_fd = os.open(self._path("entries.jsonl"), os.O_RDONLY)
+        self._ids, self._rows = None, None
+
+    def __len__(self):
+        return self.size
+
+    def __del__(self):
+        if getattr(self, "_entries_fd", None) is not None:
+            os.close(self._entries_fd)
+
+    @classmethod
+    def create(cls, store_dir: str, entries: list[dict], vectors: np.ndarray, embedder_name: str,
+               dtype: str = "float32") -> "EmbeddingStore":
+        """
+        Write `entries` and their embedding rows to `store_dir` and open the result.
+        """
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}; expected one of {list(_DTYPES)}")
+        if len(entries) != len(vectors):
+            raise ValueError(f"Got {len(entries)} entries but {len(vectors)} embeddings")
+
+        os.makedirs(store_dir, exist_ok=True)
+        np.ascontiguousarray(vectors, dtype=_DTYPES[dtype]).tofile(os.path.join(store_dir, "embeddings.bin"))
+
+        offsets = [0]
+        with open(os.path.join(store_dir, "entries.jsonl"), "wb") as f:
+            for entry in entries:
+                f.write(json.dumps(entry).encode("utf-8") + b"\n")
+                offsets.append(f.tell())
+        np.save(os.path.join(store_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        if os.path.exists(os.path.join(store_dir, "tombstones.npy")):
+            os.remove(os.path.join(store_dir, "tombstones.npy"))
+
+        with open(os.path.join(store_dir, "ids.json"), "w") as f:
+            json.dump([entry["id"] for entry in entries], f)
+        with open(os.path.join(store_dir, "meta.json"), "w") as f:
+            json.dump({"embedder": embedder_name, "dtype": dtype, "dim": int(vectors.shape[1]),
+                       "size": len(entries)}, f, indent=4)
+        return cls(store_dir)
+
+    def append(self, entries: list[dict], vectors: np.ndarray):
+        """
+        Append rows and re-map the store. meta.json is written last, so rows left behind by an
+        interrupted append are truncated away by the next one.
+        """
+        if len(entries) != len(vectors):
+            raise ValueError(f"Got {len(entries)} entries but {len(vectors)} embeddings")
+        itemsize = np.dtype(_DTYPES[self.dtype]).itemsize
+        end_offset = int(self.offsets[-1])
+
+        with open(self._path("embeddings.bin"), "ab") as f:
+            f.truncate(self.size * self.dim * itemsize)
+            np.ascontiguousarray(vectors, dtype=_DTYPES[self.dtype]).tofile(f)
+
+        offsets = [end_offset]
+        with open(self._path("entries.jsonl"), "ab") as f:
+            f.truncate(end_offset)
+            for entry in entries:
+                line = json.dumps(entry).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        # replace instead of overwrite: the current offsets are memory-mapped
+        with open(self._path("offsets.npy.tmp"), "wb") as f:
+            np.save(f, np.concatenate([np.asarray(self.offsets), np.array(offsets[1:], dtype=np.int64)]))
+        os.replace(self._path("offsets.npy.tmp"), self._path("offsets.npy"))
+
+        ids = list(self.ids) + [entry["id"] for entry in entries]
+        with open(self._path("ids.json"), "w") as f:
+            json.dump(ids, f)
+        with open(self._path("meta.json"), "w") as f:
+            json.dump({"embedder": self.embedder_name, "dtype": self.dtype, "dim": self.dim,
+                       "size": self.size + len(entries)}, f, indent=4)
+        self._open()
+
+    def delete(self, rows):
+        """
+        Tombstone rows. Their data stays in place; searches skip them.
+        """
+        self.deleted = np.union1d(self.deleted, np.asarray(list(rows), dtype=np.int64))
+        np.save(self._path("tombstones.npy"), self.deleted)
+
+    @property
+    def ids(self) -> list:
+        # the id table is only parsed when lookups by id are needed
+        if self._ids is None:
+            with open(self._path("ids.json"), "r") as f:
+                self._ids = json.load(f)
+        return self._ids
+
+    def rows_of(self, entry_id) -> list[int]:
+        """
+        All rows holding a PAQ id. PAQ ids are not unique across regenerated chunks.
+        """
+        if self._rows is None:
+            self._rows = dict()
+            for row, row_id in enumerate(self.ids):
+                self._rows.setdefault(row_id, []).append(row)
+        return self._rows.get(entry_id, [])
+
+    def row_of(self, entry_id) -> int:
+        """
+        First row of a PAQ id.
+        """
+        rows = self.rows_of(entry_id)
+        if not rows:
+            raise KeyError(entry_id)
+        return rows[0]
+
+    def entry(self, row: int) -> dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(os.pread(self._entries_fd, end - start, start))
+
+    def vector(self, entry_id) -> np.ndarray:
+        return np.asarray(self.vectors[self.row_of(entry_id)], dtype=np.float32)
@@ -0,0 +1,16 @@
+PUNCTUATIONS = "`~!@#$%^&*()_+[]\\;',./{}|:\"<>?"
+_PUNCTUATION_BYTES = PUNCTUATIONS.encode("ascii")
+
+
+def normalize_text(doc: str) -> list[str]:
+    """
+    Lower-case, strip punctuation and split on whitespace. Shared by the BM25 retriever and the PAQ exact-match table.
+    """
+    # one bytes.translate pass deletes the same characters as replacing them one punctuation at a time: they are
+    # all ASCII, and ASCII bytes never occur inside a multi-byte UTF-8 sequence
+    d = doc.lower().encode("utf-8", "surrogatepass").translate(None, _PUNCTUATION_BYTES)
+    return d.decode("utf-8", "surrogatepass").split()
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(normalize_text(question))
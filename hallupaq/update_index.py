@@ -0,0 +1,52 @@
+import argparse
+import os
+import time
+import jsonlines
+from .embedder import Embedder
+from .exact_match import ExactMatchTable
+from .incremental import read_jsonl_tail, load_checkpoint, save_checkpoint
+from .paq_index import PAQIndex
+from .quantization import QUANTIZERS, QuantizedIndex
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Bring a PAQ index up to date with its growing source JSONL without a rebuild.")
+    parser.add_argument("index_dir", help="Directory of an index built by hallupaq.build_index.")
+    parser.add_argument("--source_jsonl", required=False,
+                        help="JSONL appended to by qa_generation; defaults to the file the index was built from.")
+    parser.add_argument("--tombstone_jsonl", required=False,
+                        help="Entries to delete, e.g. the --removed_file written by qa_generation/dedup.py.")
+    parser.add_argument("--batch_size", default=64, type=int, help="Embedding batch size.")
+    args = parser.parse_args()
+
+    checkpoint = load_checkpoint(args.index_dir)
+    source = args.source_jsonl or checkpoint["source"]
+    if os.path.abspath(source) != checkpoint["source"]:
+        raise ValueError(f"Index tracks {checkpoint['source']}, not {source}")
+
+    start = time.time()
+    paq_index = PAQIndex.load(args.index_dir)
+    new_entries, offset = read_jsonl_tail(source, checkpoint["offset"])
+    n_inserted = paq_index.insert(new_entries, Embedder(paq_index.embedder_name), batch_size=args.batch_size) \
+        if new_entries else 0
+
+    n_deleted = 0
+    if args.tombstone_jsonl:
+        with jsonlines.open(args.tombstone_jsonl, "r") as reader:
+            n_deleted = paq_index.delete(list(reader))
+
+    paq_index.save()
+    # keep any compressed codes in sync with the store
+    for codec in QUANTIZERS:
+        if os.path.exists(os.path.join(args.index_dir, f"{codec}_codes.npy")):
+            quantized = QuantizedIndex.load(args.index_dir, codec, paq_index.store.vectors)
+            quantized.extend(paq_index.store.vectors)
+            quantized.save(args.index_dir)
+    if ExactMatchTable.exists(args.index_dir):
+        exact_match = ExactMatchTable.load(args.index_dir, paq_index.store)
+        exact_match.extend()
+        exact_match.save(args.index_dir)
+    save_checkpoint(args.index_dir, source, offset)
+
+    print(f"Inserted {n_inserted} and deleted {n_deleted} entries in {time.time() - start:.1f}s; "
+          f"index holds {len(paq_index) - len(paq_index.store.deleted)} live entries")
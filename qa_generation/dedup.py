@@ -6,20 +6,26 @@ if __name__ == '__main__':
     parser.add_argument('input_file', help="JSONL file containing duplicate entries.")
     parser.add_argument('output_file', help="JSONL after deduplication.")
     parser.add_argument('--verbose', help="Verbose mode switch", action="store_true")
+    parser.add_argument('--removed_file', required=False, help="JSONL to write the dropped duplicates to, e.g. as tombstones for hallupaq.update_index.")
     args = parser.parse_args()
 
     entries = dict()
+    removed_entries = []
     org_entry_counter = 0
     with jsonlines.open(args.input_file, mode="r") as reader:
         for entry in reader:
             org_entry_counter += 1
             if entry['question'] in entries:
                 if args.verbose: print(f"Duplicate question: {entry['question']}")
+                removed_entries.append(entry)
                 continue
             entries[entry['question']] = entry
 
     with jsonlines.open(args.output_file, mode="w") as writer:
         writer.write_all(list(entries.values()))
+    if args.removed_file:
+        with jsonlines.open(args.removed_file, mode="w") as writer:
+            writer.write_all(removed_entries)
 
     if args.verbose:
         print(f"Original file contains {org_entry_counter} entries.")
@@ -4,6 +4,8 @@ import json
 import time
 from openai_config import OpenAIConfig
 import os
+import queue
+import threading
 from tqdm import tqdm
 import pandas as pd
 
@@ -199,12 +201,15 @@ class QAPairsGenerator:
 
         return qa_pairs
     
-    def generate_qa_pairs_from_chunks(self, chunks: list[str], output_file: str, n_worker: int = 128) -> None:
+    def generate_qa_pairs_from_chunks(self, chunks: list[str], output_file: str, n_worker: int = 128,
+                                      max_pending: int = None) -> None:
         """
         Generate QA pairs from the list of chunks of text.
+        `n_worker` chunks are in flight at all times: the next chunk starts as soon as any one finishes, so a
+        slow request does not hold up the others. A single writer thread writes the QA pairs in chunk order,
+        so resuming after the latest written id never skips an unfinished chunk; reading new chunks pauses
+        while `max_pending` (default 4 x n_worker) chunks are started but not yet written.
         """
-        executor = ThreadPoolExecutor(max_workers=n_worker)
-
         # create dir if not exists
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         id = _fetch_lastest_id(output_file)
@@ -214,30 +219,49 @@ class QAPairsGenerator:
             index = df.index[df['id'] == id].tolist()[0]
             # Update chunks
             chunks = chunks[index:]
+
+        def task(entry):
+            id, chunk = entry
+            try:
+                return self.generate_qa_pairs(id, chunk)
+            except Exception as e:  # just ignore error
+                print(e)
+                return []
+
+        pending = threading.Semaphore(max_pending or 4 * n_worker)
+        ordered = queue.Queue()
+        progress = tqdm(total=len(chunks), desc="Chunks")
+
         # Continue to modify the output file
         with open(output_file, 'a', encoding='utf-8') as f:
-            for i in tqdm(range(0, len(chunks), n_worker)):
-                # start_time = time.time()
-                print(f"Processing batch {i // n_worker} out of {len(chunks) // n_worker}")
-                batch = chunks[i: i + n_worker]
-
-                def task(entry):
-                    id, chunk = entry
+            def writer():
+                # the only thread writing to f
+                while True:
+                    future = ordered.get()
+                    if future is None:
+                        return
                     try:
-                        qa_pairs = self.generate_qa_pairs(id, chunk)
-                    except Exception as e:  # just ignore error
+                        for qa_pair in future.result():
+                            f.write(json.dumps(qa_pair) + "\n")
+                        f.flush()
+                    except Exception as e:
                         print(e)
-                        return
-
-                    for qa_pair in qa_pairs:
-                        f.write(json.dumps(qa_pair) + "\n")
-
-                results = executor.map(task, batch)  # submit the job in a detached manner
-                for result in results:  # wait for the current batch to finish before next batch
-                    pass
-
-                # end_time = time.time()
-                # print("Time taken: ", end_time - start_time)
+                    finally:
+                        pending.release()
+
+            writer_thread = threading.Thread(target=writer, name="qa-writer")
+            writer_thread.start()
+            try:
+                with ThreadPoolExecutor(max_workers=n_worker) as executor:
+                    for entry in chunks:
+                        pending.acquire()
+                        future = executor.submit(task, entry)
+                        future.add_done_callback(lambda _: progress.update(1))  # counts completed chunks
+                        ordered.put(future)
+            finally:
+                ordered.put(None)
+                writer_thread.join()
+                progress.close()
 
 if __name__ == "__main__":
     qag = QAPairsGenerator(num_qa=2, q_model="gpt-3.5-turbo", a_model="gpt-4-turbo")
@@ -6,7 +6,16 @@ from concurrent.futures import ThreadPoolExecutor
 
 _counter = 0
 
-def paraphrase_questions(input_file, output_file, api_key, n_thread: int = 10):
+
+def _chat_completion(generation_cache, client, **kwargs) -> str:
+    if generation_cache is None:
+        return client.chat.completions.create(**kwargs).choices[0].message.content
+    # the cache lives in the hallupaq package; run from the repository root with PYTHONPATH=. to use it
+    from hallupaq.generation_cache import cached_chat_completion
+    return cached_chat_completion(generation_cache, client, **kwargs)
+
+
+def paraphrase_questions(input_file, output_file, api_key, n_thread: int = 10, generation_cache=None):
     global _counter
     _counter = 0
     client = OpenAI(api_key=api_key)
@@ -24,15 +33,15 @@ def paraphrase_questions(input_file, output_file, api_key, n_thread: int = 10):
                 if original_question:
                     try:
                         # Request the OpenAI API to paraphrase the question
-                        response = client.chat.completions.create(
+                        paraphrased_question = _chat_completion(
+                            generation_cache, client,
                             model="gpt-3.5-turbo",
                             messages=[
                                 {"role": "system", "content": "You are a helpful assistant who can paraphrase a sentence given to you. Please paraphrase this question such that it is different from the original."},
                                 {"role": "user", "content": original_question}
                             ],
                             max_tokens=100
-                        )
-                        paraphrased_question = response.choices[0].message.content.strip()
+                        ).strip()
                     except Exception as e:
                         print(f"Error processing question: {original_question}")
                         print(e)
@@ -57,10 +66,23 @@ def main():
     parser = argparse.ArgumentParser(description='Paraphrase subset of training data questions to become the covered subset of testing/validation set.')
     parser.add_argument('input_path', type=str, help='Path to input JSONL file (training subset)')
     parser.add_argument('output_path', type=str, help='Path to output JSONL file (test/validation covered subset)')
+    parser.add_argument('--generation_cache', type=str, help='SQLite file caching paraphrases by request (needs PYTHONPATH=. from the repository root)')
+    # same choices as GenerationCache.MODES, listed here since hallupaq is only imported when a cache is used
+    parser.add_argument('--generation_cache_mode', type=str, default='readwrite', choices=['readwrite', 'readonly', 'replay'],
+                        help='readonly: do not store new paraphrases; replay: also fail on paraphrases that are not cached')
+    parser.add_argument('--generation_cache_mb', type=int, default=1024, help='Size of the generation cache before eviction, in MB')
     args = parser.parse_args()
 
+    generation_cache = None
+    if args.generation_cache:
+        from hallupaq.generation_cache import GenerationCache
+        generation_cache = GenerationCache(args.generation_cache, args.generation_cache_mode,
+                                           max_bytes=args.generation_cache_mb << 20)
+
     # Run the paraphrasing function
-    paraphrase_questions(args.input_path, args.output_path, OpenAIConfig.PROXY_API_KEY)
+    paraphrase_questions(args.input_path, args.output_path, OpenAIConfig.PROXY_API_KEY, generation_cache=generation_cache)
+    if generation_cache is not None:
+        print(f"Generation cache: {generation_cache.stats()}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,30 @@
+import zlib
+import numpy as np
+from hallupaq.paq_index import PAQIndex
+
+
+class _HashEmbedder:
+    name = "hash"
+
+    def embed(self, texts, batch_size=64):
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode())).standard_normal(8).astype(np.float32)
+                         for text in texts])
+
+
+def test_delete_is_idempotent(tmp_path):
+    entries = [{"id": "a", "question": "q1"}, {"id": "a", "question": "q1"}, {"id": "a", "question": "q1"},
+               {"id": "b", "question": "q2"}]
+    index = PAQIndex.build(entries, _HashEmbedder(), str(tmp_path / "paq"))
+    removed = [{"id": "a", "question": "q1"}]
+
+    assert index.delete(removed) == 1
+    assert index.delete(removed) == 0
+    assert index.store.deleted.tolist() == [2]
+
+    # a cumulative removed file only deletes the entries added to it since
+    assert index.delete(removed + [{"id": "a", "question": "q1"}]) == 1
+    assert index.delete(removed * 2) == 0
+    assert sorted(index.store.deleted.tolist()) == [1, 2]
+
+    reloaded = PAQIndex.load(str(tmp_path / "paq"), exact=True)
+    assert reloaded.delete(removed * 2) == 0
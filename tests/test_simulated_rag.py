@@ -0,0 +1,50 @@
+import json
+import pytest
+
+pytest.importorskip("sagemaker")
+pytest.importorskip("boto3")
+from analysis_scripts.simulated_rag import completed_lines, restore_input_order
+
+# ids repeat in the PAQ splits: the two "a" rows are different questions
+INPUT = [{"id": "a", "question": "q1"}, {"id": "b", "question": "q2"}, {"id": "a", "question": "q3"},
+         {"id": "c", "question": "q4"}]
+
+
+def _write_output(path, checkpoint, input_lines):
+    records = []
+    with open(path, "w") as f:
+        f.write("null\n")
+        for input_line in input_lines:
+            f.write(json.dumps({**INPUT[input_line], "input_line": input_line}) + "\n")
+            records.append({"input_line": input_line, "id": INPUT[input_line]["id"], "offset": f.tell()})
+    with open(checkpoint, "w") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+
+
+def _read_output(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_tracks_repeated_ids_by_input_line(tmp_path):
+    output, checkpoint = str(tmp_path / "out.jsonl"), str(tmp_path / "out.ckpt")
+    _write_output(output, checkpoint, [0])
+
+    # only the first "a" is done; the second one is a different question and must be generated
+    assert completed_lines(output, checkpoint) == {0}
+    assert completed_lines(output) == {0}
+
+
+def test_restore_input_order_keeps_repeated_ids_apart(tmp_path):
+    output, checkpoint = str(tmp_path / "out.jsonl"), str(tmp_path / "out.ckpt")
+    # entries 2 and 1 were retried and appended after the others
+    _write_output(output, checkpoint, [0, 3, 2, 1])
+
+    assert restore_input_order(output, checkpoint)
+    entries = _read_output(output)
+    assert entries[0] is None
+    assert [entry["question"] for entry in entries[1:]] == ["q1", "q2", "q3", "q4"]
+    assert completed_lines(output, checkpoint) == {0, 1, 2, 3}
+    assert _read_output(output) == entries  # the regenerated checkpoint covers the whole output
+
+    assert not restore_input_order(output, checkpoint)